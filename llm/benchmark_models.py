@@ -0,0 +1,232 @@
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import time
+import logging
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from langchain_core.prompts import ChatPromptTemplate
+from prompt.prompts import BENCHMARK_CONFIG, DATASET_CONFIG, get_system_prompt
+from utils.llm_utils import get_llm_model, warm_up_llm, release_llm_model, is_mock_model
+from utils.sql_utils import canonicalize_sql, extract_sql_statement
+from utils.validation_utils import validate_sql
+
+# === LOGGER SETUP ===
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+INPUT_DIR = os.path.join(ROOT_DIR, "query", "input")
+OUTPUT_ROOT = os.path.join(ROOT_DIR, "query", "output")
+
+# === LOAD QUESTIONS AND GOLD SQL ===
+def load_questions(dataset: str) -> list:
+    with open(os.path.join(INPUT_DIR, f"{dataset}.json"), encoding="utf-8") as f:
+        return json.load(f)["user_queries"]
+
+def load_gold_sql(dataset: str, idx: int):
+    for path in sorted(glob.glob(os.path.join(OUTPUT_ROOT, "*", dataset, "gold_sql", f"question_{idx}.json"))):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("query")
+    return None
+
+# Same prompt as llm/slm_query.py: full schema, "date, index info" questions reordered
+def build_prompt(table_name: str, question: str) -> str:
+    if ',' in question:
+        date, index_info = question.split(',', 1)
+        question = f"{index_info.strip()} on {date.strip()}"
+    return ChatPromptTemplate.from_messages([
+        ("system", get_system_prompt(table_name=table_name)),
+        ("human", "{question}")
+    ]).format_prompt(question=question).to_string()
+
+# === TIMED GENERATION ===
+# Streamed, so time-to-first-token is measured on the client exactly as main.py sees it.
+# Ollama streams one token per chunk (plus an empty final chunk), so chunks count tokens.
+def timed_generation(llm, prompt: str) -> dict:
+    chunks = []
+    first_token_time = None
+    start_time = time.perf_counter()
+    for chunk in llm.stream(prompt):
+        chunk = chunk if isinstance(chunk, str) else str(chunk)
+        if not chunk:
+            continue
+        if first_token_time is None:
+            first_token_time = time.perf_counter() - start_time
+        chunks.append(chunk)
+    latency = time.perf_counter() - start_time
+    tokens = len(chunks)
+    decode_time = latency - (first_token_time or 0)
+    return {
+        "latency": latency,
+        "ttft": first_token_time if first_token_time is not None else latency,
+        "tokens": tokens,
+        "tokens_per_sec": (tokens - 1) / decode_time if tokens > 1 and decode_time > 0 else None,
+        "text": ''.join(chunks)
+    }
+
+# === STATISTICS ===
+def percentile(values: list, q: float):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def _round(value, digits: int = 4):
+    return round(value, digits) if value is not None else None
+
+def _mean(values: list):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+def summarize(records: list) -> dict:
+    trials = [trial for record in records for trial in record["trials"]]
+    latencies = [trial["latency"] for trial in trials]
+    ttfts = [trial["ttft"] for trial in trials]
+    matches = [record["exact_match"] for record in records if record.get("exact_match") is not None]
+    summary = {"questions": len(records), "trials": len(trials)}
+    for name, values in (("latency", latencies), ("ttft", ttfts)):
+        for q in (50, 95, 99):
+            summary[f"{name}_p{q}"] = _round(percentile(values, q))
+    summary["latency_mean"] = _round(_mean(latencies))
+    summary["tokens_per_sec"] = _round(_mean([trial["tokens_per_sec"] for trial in trials]), 2)
+    summary["avg_output_tokens"] = _round(_mean([trial["tokens"] for trial in trials]), 1)
+    summary["valid_sql_rate"] = _round(_mean([record["valid_sql"] for record in records]))
+    summary["exact_match_rate"] = _round(sum(matches) / len(matches)) if matches else None
+    return summary
+
+# === SAVE OUTPUT ===
+# Same layout and fields as llm/slm_query.py, so a run reproduces query/output/<model>/.
+# Mock runs go to mock-<model>/ and never overwrite a real model's stored predictions.
+def output_model_dir(model: str) -> str:
+    return model.replace(':', '-', 1) if is_mock_model(model) else model
+
+def save_sql(output_root: str, model: str, dataset: str, idx: int, question: str, query: str, gen_time: float):
+    output_dir = os.path.join(output_root, output_model_dir(model), dataset, "pred_sql")
+    os.makedirs(output_dir, exist_ok=True)
+    output = {"question": question, "query": query.replace('\n', ' ').replace('\r', ' ').strip(), "generation_time": round(gen_time, 4)}
+    with open(os.path.join(output_dir, f"question_{idx}.json"), "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=4)
+
+# === BENCHMARK ===
+def benchmark_model(model: str, datasets: list, trials: int, warm_up_runs: int, limit: int = None, output_root: str = None) -> dict:
+    llm = get_llm_model(model)
+    if llm is None:
+        return {"error": "model could not be initialized", "datasets": {}}
+    load_start = time.perf_counter()
+    warm_up_llm(model)
+    load_time = time.perf_counter() - load_start
+
+    result = {"load_time": round(load_time, 4), "datasets": {}}
+    for dataset in datasets:
+        table_name = DATASET_CONFIG['tables'][dataset]
+        questions = load_questions(dataset)[:limit]
+        for _ in range(warm_up_runs):
+            timed_generation(llm, build_prompt(table_name, questions[0]))
+
+        records = []
+        for idx, question in enumerate(questions, 1):
+            prompt = build_prompt(table_name, question)
+            runs = [timed_generation(llm, prompt) for _ in range(trials)]
+            sql = extract_sql_statement(runs[0]["text"]) or runs[0]["text"].strip()
+            gold_sql = load_gold_sql(dataset, idx)
+            records.append({
+                "idx": idx,
+                "question": question,
+                "query": sql,
+                "valid_sql": validate_sql(runs[0]["text"], table_name)["valid"],
+                "exact_match": canonicalize_sql(sql) == canonicalize_sql(gold_sql) if gold_sql else None,
+                "trials": [{key: _round(value) for key, value in run.items() if key != "text"} for run in runs]
+            })
+            if output_root:
+                save_sql(output_root, model, dataset, idx, question, sql, _mean([run["latency"] for run in runs]))
+            logger.info(f"{model} {dataset} #{idx}: {records[-1]['trials'][0]['latency']}s")
+
+        result["datasets"][dataset] = {"table_name": table_name, "summary": summarize(records), "questions": records}
+    result["summary"] = summarize([record for data in result["datasets"].values() for record in data["questions"]])
+    return result
+
+# Every model over every dataset, one model loaded at a time
+def run_benchmark(models: list, datasets: list, trials: int, warm_up_runs: int, limit: int = None, output_root: str = None) -> dict:
+    report = {"trials": trials, "warm_up_runs": warm_up_runs, "datasets": datasets, "models": {}}
+    for model in models:
+        logger.info(f"Benchmarking {model}")
+        try:
+            report["models"][model] = benchmark_model(model, datasets, trials, warm_up_runs, limit, output_root)
+        except Exception as e:
+            logger.error(f"Benchmark of {model} failed: {str(e)}")
+            report["models"][model] = {"error": str(e), "datasets": {}}
+        finally:
+            release_llm_model(model, unload=not is_mock_model(model))
+    return report
+
+# === COMPARISON REPORT ===
+def _cell(value, suffix: str = "") -> str:
+    return "-" if value is None else f"{value}{suffix}"
+
+def format_report(report: dict) -> str:
+    lines = [
+        "# Model Benchmark",
+        "",
+        f"{report['trials']} trials per question after {report['warm_up_runs']} warm-up run(s); datasets: {', '.join(report['datasets'])}.",
+        "",
+        "| Model | Questions | p50 (s) | p95 (s) | p99 (s) | TTFT p50 (s) | TTFT p95 (s) | Tokens/s | Valid SQL | Exact match |",
+        "| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |"
+    ]
+    ranked = sorted(report["models"].items(), key=lambda item: (item[1].get("summary") or {}).get("latency_p50") or math.inf)
+    for model, result in ranked:
+        summary = result.get("summary")
+        if not summary:
+            lines.append(f"| {model} | failed: {result.get('error', 'no results')} | | | | | | | | |")
+            continue
+        lines.append(
+            f"| {model} | {summary['questions']} | {_cell(summary['latency_p50'])} | {_cell(summary['latency_p95'])} | "
+            f"{_cell(summary['latency_p99'])} | {_cell(summary['ttft_p50'])} | {_cell(summary['ttft_p95'])} | "
+            f"{_cell(summary['tokens_per_sec'])} | {_cell(summary['valid_sql_rate'])} | {_cell(summary['exact_match_rate'])} |"
+        )
+    for dataset in report["datasets"]:
+        lines += ["", f"## {dataset}", "", "| Model | p50 (s) | p95 (s) | TTFT p50 (s) | Tokens/s | Valid SQL | Exact match |",
+                  "| --- | --- | --- | --- | --- | --- | --- |"]
+        for model, result in ranked:
+            summary = result["datasets"].get(dataset, {}).get("summary")
+            if summary:
+                lines.append(
+                    f"| {model} | {_cell(summary['latency_p50'])} | {_cell(summary['latency_p95'])} | {_cell(summary['ttft_p50'])} | "
+                    f"{_cell(summary['tokens_per_sec'])} | {_cell(summary['valid_sql_rate'])} | {_cell(summary['exact_match_rate'])} |"
+                )
+    return "\n".join(lines) + "\n"
+
+# === MAIN PIPELINE ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SQL generation latency and quality across models")
+    parser.add_argument("--models", nargs="+", default=BENCHMARK_CONFIG['models'])
+    parser.add_argument("--datasets", nargs="+", default=list(DATASET_CONFIG['tables']))
+    parser.add_argument("--trials", type=int, default=BENCHMARK_CONFIG['trials'])
+    parser.add_argument("--warm-up", type=int, default=BENCHMARK_CONFIG['warm_up_runs'], help="untimed runs per model and dataset")
+    parser.add_argument("--limit", type=int, default=None, help="questions per dataset (default: all)")
+    parser.add_argument("--mock", action="store_true", help="use the deterministic offline mock LLM for every model")
+    parser.add_argument("--save-sql", metavar="OUTPUT_ROOT", default=None,
+                        help="also write <OUTPUT_ROOT>/<model>/<dataset>/pred_sql/question_<n>.json (e.g. query/output); "
+                             "with --mock, under mock-<model>/")
+    parser.add_argument("--output", default=os.path.join(ROOT_DIR, BENCHMARK_CONFIG['output']))
+    parser.add_argument("--report", default=os.path.join(ROOT_DIR, BENCHMARK_CONFIG['report']))
+    args = parser.parse_args()
+
+    models = [f"mock:{model}" for model in args.models] if args.mock else args.models
+    report = run_benchmark(models, args.datasets, args.trials, args.warm_up, args.limit, args.save_sql)
+    for path in (args.output, args.report):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    with open(args.report, "w", encoding="utf-8") as f:
+        f.write(format_report(report))
+
+    print(format_report(report))
+    logger.info(f"Saved: {args.output} and {args.report}")
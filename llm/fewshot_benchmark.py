@@ -0,0 +1,202 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import logging
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from prompt.prompts import DATASET_CONFIG, FEWSHOT_CONFIG, get_system_prompt
+from utils.example_utils import load_gold_examples, select_examples, example_messages, estimate_tokens
+from utils.llm_utils import get_llm_model, warm_up_llm, release_llm_model, is_mock_model
+from utils.sql_utils import canonicalize_sql, extract_sql_statement
+from utils.validation_utils import validate_sql
+
+# === LOGGER SETUP ===
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+# Speed/accuracy of SQL generation with 0..k retrieved examples per model. Every question
+# with gold SQL is asked with examples retrieved from the other gold pairs (leave-one-out),
+# so a question never sees its own answer.
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Same prompt as utils/agent.py: full schema, examples as earlier turns, "date, index info" reordered
+def build_prompt(table_name: str, question: str, examples: list) -> str:
+    if ',' in question:
+        date, index_info = question.split(',', 1)
+        question = f"{index_info.strip()} on {date.strip()}"
+    return ChatPromptTemplate.from_messages([
+        ("system", get_system_prompt(table_name=table_name)),
+        MessagesPlaceholder("examples", optional=True),
+        ("human", "{question}")
+    ]).format_prompt(examples=example_messages(examples), question=question).to_string()
+
+def generate(llm, prompt: str) -> dict:
+    start_time = time.perf_counter()
+    result = llm.generate([prompt])
+    latency = time.perf_counter() - start_time
+    generation = result.generations[0][0]
+    info = generation.generation_info or {}
+    return {
+        "latency": latency,
+        "prompt_tokens": info.get("prompt_eval_count") or estimate_tokens(prompt),
+        "completion_tokens": info.get("eval_count"),
+        "text": generation.text
+    }
+
+# Rows of a query as a sorted list, or None when it cannot be run
+def execute(sql: str, table_name: str):
+    from utils.db_utils import run_query
+    result = run_query(sql, table_name)
+    if result.get("error"):
+        return None
+    return sorted((tuple(str(value) for value in row) for row in result.get("data") or []))
+
+# === STATISTICS ===
+def percentile(values: list, q: float):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def _round(value, digits: int = 4):
+    return round(value, digits) if value is not None else None
+
+def _rate(values: list):
+    values = [v for v in values if v is not None]
+    return _round(sum(values) / len(values)) if values else None
+
+def _mean(values: list):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+def summarize(records: list) -> dict:
+    latencies = [record["latency"] for record in records]
+    return {
+        "questions": len(records),
+        "latency_p50": _round(percentile(latencies, 50)),
+        "latency_p95": _round(percentile(latencies, 95)),
+        "latency_mean": _round(_mean(latencies)),
+        "prompt_tokens": _round(_mean([record["prompt_tokens"] for record in records]), 1),
+        "examples": _round(_mean([record["examples"] for record in records]), 2),
+        "retrieval_us": _round(_mean([record["retrieval_us"] for record in records]), 1),
+        "valid_sql_rate": _rate([record["valid_sql"] for record in records]),
+        "exact_match_rate": _rate([record["exact_match"] for record in records]),
+        "execution_match_rate": _rate([record["execution_match"] for record in records])
+    }
+
+# === BENCHMARK ===
+def benchmark_model(model: str, corpus: dict, k_values: list, limit: int = None, run_sql: bool = False) -> dict:
+    llm = get_llm_model(model)
+    if llm is None:
+        return {"error": "model could not be initialized", "k": {}}
+    warm_up_llm(model)
+
+    result = {"k": {}}
+    for k in k_values:
+        records = []
+        for table_name, examples in corpus.items():
+            for example in examples[:limit]:
+                question, gold_sql = example["question"], example["query"]
+                start_time = time.perf_counter()
+                shots = select_examples(question, table_name, k=k, exclude=(question,)) if k else []
+                retrieval_time = time.perf_counter() - start_time
+                run = generate(llm, build_prompt(table_name, question, shots))
+                sql = extract_sql_statement(run["text"]) or run["text"].strip()
+                record = {
+                    "table_name": table_name,
+                    "question": question,
+                    "query": sql,
+                    "examples": len(shots),
+                    "retrieval_us": round(retrieval_time * 1e6, 1),
+                    "latency": _round(run["latency"]),
+                    "prompt_tokens": run["prompt_tokens"],
+                    "completion_tokens": run["completion_tokens"],
+                    "valid_sql": validate_sql(run["text"], table_name)["valid"],
+                    "exact_match": canonicalize_sql(sql) == canonicalize_sql(gold_sql),
+                    "execution_match": None
+                }
+                if run_sql:
+                    gold_rows = execute(gold_sql, table_name)
+                    if gold_rows is not None:
+                        record["execution_match"] = execute(sql, table_name) == gold_rows
+                records.append(record)
+        result["k"][str(k)] = {"summary": summarize(records), "questions": records}
+        logger.info(f"{model} k={k}: {result['k'][str(k)]['summary']}")
+    return result
+
+def run_benchmark(models: list, datasets: list, k_values: list, limit: int = None, run_sql: bool = False) -> dict:
+    tables = {DATASET_CONFIG['tables'][dataset] for dataset in datasets}
+    corpus = {table_name: examples for table_name, examples in load_gold_examples().items() if table_name in tables}
+    if not corpus:
+        logger.warning(f"No gold SQL found for {', '.join(datasets)}")
+    report = {"k_values": k_values, "tables": sorted(corpus), "questions": sum(len(examples[:limit]) for examples in corpus.values()), "models": {}}
+    for model in models:
+        logger.info(f"Benchmarking {model}")
+        try:
+            report["models"][model] = benchmark_model(model, corpus, k_values, limit, run_sql)
+        except Exception as e:
+            logger.error(f"Benchmark of {model} failed: {str(e)}")
+            report["models"][model] = {"error": str(e), "k": {}}
+        finally:
+            release_llm_model(model, unload=not is_mock_model(model))
+    return report
+
+# === COMPARISON REPORT ===
+def _cell(value) -> str:
+    return "-" if value is None else f"{value}"
+
+def format_report(report: dict) -> str:
+    lines = [
+        "# Few-shot Benchmark",
+        "",
+        f"{report['questions']} gold questions ({', '.join(report['tables']) or 'none'}), examples retrieved leave-one-out; "
+        f"k examples at most, within {FEWSHOT_CONFIG['max_tokens']} estimated tokens.",
+        "",
+        "| Model | k | Examples | Prompt tokens | p50 (s) | p95 (s) | Valid SQL | Exact match | Execution match |",
+        "| --- | --- | --- | --- | --- | --- | --- | --- | --- |"
+    ]
+    for model, result in report["models"].items():
+        if not result.get("k"):
+            lines.append(f"| {model} | failed: {result.get('error', 'no results')} | | | | | | | |")
+            continue
+        for k, data in result["k"].items():
+            summary = data["summary"]
+            lines.append(
+                f"| {model} | {k} | {_cell(summary['examples'])} | {_cell(summary['prompt_tokens'])} | {_cell(summary['latency_p50'])} | "
+                f"{_cell(summary['latency_p95'])} | {_cell(summary['valid_sql_rate'])} | {_cell(summary['exact_match_rate'])} | "
+                f"{_cell(summary['execution_match_rate'])} |"
+            )
+    return "\n".join(lines) + "\n"
+
+# === MAIN PIPELINE ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare SQL generation speed and accuracy with retrieved few-shot examples")
+    parser.add_argument("--models", nargs="+", default=FEWSHOT_CONFIG['eval_models'])
+    parser.add_argument("--datasets", nargs="+", default=list(DATASET_CONFIG['tables']))
+    parser.add_argument("--k", nargs="+", type=int, default=FEWSHOT_CONFIG['eval_k'], help="example counts to compare (0 = zero-shot)")
+    parser.add_argument("--limit", type=int, default=None, help="gold questions per table (default: all)")
+    parser.add_argument("--execute", action="store_true", help="also compare result sets against the gold SQL on the database")
+    parser.add_argument("--mock", action="store_true", help="use the deterministic offline mock LLM for every model")
+    parser.add_argument("--output", default=os.path.join(ROOT_DIR, FEWSHOT_CONFIG['output']))
+    parser.add_argument("--report", default=os.path.join(ROOT_DIR, FEWSHOT_CONFIG['report']))
+    args = parser.parse_args()
+
+    models = [f"mock:{model}" for model in args.models] if args.mock else args.models
+    report = run_benchmark(models, args.datasets, args.k, args.limit, args.execute)
+    for path in (args.output, args.report):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    with open(args.report, "w", encoding="utf-8") as f:
+        f.write(format_report(report))
+
+    print(format_report(report))
+    logger.info(f"Saved: {args.output} and {args.report}")
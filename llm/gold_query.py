@@ -8,18 +8,22 @@ import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from utils.batch_utils import run_batch
 from utils.llm_utils import get_groq_llm_model
-from prompt.prompts import GROQ_CONFIG, DATA_FIELDS_MEANING, get_system_prompt
+from utils.routing_utils import route_question, stream_table
+from prompt.prompts import GROQ_CONFIG, DATASET_CONFIG, DATA_FIELDS_MEANING, get_system_prompt
 # === LOGGER SETUP ===
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # === CONFIGURATION ===
-OUTPUT_DIR = os.path.join(
-    os.path.dirname(__file__),
-    "..", "query", "output", "country_income", "gold_sql"
-)
-TABLE_NAME = "country_income"
+OUTPUT_ROOT = os.path.join(os.path.dirname(__file__), "..", "query", "output")
+TABLE_NAME = None  # None routes each question to its table (utils/routing_utils.py)
+
+# query/output/<dataset>/gold_sql of the table a question was answered from
+def get_output_dir(table_name: str) -> str:
+    datasets = {table: dataset for dataset, table in DATASET_CONFIG['tables'].items()}
+    return os.path.join(OUTPUT_ROOT, datasets.get(table_name, table_name), "gold_sql")
 
 # === GET DATA FIELDS MEANING ===
 def get_data_fields_meaning(table_name: str) -> str:
@@ -71,8 +75,23 @@ def sql_gen_node(state: State) -> State:
     state['query'] = sql
     return state
 
+# === TIMED SQL GENERATION STAGE ===
+def timed_sql_gen_node(state: State) -> State:
+    start_time = time.time()
+    state = sql_gen_node(state)
+    state['generation_time'] = time.time() - start_time
+    return state
+
+# === TABLE ROUTING NODE ===
+def table_routing_node(state: State) -> State:
+    if not state.get("table_name"):
+        state["table_name"] = route_question(state["question"], prefer=state.get("preferred_table"))[0]
+        logger.info(f"Routed to {state['table_name']}")
+    return state
+
 # === SAVE OUTPUT ===
-def save_ground_truth(state: State, idx, gen_time=None, output_dir=OUTPUT_DIR):
+def save_ground_truth(state: State, idx, gen_time=None, output_dir=None):
+    output_dir = output_dir or get_output_dir(state["table_name"])
     os.makedirs(output_dir, exist_ok=True)
     output = {
         "question": state["question"],
@@ -127,21 +146,23 @@ if __name__ == "__main__":
         logger.error("No query provided. Please set a valid query in the code.")
         exit()
 
-    for idx, question in enumerate(user_queries, 1):
-        logger.info(f"Processing question {idx}: {question}")
-        try:
-            state: State = {
-                "question": question,
-                "query": "",
-                "table_name": TABLE_NAME
-            }
-            start_time = time.time()
-            state = sql_gen_node(state)
-            end_time = time.time()
-            gen_time = end_time - start_time
-            save_ground_truth(state, idx, gen_time)
-            logger.info(f"Saved: {OUTPUT_DIR}/question_{idx}.json")
-            logger.info(f"Generation time for question {idx}: {gen_time:.2f} seconds")
-            print(f"Generation time for question {idx}: {gen_time:.2f} seconds")
-        except Exception as e:
-            logger.error(f"Error processing question {idx}: {e}")
\ No newline at end of file
+    def handle_result(idx, state):
+        if state.get('error'):
+            return
+        gen_time = state.get('generation_time')
+        save_ground_truth(state, idx, gen_time)
+        logger.info(f"Saved: {get_output_dir(state['table_name'])}/question_{idx}.json")
+        logger.info(f"Generation time for question {idx}: {gen_time:.2f} seconds")
+        print(f"Generation time for question {idx}: {gen_time:.2f} seconds")
+
+    preferred_table = None if TABLE_NAME else stream_table(user_queries)
+    states = [
+        {
+            "question": question,
+            "query": "",
+            "table_name": TABLE_NAME,
+            "preferred_table": preferred_table
+        }
+        for question in user_queries
+    ]
+    run_batch(states, [('table_routing', table_routing_node), ('sql_gen', timed_sql_gen_node)], on_result=handle_result)
\ No newline at end of file
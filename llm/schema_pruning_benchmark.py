@@ -0,0 +1,166 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import logging
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from prompt.prompts import DATA_FIELDS_MEANING, DATASET_CONFIG, SCHEMA_PRUNING_CONFIG, get_system_prompt
+from utils.schema_utils import get_column_index, select_relevant_columns
+from utils.sql_utils import tokenize_sql, canonicalize_sql
+
+# === LOGGER SETUP ===
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# === CONFIGURATION ===
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+INPUT_DIR = os.path.join(ROOT_DIR, "query", "input")
+OUTPUT_ROOT = os.path.join(ROOT_DIR, "query", "output")
+REPORT_PATH = os.path.join(ROOT_DIR, "query", "benchmark", "schema_pruning.json")
+
+# === LOAD QUESTIONS AND GOLD SQL ===
+def load_questions(dataset: str) -> list:
+    with open(os.path.join(INPUT_DIR, f"{dataset}.json"), encoding="utf-8") as f:
+        return json.load(f)["user_queries"]
+
+def load_gold_sql(dataset: str, idx: int):
+    for path in sorted(glob.glob(os.path.join(OUTPUT_ROOT, "*", dataset, "gold_sql", f"question_{idx}.json"))):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("query")
+    return None
+
+def referenced_columns(sql: str, table_name: str) -> set:
+    fields = {field.lower() for field in DATA_FIELDS_MEANING[table_name]['fields']}
+    return {text.lower().strip('"') for kind, text in tokenize_sql(sql) if kind in ('word', 'quoted')} & fields
+
+# Rough token estimate (about 4 characters per token for English and SQL)
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+# === PROMPT PREFIX REUSE ===
+# The SQL prompt as the pipeline builds it, with pruning and few-shot examples both on.
+# Ollama reuses its cached KV state for the part of a prompt shared with the previous one.
+def pipeline_prompt(table_name: str, question: str, columns) -> str:
+    from utils.agent import build_sql_gen_prompt
+    from utils.example_utils import select_examples, example_messages
+    examples = select_examples(question, table_name, exclude=(question,))
+    return build_sql_gen_prompt(table_name, columns).format_prompt(examples=example_messages(examples), question=question).to_string()
+
+# === OPTIONAL LLM TIMING ===
+def generate_sql(llm, table_name: str, question: str, columns):
+    prompt = f"System: {get_system_prompt(table_name, columns)}\nHuman: {question}"
+    start_time = time.time()
+    result = llm.generate([prompt])
+    elapsed = time.time() - start_time
+    generation = result.generations[0][0]
+    info = generation.generation_info or {}
+    sql = generation.text.strip().replace('```sql', '').replace('```', '').strip()
+    prompt_eval = info.get('prompt_eval_duration')
+    return sql, elapsed, prompt_eval / 1e9 if prompt_eval is not None else None
+
+# === BENCHMARK ===
+def run_benchmark(datasets: list, top_k: int, min_fields: int, use_llm: bool) -> dict:
+    llm = None
+    if use_llm:
+        from utils.llm_utils import get_llm_model
+        llm = get_llm_model()
+
+    report = {"top_k": top_k, "min_fields": min_fields, "datasets": {}}
+    for dataset in datasets:
+        table_name = DATASET_CONFIG['tables'][dataset]
+        full_prompt_tokens = estimate_tokens(get_system_prompt(table_name))
+        get_column_index(table_name)  # built once at startup in the pipeline; keep it out of the timings
+        records = []
+        previous_prompt = ""
+        for idx, question in enumerate(load_questions(dataset), 1):
+            start_time = time.perf_counter()
+            columns = select_relevant_columns(question, table_name, top_k=top_k, min_fields=min_fields)
+            selection_time = time.perf_counter() - start_time
+
+            record = {
+                "idx": idx,
+                "question": question,
+                "columns": list(columns) if columns else None,
+                "selection_time_us": round(selection_time * 1e6, 1),
+                "full_prompt_tokens": full_prompt_tokens,
+                "pruned_prompt_tokens": estimate_tokens(get_system_prompt(table_name, columns))
+            }
+            prompt = pipeline_prompt(table_name, question, columns)
+            shared = len(os.path.commonprefix([previous_prompt, prompt]))
+            record["prefix_reuse"] = round(shared / len(prompt), 4)
+            record["prefix_reuse_tokens"] = estimate_tokens(prompt[:shared]) if shared else 0
+            previous_prompt = prompt
+            gold_sql = load_gold_sql(dataset, idx)
+            if gold_sql:
+                gold_columns = referenced_columns(gold_sql, table_name)
+                kept = {c.lower() for c in (columns or DATA_FIELDS_MEANING[table_name]['fields'])}
+                record["gold_column_recall"] = len(gold_columns & kept) / len(gold_columns) if gold_columns else 1.0
+
+            if llm is not None:
+                for mode, mode_columns in (("full", None), ("pruned", columns)):
+                    sql, elapsed, prompt_eval = generate_sql(llm, table_name, question, mode_columns)
+                    record[f"{mode}_generation_time"] = round(elapsed, 4)
+                    record[f"{mode}_prompt_eval_time"] = prompt_eval
+                    if gold_sql:
+                        record[f"{mode}_exact_match"] = canonicalize_sql(sql) == canonicalize_sql(gold_sql)
+            records.append(record)
+
+        report["datasets"][dataset] = {"table_name": table_name, "summary": summarize(records), "questions": records}
+    return report
+
+def _mean(values: list):
+    values = [v for v in values if v is not None]
+    return round(sum(values) / len(values), 4) if values else None
+
+def summarize(records: list) -> dict:
+    summary = {
+        "questions": len(records),
+        "pruned_questions": sum(1 for r in records if r["columns"]),
+        "avg_full_prompt_tokens": _mean([r["full_prompt_tokens"] for r in records]),
+        "avg_pruned_prompt_tokens": _mean([r["pruned_prompt_tokens"] for r in records]),
+        "avg_selection_time_us": _mean([r["selection_time_us"] for r in records]),
+        # The first prompt has nothing before it to share a prefix with
+        "avg_prefix_reuse": _mean([r["prefix_reuse"] for r in records[1:]]),
+        "avg_prefix_reuse_tokens": _mean([r["prefix_reuse_tokens"] for r in records[1:]]),
+        "avg_gold_column_recall": _mean([r.get("gold_column_recall") for r in records])
+    }
+    for mode in ("full", "pruned"):
+        summary[f"avg_{mode}_generation_time"] = _mean([r.get(f"{mode}_generation_time") for r in records])
+        summary[f"avg_{mode}_prompt_eval_time"] = _mean([r.get(f"{mode}_prompt_eval_time") for r in records])
+        matches = [r[f"{mode}_exact_match"] for r in records if f"{mode}_exact_match" in r]
+        summary[f"{mode}_exact_match_rate"] = round(sum(matches) / len(matches), 4) if matches else None
+    return summary
+
+# === MAIN PIPELINE ===
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure prompt size, latency and accuracy effect of schema pruning")
+    parser.add_argument("--datasets", nargs="+", default=list(DATASET_CONFIG['tables']))
+    parser.add_argument("--top-k", type=int, default=SCHEMA_PRUNING_CONFIG['top_k'])
+    parser.add_argument("--min-fields", type=int, default=SCHEMA_PRUNING_CONFIG['min_fields'],
+                        help="prune tables wider than this; 0 prunes every table")
+    parser.add_argument("--llm", action="store_true", help="also time SQL generation with the full and pruned prompts")
+    parser.add_argument("--output", default=REPORT_PATH)
+    args = parser.parse_args()
+
+    report = run_benchmark(args.datasets, args.top_k, args.min_fields, args.llm)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    for dataset, result in report["datasets"].items():
+        summary = result["summary"]
+        print(f"\n=== {dataset} ({result['table_name']}) ===")
+        print(f"Pruned questions: {summary['pruned_questions']}/{summary['questions']}")
+        print(f"Prompt tokens: {summary['avg_full_prompt_tokens']} -> {summary['avg_pruned_prompt_tokens']}")
+        print(f"Column selection: {summary['avg_selection_time_us']} us")
+        print(f"Prompt prefix shared with the previous question: {summary['avg_prefix_reuse']} ({summary['avg_prefix_reuse_tokens']} tokens)")
+        if summary['avg_gold_column_recall'] is not None:
+            print(f"Gold column recall: {summary['avg_gold_column_recall']}")
+        if summary['avg_full_generation_time'] is not None:
+            print(f"Generation time: {summary['avg_full_generation_time']}s -> {summary['avg_pruned_generation_time']}s")
+            print(f"Exact match: {summary['full_exact_match_rate']} -> {summary['pruned_exact_match_rate']}")
+    logger.info(f"Saved: {args.output}")
@@ -1,3 +1,4 @@
+import re
 import sys
 import logging
 import time
@@ -5,13 +6,23 @@ from datetime import datetime
 
 sys.path.append('.')
 
-from utils.db_utils import get_db_connection, check_table_exists
-from utils.agent import sql_gen_node, query_execution_node, response_generation_node, State, save_output_as_json
+from utils.db_utils import borrow_connection, check_table_exists, close_connection_pool, get_pool_stats
+from utils.agent import PIPELINE_STAGES, State, save_output_as_json, response_generation_node
+from utils.batch_utils import run_batch
+from utils.llm_utils import warm_up_llm
+from utils.cache_utils import get_sql_cache_stats, get_result_cache_stats
+from utils.dispatch_utils import get_dispatch_stats
+from utils.trace_utils import stage_durations, export_traces, profile, format_profile
+from utils.routing_utils import stream_table
+from prompt.prompts import OLLAMA_CONFIG, DB_CONFIG, TRACE_CONFIG, DATA_FIELDS_MEANING
 
 # Logging Configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Questions below are numbered "N|question"; the number is not part of the question
+_INDEX_PREFIX_RE = re.compile(r'^\s*\d+\|')
+
 def main():
     user_queries = [
         "1|What is the digital readiness score of South Asia in 2020?",
@@ -47,55 +58,166 @@ def main():
         "31|What is the relationship between unemployment rate and inflation of US through years?"
     ]
 
-    table_name = "world_happiness_report"
-    conn = get_db_connection()
-    if conn is None:
-        logger.error("Please check your PostgreSQL configuration. Exiting...")
-        sys.exit(1)
-    if not check_table_exists(conn, table_name):
-        logger.error(f"Table '{table_name}' does not exist. Please create the table and load the data. Exiting...")
-        conn.close()
-        sys.exit(1)
-    conn.close()
+    # Each question is routed to one of the tables that are actually loaded
+    if DB_CONFIG['backend'] == 'embedded':
+        tables = [table_name for table_name in DATA_FIELDS_MEANING if check_table_exists(None, table_name)]
+        if not tables:
+            logger.error("No table is available in the embedded database (is dataset/ populated?). Exiting...")
+            sys.exit(1)
+    else:
+        with borrow_connection() as conn:
+            if conn is None:
+                logger.error("Please check your PostgreSQL configuration. Exiting...")
+                sys.exit(1)
+            tables = [table_name for table_name in DATA_FIELDS_MEANING if check_table_exists(conn, table_name)]
+            if not tables:
+                logger.error("No table has been loaded. Load them with `python utils/ingest_utils.py`. Exiting...")
+                sys.exit(1)
+    logger.info(f"Routing questions across: {', '.join(tables)}")
 
     if not user_queries:
         logger.error("No query provided. Please set a valid query in the code.")
         return
-    for idx, question in enumerate(user_queries, 1):
-        state = {
+
+    if OLLAMA_CONFIG.get('warm_up'):
+        warm_up_llm()
+    questions = [_INDEX_PREFIX_RE.sub('', question).strip() for question in user_queries]
+    preferred_table = stream_table(questions, tables)
+    states = [
+        {
             'question': question,
-            'table_name': table_name,
+            'candidate_tables': tables,
+            'preferred_table': preferred_table,
             'query': '',
             'query_result': '',
             'final_answer': ''
         }
+        for question in questions
+    ]
+
+    def handle_result(idx, state):
+        if state.get('error'):
+            logger.error(f"An error occurred: {state['error']}")
+            print(f"An error occurred: {state['error']}")
+            return
 
-        try:
-            state = sql_gen_node(state)
-            state = query_execution_node(state)
-            state = response_generation_node(state)
-            total_time = state.get('sql_execution_time', 0)+ state.get('nlp_generation_time')
-
-            output = {
-                "question": state['question'],
-                "query": state['query'],
-                "answer": state['final_answer'],
-                "sql_execution_time": round(state.get('sql_execution_time', 0),2),
-                "nlp_generation_time": round(state.get('nlp_generation_time', 0),2),
-                "total_time":round(total_time,2)
-            }
-            save_output_as_json(output, idx)
-            
-            print("\n=== Results ===")
-            print(f"Query: {state['query']}")
-            print("Raw Results:")
-            print(state['query_result'])
+        stage_times = stage_durations(state)
+        total_time = sum(stage_times.get(stage_name, 0) for stage_name, _ in PIPELINE_STAGES)
+        output = {
+            "question": state['question'],
+            "table_name": state.get('table_name'),
+            "routed_tables": state.get('routed_tables'),
+            "query": state['query'],
+            "answer": state['final_answer'],
+            "sql_generation_time": round(state.get('sql_generation_time', 0),2),
+            "sql_validation_time": round(state.get('sql_validation_time', 0),4),
+            "sql_execution_time": round(state.get('sql_execution_time', 0),2),
+            "nlp_generation_time": round(state.get('nlp_generation_time', 0),2),
+            "nlp_first_token_time": round(state['nlp_first_token_time'],2) if 'nlp_first_token_time' in state else None,
+            "total_time":round(total_time,2),
+            "sql_cache_hit": state.get('sql_cache_hit', False),
+            "sql_template": state.get('sql_template'),
+            "entity_hints": state.get('entity_hints'),
+            "fewshot_examples": [example['question'] for example in state.get('fewshot_examples') or []],
+            "answer_path": state.get('answer_path'),
+            "answer_latency_saved": round(state['answer_latency_saved'],2) if 'answer_latency_saved' in state else None,
+            "rollup_query": state.get('rollup_query'),
+            "sql_valid": state.get('sql_valid'),
+            "sql_repairs": state.get('sql_repairs', []),
+            "sql_repair_attempts": state.get('sql_repair_attempts', 0),
+            "sql_prompt_tokens": state.get('sql_prompt_tokens'),
+            "sql_prompt_eval_time": round(state['sql_prompt_eval_time'],4) if 'sql_prompt_eval_time' in state else None,
+            "sql_completion_tokens": state.get('sql_completion_tokens'),
+            "nlp_prompt_tokens": state.get('nlp_prompt_tokens'),
+            "nlp_completion_tokens": state.get('nlp_completion_tokens'),
+            "trace_id": state.get('trace_id'),
+            "stage_times": stage_times
+        }
+        save_output_as_json(output, idx)
+
+        print("\n=== Results ===")
+        print(f"Query: {state['query']}")
+        print("Raw Results:")
+        print(state['query_result'])
+        if not OLLAMA_CONFIG.get('stream'):
             print("\nFinal Answer:")
             print(state['final_answer'])
 
-        except Exception as e:
-            logger.error(f"An error occurred: {str(e)}")
-            print(f"An error occurred: {str(e)}")
+    # Streamed answers run one question at a time, so they do not interleave
+    def streaming_response_node(state):
+        print(f"\n=== Answer: {state['question']} ===")
+        state = response_generation_node(state, on_token=lambda chunk: print(chunk, end='', flush=True))
+        print()
+        return state
+
+    stages = PIPELINE_STAGES
+    stage_limits = None
+    if OLLAMA_CONFIG.get('stream'):
+        stages = [(name, streaming_response_node if name == 'response_generation' else node) for name, node in PIPELINE_STAGES]
+        stage_limits = {'response_generation': 1}
+    results = run_batch(states, stages, on_result=handle_result, stage_limits=stage_limits)
+
+    logger.info("Stage profile:\n" + format_profile(profile(results)))
+    exported = export_traces(results)
+    if exported:
+        logger.info(f"Exported {exported} spans ({TRACE_CONFIG['export']})")
+
+    prompt_eval_times = [state['sql_prompt_eval_time'] for state in results if 'sql_prompt_eval_time' in state]
+    if prompt_eval_times:
+        logger.info(
+            f"SQL prompt eval: avg {sum(prompt_eval_times) / len(prompt_eval_times):.3f}s over {len(prompt_eval_times)} questions "
+            f"(first {prompt_eval_times[0]:.3f}s, last {prompt_eval_times[-1]:.3f}s)"
+        )
+
+    direct = [state for state in results if state.get('answer_path') in ('template', 'degraded')]
+    if direct:
+        # The saving is only estimated once an LLM answer has been timed
+        saved = [state['answer_latency_saved'] for state in direct if 'answer_latency_saved' in state]
+        logger.info(
+            f"Answered {len(direct)} of {len(results)} questions without the response LLM"
+            + (f", saving about {sum(saved):.1f}s" if saved else "")
+        )
+
+    templated = [state for state in results if state.get('sql_template')]
+    if templated:
+        logger.info(f"Template SQL for {len(templated)} of {len(results)} questions (no SQL-generation LLM call)")
+
+    validated = [state for state in results if 'sql_valid' in state]
+    if validated:
+        logger.info(
+            f"SQL validation: {sum(bool(state['sql_repairs']) for state in validated)} repaired, "
+            f"{sum(state['sql_repair_attempts'] for state in validated)} LLM re-prompts, "
+            f"{sum(not state['sql_valid'] for state in validated)} rejected without running "
+            f"(avg {sum(state['sql_validation_time'] for state in validated) / len(validated) * 1000:.1f} ms)"
+        )
+
+    if DB_CONFIG['backend'] != 'embedded':
+        pool_stats = get_pool_stats()
+        logger.info(
+            f"Connection pool: {pool_stats['checkouts']} checkouts, "
+            f"avg wait {pool_stats['wait_time_avg']*1000:.1f} ms (max {pool_stats['wait_time_max']*1000:.1f} ms), "
+            f"avg checkout {pool_stats['checkout_time_avg']*1000:.1f} ms, "
+            f"{pool_stats['timeouts']} timeouts, {pool_stats['recycled']} recycled"
+        )
+    cache_stats = get_sql_cache_stats()
+    logger.info(
+        f"SQL cache: {cache_stats['exact_hits']} exact hits, {cache_stats['near_hits']} near-duplicate hits, "
+        f"{cache_stats['misses']} misses (hit rate {cache_stats['hit_rate']:.0%})"
+    )
+    dispatch_stats = get_dispatch_stats()
+    if dispatch_stats['requests']:
+        logger.info(
+            f"LLM dispatcher: {dispatch_stats['requests']} requests, {dispatch_stats['coalesced']} coalesced "
+            f"({dispatch_stats['coalesce_rate']:.0%}), {dispatch_stats['batches']} batches "
+            f"(avg size {dispatch_stats['batch_size_avg']:.1f}, max {dispatch_stats['batch_size_max']}), "
+            f"max queue depth {dispatch_stats['queue_depth_max']}, avg queue wait {dispatch_stats['queue_wait_avg']*1000:.1f} ms"
+        )
+    result_stats = get_result_cache_stats()
+    logger.info(
+        f"Result cache: {result_stats['hits'] + result_stats['disk_hits']} hits, {result_stats['misses']} misses, "
+        f"{result_stats['memory_bytes'] / 1024:.1f} KiB in memory"
+    )
+    close_connection_pool()
 
 if __name__ == "__main__":
     main()
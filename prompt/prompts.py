@@ -1,5 +1,6 @@
 import json
 import sys
+from functools import lru_cache
 
 sys.path.append('.')
 
@@ -12,16 +13,251 @@ POSTGRES_CONFIG = {
     'password': 'admin'
 }
 
+# Query Backend Configuration
+DB_CONFIG = {
+    'backend': 'postgres',                  # 'postgres', or 'embedded' to query a local database built from dataset/*.csv
+    'embedded_engine': 'duckdb',            # 'duckdb' (columnar, PostgreSQL dialect) or 'sqlite'; sqlite is used if duckdb is missing
+    'duckdb_path': '.cache/text2sql.duckdb',
+    'sqlite_path': '.cache/text2sql.sqlite'
+}
+
+# Guarded Query Execution Configuration
+EXECUTION_CONFIG = {
+    'statement_timeout_ms': 15000,          # per statement; the whole fetch is held to the same deadline
+    'max_rows': 1000,                       # rows kept from one result; the rest is reported as truncated
+    'max_bytes': 4 * 1024 * 1024,           # approximate size cap on the kept rows
+    'fetch_size': 500,                      # rows per fetchmany round trip
+    'read_only': True                       # run generated SQL in READ ONLY transactions
+}
+
+# Query Result Formatting Configuration (utils/format_utils.py)
+RESULT_FORMAT_CONFIG = {
+    'token_budget': 1500,                   # results larger than this reach the response LLM as statistics plus leading rows
+    'top_values': 5                         # most frequent values listed per text column in a summary
+}
+
+# Tracing Configuration (utils/trace_utils.py)
+TRACE_CONFIG = {
+    'export': 'jsonl',                      # 'jsonl', 'otlp' (OpenTelemetry JSON) or None
+    'jsonl_path': '.cache/traces.jsonl',    # appended to, one span per line
+    'otlp_path': '.cache/traces.otlp.json', # rewritten per run
+    'service_name': 'text2sql'
+}
+
+# Deterministic Answer Configuration (fast path in utils/agent.py)
+FAST_ANSWER_CONFIG = {
+    'enabled': True,
+    'max_rows': 10,                         # larger (or truncated) results are answered by the LLM
+    'max_columns': 4,
+    'analytic_terms': [                     # question words that need the LLM to interpret the data
+        'explain', 'why', 'correlat', 'relation', 'relate', 'compar', 'pattern', 'trend', 'evaluat', 'affect',
+        'impact', 'implication', 'differ', 'extent', 'analy', 'insight', 'describ', 'summar', 'grow', 'change',
+        'cause', 'predict', 'versus', 'vs'
+    ]
+}
+
+# PostgreSQL Connection Pool Configuration
+POOL_CONFIG = {
+    'min_size': 1,                  # connections opened up front; up to max_size idle ones are kept
+    'max_size': 8,
+    'checkout_timeout': 30,         # seconds to wait for a free connection
+    'health_check_interval': 60,    # seconds idle before a connection is pinged on checkout
+    'max_lifetime': 1800            # seconds before a connection is recycled
+}
+
 # Groq Model Configuration
 GROQ_CONFIG = {
     'model': 'llama3-70b-8192',
     'api_key': 'YOUR_API_KEY',  # Replace with your actual Groq API key
+    'endpoint': None,           # None uses the default Groq API URL
 }
 
 # Ollama Model Configuration
 OLLAMA_CONFIG = {
     'model': 'gemma3:12b',
-    'endpoint': 'http://localhost:11434/'
+    'endpoint': 'http://localhost:11434/',
+    'keep_alive': '30m',            # how long Ollama keeps the model loaded between requests
+    'warm_up': True,                # load the model at startup so the first question skips the load time
+    'stream': True                  # stream natural-language answers token by token in main.py
+}
+
+# Mock LLM Configuration: models named 'mock' or 'mock:<name>' answer deterministically offline
+MOCK_LLM_CONFIG = {
+    'prompt_seconds_per_token': 0.00005,    # simulated prompt evaluation time
+    'seconds_per_token': 0.002              # simulated generation time per output token
+}
+
+# Model Benchmark Configuration (llm/benchmark_models.py)
+BENCHMARK_CONFIG = {
+    'models': ['falcon3', 'gemma2', 'gemma3', 'llama3.1', 'llama3.2', 'llamaguard4', 'mistral', 'phi3.5', 'qwen2.5'],
+    'warm_up_runs': 1,              # untimed generations per model before measuring
+    'trials': 3,                    # timed generations per question
+    'output': 'query/benchmark/models.json',
+    'report': 'query/benchmark/models.md'
+}
+
+# Batch Pipeline Configuration
+BATCH_CONFIG = {
+    'max_in_flight': 4,             # questions processed concurrently
+    'async_max_in_flight': 256,     # questions in flight per event loop in answer_many
+    'stage_limits': {               # concurrent calls allowed per pipeline stage
+        'table_routing': 4,         # in-memory lookup, no LLM call
+        'sql_gen': 4,               # LLM calls wait in the dispatcher (DISPATCH_CONFIG), which bounds the backend load
+        'sql_validation': 4,        # local checks are cheap; repairs go through the dispatcher too
+        'query_execution': 4,
+        'response_generation': 4    # main.py runs one at a time when streaming, so answers do not interleave
+    }
+}
+
+# LLM Dispatcher Configuration (utils/dispatch_utils.py)
+DISPATCH_CONFIG = {
+    'enabled': True,                # route non-streamed generations through the dispatcher
+    'coalesce': True,               # identical prompts in flight share one completion
+    'batch_window_ms': 5,           # how long the first queued prompt waits for others to join its batch
+    'max_batch_size': 8,            # prompts taken from the queue per batch
+    'parallel_slots': None,         # generations sent to the backend at once; None uses OLLAMA_NUM_PARALLEL when
+                                    # set, else the sql_gen + response_generation stage limits of BATCH_CONFIG
+    'native_batch': False           # True for backends whose generate() runs a list of prompts as one batch;
+                                    # otherwise each prompt of a batch takes its own slot
+}
+
+# Question -> SQL Cache Configuration
+SQL_CACHE_CONFIG = {
+    'enabled': True,
+    'path': '.cache/sql_cache.sqlite',      # persistent tier; set to None to keep the cache in memory only
+    'max_entries': 10000,
+    'ttl_seconds': 7 * 24 * 3600,
+    'touch_batch': 64,                      # memory-tier hits written to the persistent tier's last_used per batch
+    'near_duplicate': False,                # also serve textually near-identical questions with the same entities
+    'near_duplicate_threshold': 0.9         # minimum trigram Jaccard similarity for a near-duplicate hit
+}
+
+# Executed SQL -> Result Cache Configuration
+RESULT_CACHE_CONFIG = {
+    'enabled': True,
+    'max_bytes': 64 * 1024 * 1024,          # in-memory budget (pickled size of the cached results)
+    'spill_dir': '.cache/results',          # results evicted from memory are written here; None disables spilling
+    'disk_max_bytes': 512 * 1024 * 1024,
+    'version_check_interval': 5             # seconds a table's modification counters are trusted before re-reading
+}
+
+# Dataset Configuration
+DATASET_CONFIG = {
+    'dir': 'dataset',                       # CSV files named <table_name>.csv, relative to the repository root
+    'max_categorical_values': 500,          # text columns with more distinct values are not treated as categorical
+    'tables': {                             # query/input and query/output dataset names -> table names
+        'country_income': 'country_income',
+        'finance_economics': 'finance_economics_dataset',
+        'global_development': 'global_development_indicators',
+        'happiness_record': 'world_happiness_report'
+    }
+}
+
+# CSV Ingestion Configuration (utils/ingest_utils.py)
+INGEST_CONFIG = {
+    'chunk_rows': 50000,                    # rows per COPY batch; bounds memory for large CSVs
+    'index_columns': ['country_name', 'country', 'year', 'date'],
+    'state_table': '_ingest_state'          # remembers what was loaded from each CSV for incremental reloads
+}
+
+# Index Advisor Configuration (utils/index_advisor.py)
+INDEX_ADVISOR_CONFIG = {
+    'log_queries': True,                    # append every query run on PostgreSQL to query_log
+    'query_log': '.cache/query_log.jsonl',
+    'min_frequency': 2,                     # queries that must share a predicate pattern before indexing it
+    'max_index_columns': 3,
+    'partial_min_share': 0.6,               # share of a pattern's queries using the same constant to propose a partial index
+    'min_improvement': 0.2,                 # relative planner-cost reduction required to recommend (or create) an index
+    'trials': 3                             # timed executions per query before and after
+}
+
+# Aggregate Rollup Configuration (utils/rollup_utils.py)
+ROLLUP_CONFIG = {
+    'enabled': True,                        # rewrite matching aggregate SQL onto the rollup tables
+    'rollups': {                            # base table -> grouping column sets, one summary table each
+        'global_development_indicators': [['year', 'region'], ['year', 'income_group']],
+        'country_income': [['year', 'gcam_region_id'], ['year', 'gcam_region_id', 'category']]
+    },
+    'availability_check_interval': 60       # seconds before re-checking that a missing rollup table now exists
+}
+
+# SQL Validation Configuration (utils/validation_utils.py)
+SQL_VALIDATION_CONFIG = {
+    'enabled': True,
+    'max_repair_attempts': 2,               # LLM re-prompts after the local fixes; SQL still invalid then is never executed
+    'max_suggestions': 3                    # close column names listed in the error handed back to the LLM
+}
+
+# Entity Gazetteer Configuration (utils/gazetteer_utils.py)
+GAZETTEER_CONFIG = {
+    'enabled': True,                        # ground entity mentions for the templates and as hints in the SQL prompt
+    'columns': ['country_name', 'country', 'country_code', 'iso', 'region', 'regional_indicator', 'income_group', 'category', 'stock_index'],
+    'query_database': True,                 # tables without a CSV in dataset/ read their distinct values from the database
+    'max_values': 2000,                     # distinct values read per column
+    'fuzzy_cutoff': 0.85,                   # similarity for misspelled mentions ("Vietnan")
+    'max_hints': 3,                         # candidate values listed per mention in the SQL prompt
+    'aliases': {                            # how questions name things -> value in the data (used where that value exists)
+        'us': 'United States', 'usa': 'United States', 'america': 'United States', 'united states of america': 'United States',
+        'uk': 'United Kingdom', 'britain': 'United Kingdom', 'great britain': 'United Kingdom',
+        'viet nam': 'Vietnam', 'south korea': 'Korea', 'russian federation': 'Russia',
+        'europe': 'Europe & Central Asia', 'eu': 'European Union', 'middle east': 'Middle East & North Africa',
+        'latin america': 'Latin America & Caribbean', 'east asia': 'East Asia & Pacific',
+        'indebt': 'Heavily indebted poor countries (HIPC)', 'indebted': 'Heavily indebted poor countries (HIPC)',
+        'heavily indebted': 'Heavily indebted poor countries (HIPC)', 'oecd': 'OECD members',
+        'least developed': 'Least developed countries: UN classification',
+        'dow': 'Dow Jones', 'nasdaq': 'NASDAQ', 's and p': 'S&P 500', 's and p 500': 'S&P 500', 'sp500': 'S&P 500'
+    }
+}
+
+ENTITY_HINT_PROMPT = "Values in {table_name} matching the question: {hints}"
+
+# Question Template Configuration (utils/intent_utils.py)
+INTENT_CONFIG = {
+    'enabled': True,                        # answer common question shapes with template SQL before calling the LLM
+    'metric_cutoff': 0.85,                  # similarity needed between the question's metric wording and a column name
+    'metric_margin': 0.05,                  # lead the best column needs over the next one; otherwise the LLM decides
+    'name_columns': ['country_name', 'country', 'stock_index'],   # columns naming one entity per row, tried first for lookups
+    'country_filters': {                    # rows that are single countries, for "which country"/"top N countries" questions
+        'global_development_indicators': 'region IS NOT NULL'   # regional and income-group aggregates have no region
+    },
+    'max_top_n': 100,
+    'limit': 50
+}
+
+# Table Routing Configuration (utils/routing_utils.py)
+ROUTING_CONFIG = {
+    'enabled': True,                        # pick the table per question when a state has no table_name
+    'default_table': 'global_development_indicators',   # used when no table matches at all
+    'top_columns': 3,                       # a table scores by its best matching columns, so wide tables are not favoured
+    'value_weight': 0.5,                    # weight of a categorical value named in the question (per word) relative to a column-name word
+    'date_weight': 2.0,                     # added for tables with a DATE column when the question names a day
+    'max_value_words': 4,                   # longest categorical value matched as a phrase
+    'ambiguity_ratio': 0.8,                 # runner-up tables scoring at least this share of the best are kept as candidates
+    'tie_ratio': 0.95,                      # candidates this close to the best are ordered by the question words found in their categorical values
+    'stream_share': 0.5,                    # share of a question stream that must route to one table for it to be preferred for the rest
+    'stream_ratio': 0.75                    # the preferred table wins a question when it scores at least this share of the best
+}
+
+# Schema Pruning Configuration
+SCHEMA_PRUNING_CONFIG = {
+    'enabled': True,
+    'min_fields': 20,                       # only tables wider than this are pruned
+    'top_k': 12,                            # relevant columns kept in addition to the key columns
+    'key_columns': ['country_name', 'country', 'country_code', 'year', 'date', 'region', 'income_group', 'stock_index']
+}
+
+# Few-shot Example Configuration (utils/example_utils.py)
+FEWSHOT_CONFIG = {
+    'enabled': True,                        # add the most similar gold question/SQL pairs to the SQL generation prompt
+    'corpus': 'query/output/*/{dataset}/gold_sql/question_*.json',
+    'index_path': '.cache/fewshot_index.json',  # rebuilt when the gold files change
+    'k': 3,                                 # examples per question at most
+    'max_tokens': 300,                      # estimated tokens of all examples together
+    'min_similarity': 0.2,                  # cosine similarity below which an example is not shown
+    'eval_models': ['llama3.2', 'qwen2.5', 'gemma3'],
+    'eval_k': [0, 1, 3, 5],                 # example counts compared by llm/fewshot_benchmark.py
+    'output': 'query/benchmark/fewshot.json',
+    'report': 'query/benchmark/fewshot.md'
 }
 
 # Data Fields Meaning 1
@@ -147,9 +383,14 @@ DATA_FIELDS_MEANING = {
     }
 }
 
-def get_data_fields_from_table(table_name:str):
+@lru_cache(maxsize=None)
+def get_data_fields_from_table(table_name:str, columns: tuple = None):
+    fields = DATA_FIELDS_MEANING[table_name]['fields']
+    if columns:
+        fields = {field: meaning for field, meaning in fields.items() if field in columns}
+
     # Generate json string
-    json_str = json.dumps(DATA_FIELDS_MEANING[table_name]['fields'], indent=2)
+    json_str = json.dumps(fields, indent=2)
     
     # Escape curly braces in JSON for prompt formatting
     data_fields = json_str.replace('{', '{{').replace('}', '}}') 
@@ -162,15 +403,34 @@ Given the query results, provide a clear, concise, and natural language response
 Use the query results to inform your answer and present the information in a user-friendly way.
 """
 
-def get_system_prompt(table_name: str):
-    system_prompt = f"""
+SQL_REPAIR_PROMPT = """
+The SQL query above cannot be run:
+{errors}
+Rewrite it as a single valid PostgreSQL SELECT statement answering the same question.
+ONLY return the SQL query.
+"""
+
+# Memoized per table: the rendered prompt is byte-identical across requests, which keeps
+# the prompt prefix stable so Ollama can reuse its cached KV state for it
+@lru_cache(maxsize=None)
+def get_sql_instructions(table_name: str):
+    return f"""
         You are a SQL expert for PostgreSQL.
         Only generate a valid SQL query for a table named '{table_name}'.
         Your goal is to generate precise SQL query.
         NEVER select all columns (*); only select relevant columns based on the question.
         NEVER answer in natural language. ONLY write SQL for query purposes.
         Limit query results to 50 rows only.
-        The table has the following fields:
-        {get_data_fields_from_table(table_name)}
+"""
+
+# The field list alone; a pruned list changes per question, so the pipeline sends it
+# after the instructions and examples rather than in the system prompt
+@lru_cache(maxsize=None)
+def get_fields_prompt(table_name: str, columns: tuple = None):
+    return f"""        The table has the following fields:
+        {get_data_fields_from_table(table_name, columns)}
     """
-    return system_prompt
+
+@lru_cache(maxsize=None)
+def get_system_prompt(table_name: str, columns: tuple = None):
+    return get_sql_instructions(table_name) + get_fields_prompt(table_name, columns)
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import re
 import os
@@ -5,15 +6,32 @@ import sys
 import time
 from datetime import datetime
 import logging
+import threading
 import traceback
+from functools import lru_cache
 from typing_extensions import TypedDict
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 sys.path.append('.')
 
-from utils.db_utils import run_query, convert_to_markdown_table
+from utils.db_utils import run_query, async_run_query, check_table_exists
+from utils.format_utils import summarize_result, format_value
 from utils.llm_utils import get_llm_model
-from prompt.prompts import NL_RESPONSE_PROMPT, get_system_prompt
+from utils.dispatch_utils import generate, agenerate
+from utils.cache_utils import lookup_cached_sql, store_cached_sql
+from utils.schema_utils import select_relevant_columns
+from utils.rollup_utils import rewrite_to_rollup
+from utils.execution_utils import new_query_id
+from utils.validation_utils import validate_sql
+from utils.routing_utils import route_question, score_tables, stream_table
+from utils.intent_utils import match_question
+from utils.gazetteer_utils import entity_hints
+from utils.example_utils import select_examples, example_messages
+from utils.trace_utils import span, record_span, add_spans
+from prompt.prompts import (
+    BATCH_CONFIG, DATA_FIELDS_MEANING, ENTITY_HINT_PROMPT, FAST_ANSWER_CONFIG, FEWSHOT_CONFIG, INTENT_CONFIG, NL_RESPONSE_PROMPT, ROUTING_CONFIG, SCHEMA_PRUNING_CONFIG, SQL_REPAIR_PROMPT, SQL_VALIDATION_CONFIG,
+    get_system_prompt, get_sql_instructions, get_fields_prompt
+)
 
 # Logging Configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,86 +46,697 @@ class State(TypedDict):
     sql_generation_time: float
     nlr_generation_time: float
 
+# Turn "date, index info" questions into "index info on date"
+def _prepare_question(question: str) -> str:
+    if ',' in question:
+        date, index_info = question.split(',', 1)
+        date = date.strip()
+        index_info = index_info.strip()
+        question = f"{index_info} on {date}"
+    return question
+
+# Prompt templates are built once per table and reused for every question; few-shot
+# examples go in as earlier turns of the conversation, after the system prompt. A pruned
+# field list (schema pruning) differs per question, so it follows the examples, right
+# before the question, and the table's instructions stay a stable prefix.
+def _sql_context(table_name: str, columns: tuple = None) -> list:
+    if columns is None:
+        return [("system", get_system_prompt(table_name=table_name)), MessagesPlaceholder("examples", optional=True)]
+    return [
+        ("system", get_sql_instructions(table_name)),
+        MessagesPlaceholder("examples", optional=True),
+        ("system", get_fields_prompt(table_name, columns))
+    ]
+
+@lru_cache(maxsize=None)
+def build_sql_gen_prompt(table_name: str, columns: tuple = None) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(_sql_context(table_name, columns) + [("human", "{question}")])
+
+# Repairs continue the original conversation, so the prompt prefix stays identical
+@lru_cache(maxsize=None)
+def _build_sql_repair_prompt(table_name: str, columns: tuple = None) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(_sql_context(table_name, columns) + [
+        ("human", "{question}"),
+        ("ai", "{previous_sql}"),
+        ("human", SQL_REPAIR_PROMPT)
+    ])
+
+@lru_cache(maxsize=None)
+def _build_response_prompt() -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([
+        ("system", NL_RESPONSE_PROMPT),
+        ("human", "Question: {question}\nQuery Results:\n{query_result}")
+    ])
+
+# Ollama reports prompt-eval and eval statistics in the generation info; keep them so the
+# effect of prompt caching on prompt-eval time can be measured per question. Token counts
+# are also attached to the LLM call's span.
+def _record_generation_stats(state: State, prefix: str, generation_info, entry: dict = None):
+    if not generation_info:
+        return
+    if generation_info.get('prompt_eval_count') is not None:
+        state[f'{prefix}_prompt_tokens'] = generation_info['prompt_eval_count']
+    if generation_info.get('prompt_eval_duration') is not None:
+        state[f'{prefix}_prompt_eval_time'] = generation_info['prompt_eval_duration'] / 1e9
+    if generation_info.get('eval_count') is not None:
+        state[f'{prefix}_completion_tokens'] = generation_info['eval_count']
+    if entry is not None:
+        entry['attributes']['prompt_tokens'] = generation_info.get('prompt_eval_count')
+        entry['attributes']['completion_tokens'] = generation_info.get('eval_count')
+        if 'dispatch_coalesced' in generation_info:
+            entry['attributes']['coalesced'] = generation_info['dispatch_coalesced']
+            entry['attributes']['queue_time'] = generation_info.get('dispatch_queue_time')
+            entry['attributes']['batch_size'] = generation_info.get('dispatch_batch_size')
+
+# Generations go through the dispatcher (utils/dispatch_utils.py): identical prompts in
+# flight share one completion and queued prompts run in micro-batches
+def _generate(llm, prompt: str):
+    return generate(llm, prompt)
+
+async def _agenerate(llm, prompt: str):
+    return await agenerate(llm, prompt)
+
+# The question as the SQL prompts show it, followed by the data values it mentions
+# ("US" -> country_name = 'United States'); kept out of the system prompt so its
+# prefix stays the same for every question
+def _sql_question(state: State) -> str:
+    question = _prepare_question(state['question'])
+    if 'entity_hints' not in state:
+        state['entity_hints'] = entity_hints(state['question'], state['table_name'])
+    if state['entity_hints']:
+        question += "\n" + ENTITY_HINT_PROMPT.format(table_name=state['table_name'], hints='; '.join(state['entity_hints']))
+    return question
+
+# The gold question/SQL pairs most similar to the question, as chat turns; retrieved once,
+# so a repair continues the same conversation
+def _fewshot_messages(state: State) -> list:
+    if 'fewshot_examples' not in state:
+        with span(state, 'fewshot_retrieval') as entry:
+            state['fewshot_examples'] = select_examples(state['question'], state['table_name']) if FEWSHOT_CONFIG['enabled'] else []
+            entry['attributes']['examples'] = len(state['fewshot_examples'])
+    return example_messages(state['fewshot_examples'])
+
+def _sql_gen_prompt(state: State) -> str:
+    with span(state, 'prompt_build'):
+        columns = None
+        if SCHEMA_PRUNING_CONFIG['enabled']:
+            columns = select_relevant_columns(state['question'], state['table_name'])
+            state['schema_columns'] = list(columns) if columns else None
+        sql_gen_prompt = build_sql_gen_prompt(state['table_name'], columns)
+        return sql_gen_prompt.format_prompt(examples=_fewshot_messages(state), question=_sql_question(state)).to_string()
+
+def _lookup_cached_sql(state: State) -> bool:
+    with span(state, 'sql_cache_lookup') as entry:
+        cached_sql = lookup_cached_sql(state['question'], state['table_name'])
+        entry['attributes']['hit'] = cached_sql is not None
+    if cached_sql is None:
+        return False
+    state['query'] = cached_sql
+    state['sql_cache_hit'] = True
+    logger.info(f"SQL cache hit: {cached_sql}")
+    return True
+
+# Common question shapes get template SQL without an LLM call (see utils/intent_utils.py)
+def _match_template(state: State) -> bool:
+    if not INTENT_CONFIG['enabled']:
+        return False
+    with span(state, 'sql_template') as entry:
+        match = match_question(state['question'], state['table_name'])
+        entry['attributes']['intent'] = match['intent'] if match else None
+    if match is None:
+        return False
+    state['query'] = match['sql']
+    state['sql_template'] = match['intent']
+    logger.info(f"Template SQL ({match['intent']}): {match['sql']}")
+    return True
+
+# Strip code fences and coerce the raw LLM output into a SQL string
+def _clean_sql_output(raw_sql) -> str:
+    if isinstance(raw_sql, dict):
+        raw_sql = raw_sql.get('query', '')
+    elif not isinstance(raw_sql, str):
+        raw_sql = str(raw_sql)
+    raw_sql = raw_sql.strip()
+    if raw_sql.startswith('```'):
+        raw_sql = raw_sql.replace('```sql', '').replace('```', '').strip()
+    return raw_sql
+
+# Questions without a table_name are routed to the table they are about, so questions on
+# different datasets can share one pipeline. state['candidate_tables'] optionally limits
+# the choice (e.g. to the tables that are loaded) and state['preferred_table'] is the table
+# of the question's stream (see routing_utils.stream_table); close runner-ups are kept in
+# routed_tables. A question whose best matches over all tables are all outside
+# candidate_tables fails instead of being sent to a table that cannot answer it.
+def table_routing_node(state: State) -> State:
+    if state.get('table_name'):
+        return state
+    candidates = state.get('candidate_tables')
+    if candidates is not None and not candidates:
+        raise ValueError("No table is loaded to answer the question from")
+    if ROUTING_CONFIG['enabled']:
+        preferred = state.get('preferred_table')
+        if candidates and score_tables(state['question']):
+            best = route_question(state['question'], prefer=preferred)
+            if not set(best) & set(candidates):
+                raise ValueError(f"The question is about {best[0]}, which is not loaded (loaded: {', '.join(candidates)})")
+        tables = route_question(state['question'], candidates, preferred)
+    else:
+        tables = [ROUTING_CONFIG['default_table']]
+    state['table_name'] = tables[0]
+    state['routed_tables'] = tables
+    logger.info(f"Routed to {tables[0]}" + (f" (close: {', '.join(tables[1:])})" if len(tables) > 1 else ""))
+    return state
+
+# Stage times are measured with time.perf_counter(); the spans in state['spans'] break
+# each stage down further (see utils/trace_utils.py)
 def sql_gen_node(state: State) -> State:
     logger.info('Generating SQL query')
+    start_time = time.perf_counter()
+
+    if _lookup_cached_sql(state) or _match_template(state):
+        state['sql_generation_time'] = time.perf_counter() - start_time
+        return state
+
     llm = get_llm_model()
-    state['sql_start_time'] = time.time()
 
     if llm is None:
         state['query'] = ""
         logger.error("No LLM available for query generation")
         return state
 
-    system_prompt = get_system_prompt(table_name=state['table_name'])
-
-    sql_gen_prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("human", "{question}")
-    ])
-
     try:
-        question = state['question']
-        if ',' in question:
-            date, index_info = question.split(',', 1)
-            date = date.strip()
-            index_info = index_info.strip()
-            question = f"{index_info} on {date}"
-
-        raw_sql = llm.invoke(sql_gen_prompt.format_messages(question=question))
-        if isinstance(raw_sql, dict):
-            raw_sql = raw_sql.get('query', '')
-        elif not isinstance(raw_sql, str):
-            raw_sql = str(raw_sql)
-        raw_sql = raw_sql.strip()
-        if raw_sql.startswith('```'):
-            raw_sql = raw_sql.replace('```sql', '').replace('```', '').strip()
-        state['query'] = raw_sql
+        prompt = _sql_gen_prompt(state)
+        with span(state, 'llm_sql_generation') as entry:
+            raw_sql, generation_info = _generate(llm, prompt)
+            _record_generation_stats(state, 'sql', generation_info, entry)
+        state['query'] = _clean_sql_output(raw_sql)
 
     except Exception as e:
         logger.error(f"SQL generation failed: {str(e)}")
         traceback.print_exc()
         state['query'] = ""
 
+    state['sql_generation_time'] = time.perf_counter() - start_time
     logger.info(f"Generated SQL Query: {state['query']}")
     return state
 
+# Record a validation result; True once no (further) repair should be attempted
+def _apply_validation(state: State, validation: dict) -> bool:
+    state['query'] = validation['sql']
+    state['sql_valid'] = validation['valid']
+    state['sql_validation_errors'] = validation['errors']
+    state.setdefault('sql_repairs', []).extend(validation['repairs'])
+    return validation['valid'] or not state['query'] or state['sql_repair_attempts'] >= SQL_VALIDATION_CONFIG['max_repair_attempts']
+
+def _repair_prompt(state: State) -> str:
+    columns = tuple(state['schema_columns']) if state.get('schema_columns') else None
+    return _build_sql_repair_prompt(state['table_name'], columns).format_prompt(
+        examples=_fewshot_messages(state),
+        question=_sql_question(state),
+        previous_sql=state['query'],
+        errors='\n'.join(f"- {error}" for error in state['sql_validation_errors'])
+    ).to_string()
+
+def _finish_validation(state: State, start_time: float) -> State:
+    state['sql_validation_time'] = time.perf_counter() - start_time
+    if state['sql_repairs']:
+        logger.info(f"Repaired SQL ({'; '.join(state['sql_repairs'])}): {state['query']}")
+    if not state['sql_valid']:
+        logger.warning(f"Rejected invalid SQL: {state['sql_validation_errors']}")
+    return state
+
+# Check the generated SQL locally before it reaches the database. Misspelled names and
+# dialect slips are fixed in place; other errors go back to the LLM a bounded number of
+# times. SQL that is still invalid is never executed and never reaches the response LLM.
+def sql_validation_node(state: State) -> State:
+    if not SQL_VALIDATION_CONFIG['enabled']:
+        return state
+    logger.info('Validating SQL query')
+    start_time = time.perf_counter()
+    state['sql_repair_attempts'] = 0
+    while not _apply_validation(state, validate_sql(state['query'], state['table_name'])):
+        llm = get_llm_model()
+        if llm is None:
+            break
+        state['sql_repair_attempts'] += 1
+        logger.info(f"Re-prompting for invalid SQL: {state['sql_validation_errors']}")
+        try:
+            with span(state, 'llm_sql_repair', attempt=state['sql_repair_attempts']) as entry:
+                raw_sql, generation_info = _generate(llm, _repair_prompt(state))
+                _record_generation_stats(state, 'sql_repair', generation_info, entry)
+            state['query'] = _clean_sql_output(raw_sql)
+        except Exception as e:
+            logger.error(f"SQL repair failed: {str(e)}")
+            break
+    return _finish_validation(state, start_time)
+
+# Aggregate SQL answerable from a precomputed rollup runs against the rollup instead;
+# the generated SQL is still what gets cached and reported
+def _rollup_query(state: State):
+    try:
+        rollup_query = rewrite_to_rollup(state['query'], state['table_name'])
+    except Exception as e:
+        logger.warning(f"Rollup rewrite failed: {str(e)}")
+        return None
+    if rollup_query is not None:
+        state['rollup_query'] = rollup_query
+        logger.info('Answering from rollup table')
+    return rollup_query
+
+# Only plain errors are retried on the generated SQL; a timed-out or cancelled rollup query
+# would only be slower against the base table
+def _should_fall_back(raw_result) -> bool:
+    return raw_result is None or (raw_result.get('error') and not raw_result.get('timed_out') and not raw_result.get('cancelled'))
+
+def _finish_execution(state: State, raw_result: dict, start_time: float) -> State:
+    state['query_truncated'] = bool(raw_result.get('truncated'))
+    state['query_timed_out'] = bool(raw_result.get('timed_out'))
+    state['query_cancelled'] = bool(raw_result.get('cancelled'))
+    state['query_error'] = raw_result.get('error')
+    # SQL that found no rows is not reused for later near-duplicate questions
+    if raw_result.get('error') is None and raw_result.get('data') and not state.get('sql_cache_hit') and not state.get('sql_template'):
+        store_cached_sql(state['question'], state['table_name'], state['query'])
+    with span(state, 'formatting', rows=len(raw_result.get('data') or [])):
+        state['query_result'] = summarize_result(raw_result)
+    # Small complete results are kept as rows for the deterministic answer templates
+    rows = raw_result.get('data')
+    if raw_result.get('error') is None and not raw_result.get('truncated') and len(rows or []) <= FAST_ANSWER_CONFIG['max_rows']:
+        state['result_rows'] = rows or []
+        state['result_columns'] = raw_result.get('columns') or []
+    state['sql_execution_time'] = time.perf_counter() - start_time
+    return state
+
+def _invalid_sql_result(state: State) -> dict:
+    return {
+        'data': None, 'columns': [], 'error': f"Invalid SQL: {'; '.join(state['sql_validation_errors'])}",
+        'truncated': False, 'timed_out': False, 'cancelled': False
+    }
+
+# The query_id is kept in the state so another thread can stop a runaway query with
+# execution_utils.cancel_query(state['query_id'])
+# Connect/execute/fetch times are reported by run_query through timings; a rollup attempt
+# and its fallback share one interval per phase.
 def query_execution_node(state: State) -> State:
+    start_time = time.perf_counter()
+    if state.get('sql_valid') is False:
+        return _finish_execution(state, _invalid_sql_result(state), start_time)
     logger.info('Executing query')
-    raw_result = run_query(state['query'], state['table_name'])
-    state['query_result'] = convert_to_markdown_table(raw_result)
-    state['sql_execution_time']=time.time() - state['sql_start_time']
+    query_id = state.setdefault('query_id', new_query_id())
+    rollup_query = _rollup_query(state)
+    timings = {}
+    raw_result = run_query(rollup_query, state['table_name'], query_id, timings=timings) if rollup_query else None
+    if _should_fall_back(raw_result):
+        raw_result = run_query(state['query'], state['table_name'], query_id, timings=timings)
+    add_spans(state, timings)
+    return _finish_execution(state, raw_result, start_time)
+
+# Answer without the LLM when there is nothing to answer from: the SQL was rejected, the
+# database returned an error, or execution was stopped before producing any rows (one
+# timeout, not a timeout plus a generation that restates it)
+def _degraded_answer(state: State):
+    if state.get('sql_valid') is False:
+        return ("I could not write a valid database query for this question. "
+                "Try rephrasing it with the indicator, place and year you are interested in.")
+    if state.get('query_cancelled'):
+        return "The database query was cancelled before it returned any results."
+    if state.get('query_timed_out') and not state.get('query_truncated'):
+        return ("The database query took too long and was stopped, so there is no result to answer from. "
+                "Try narrowing the question, for example to a specific country or year.")
+    if state.get('query_error'):
+        return ("The database could not run the query for this question, so there is no result to answer from "
+                f"({state['query_error'].splitlines()[0]}).")
+    return None
+
+# === DETERMINISTIC ANSWERS ===
+# Lookups that return a value, a row or a short list are answered from templates built from
+# the question and column names; the response LLM is only used when there is data to interpret
+
+_ANALYTIC_RE = re.compile(r'\b(?:' + '|'.join(map(re.escape, FAST_ANSWER_CONFIG['analytic_terms'])) + ')', re.IGNORECASE)
+# Questions may keep a leading "N|" index (as numbered in main.py)
+_LEAD = r'^\s*(?:\d+\|\s*)?'
+_SUBJECT_RE = re.compile(_LEAD + r'(?:what|which)\s+(is|was|are|were)\s+([^?]+?)[\s?.!]*$', re.IGNORECASE)
+_ENTITY_RE = re.compile(_LEAD + r'(?:what|which)\s+\w+\s+(has|had|is|was)\s+([^?]+?)[\s?.!]*$', re.IGNORECASE)
+_COUNT_RE = re.compile(_LEAD + r'how\s+many\s+(\w+)', re.IGNORECASE)
+
+def _column_label(column: str) -> str:
+    return column.replace('_', ' ').strip()
+
+def _row_details(columns: list, row) -> str:
+    return ', '.join(f"{_column_label(column)}: {format_value(value)}" for column, value in zip(columns, row))
+
+# A row led by a text value reads as "<entity> (<column>: <value>, ...)"
+def _render_row(columns: list, row) -> str:
+    if len(row) == 1:
+        return format_value(row[0])
+    if isinstance(row[0], str):
+        return f"{row[0]} ({_row_details(columns[1:], row[1:])})"
+    return _row_details(columns, row)
+
+def _render_value(question: str, column: str, value) -> str:
+    match = _SUBJECT_RE.match(question)
+    if value is None:
+        subject = match.group(2) if match else f"the {_column_label(column)}"
+        return f"No data is recorded for {subject}."
+    text = format_value(value)
+    if match:
+        subject = match.group(2)
+        return f"{subject[0].upper()}{subject[1:]} {match.group(1).lower()} {text}."
+    match = _ENTITY_RE.match(question)
+    if match and isinstance(value, str):
+        return f"{text} {match.group(1).lower()} {match.group(2)}."
+    match = _COUNT_RE.match(question)
+    if match:
+        return f"The number of {match.group(1).lower()} is {text}."
+    return f"The {_column_label(column)} is {text}."
+
+def _template_answer(state: State):
+    if not FAST_ANSWER_CONFIG['enabled'] or 'result_rows' not in state or _ANALYTIC_RE.search(state['question']):
+        return None
+    rows, columns = state['result_rows'], state['result_columns']
+    if not rows:
+        return "No matching records were found in the data."
+    if len(columns) > FAST_ANSWER_CONFIG['max_columns']:
+        return None
+    if len(rows) == 1 and len(columns) == 1:
+        return _render_value(state['question'], columns[0], rows[0][0])
+    if len(rows) == 1 and all(value is None for value in rows[0]):
+        return f"No data is recorded for {', '.join(_column_label(column) for column in columns)}."
+    if len(rows) == 1:
+        match = _ENTITY_RE.match(state['question'])
+        if match and isinstance(rows[0][0], str):
+            return f"{rows[0][0]} {match.group(1).lower()} {match.group(2)} ({_row_details(columns[1:], rows[0][1:])})."
+        return _render_row(columns, rows[0]) + "."
+    return '\n'.join([f"There are {len(rows)} results:"] + [f"- {_render_row(columns, row)}" for row in rows])
+
+# Running average of LLM answer times, used to estimate what a direct answer saved
+_llm_answer_times = {'total': 0.0, 'count': 0}
+_llm_answer_lock = threading.Lock()
+
+def _record_llm_answer_time(elapsed: float):
+    with _llm_answer_lock:
+        _llm_answer_times['total'] += elapsed
+        _llm_answer_times['count'] += 1
+
+# None until an LLM answer has been timed
+def _expected_llm_answer_time():
+    with _llm_answer_lock:
+        if not _llm_answer_times['count']:
+            return None
+        return _llm_answer_times['total'] / _llm_answer_times['count']
+
+# (answer, path) when the question can be answered without the response LLM
+def _direct_answer(state: State):
+    answer = _degraded_answer(state)
+    if answer is not None:
+        return answer, 'degraded'
+    answer = _template_answer(state)
+    if answer is not None:
+        return answer, 'template'
+    return None
+
+def _finish_direct_answer(state: State, direct_answer: tuple, start_time: float) -> State:
+    state['final_answer'], state['answer_path'] = direct_answer
+    end_time = time.perf_counter()
+    record_span(state, f"{state['answer_path']}_answer", start_time, end_time)
+    state['nlp_generation_time'] = state['nlr_generation_time'] = end_time - start_time
+    expected = _expected_llm_answer_time()
+    if expected is not None:
+        state['answer_latency_saved'] = max(0.0, expected - state['nlp_generation_time'])
+    logger.info(f"Answered without the LLM ({state['answer_path']})")
+    return state
+
+def _finish_llm_answer(state: State, start_time: float, succeeded: bool) -> State:
+    end_time = time.perf_counter()
+    record_span(
+        state, 'llm_nl_generation', start_time, end_time, succeeded=succeeded,
+        prompt_tokens=state.get('nlp_prompt_tokens'), completion_tokens=state.get('nlp_completion_tokens'),
+        first_token_time=state.get('nlp_first_token_time')
+    )
+    state['nlp_generation_time'] = state['nlr_generation_time'] = end_time - start_time
+    state['answer_path'] = 'llm'
+    if succeeded:
+        _record_llm_answer_time(state['nlp_generation_time'])
     return state
 
-def response_generation_node(state: State) -> State:
+# Yield answer tokens as they arrive from the LLM. When the stream ends the cleaned answer,
+# time-to-first-token and total generation time are written into the state.
+def stream_response_generation(state: State):
+    logger.info('Streaming natural language response')
+    start_time = time.perf_counter()
+    direct_answer = _direct_answer(state)
+    if direct_answer is not None:
+        _finish_direct_answer(state, direct_answer, start_time)
+        yield state['final_answer']
+        return
+    llm = get_llm_model()
+    if llm is None:
+        state['final_answer'] = "Failed to generate response due to LLM initialization error"
+        logger.error("No LLM available for response generation")
+        return
+
+    response_model = _build_response_prompt() | llm
+
+    chunks = []
+    try:
+        for chunk in response_model.stream({
+            "question": state['question'],
+            "query_result": state['query_result']
+        }):
+            if not chunks:
+                state['nlp_first_token_time'] = time.perf_counter() - start_time
+            chunk = chunk if isinstance(chunk, str) else str(chunk)
+            chunks.append(chunk)
+            yield chunk
+        # Ollama streams one token per chunk
+        state['nlp_completion_tokens'] = sum(1 for chunk in chunks if chunk)
+        state['final_answer'] = extract_natural_answer(''.join(chunks))
+        _finish_llm_answer(state, start_time, True)
+
+    except Exception as e:
+        logger.error(f"Response generation failed: {str(e)}")
+        traceback.print_exc()
+        state['final_answer'] = "Failed to generate response. Please clarify your query."
+        _finish_llm_answer(state, start_time, False)
+
+# on_token(chunk) switches the node to streaming mode
+def response_generation_node(state: State, on_token=None) -> State:
+    if on_token is not None:
+        for chunk in stream_response_generation(state):
+            on_token(chunk)
+        return state
+
     logger.info('Generating natural language response')
-    start_time=time.time()
+    start_time = time.perf_counter()
+    direct_answer = _direct_answer(state)
+    if direct_answer is not None:
+        return _finish_direct_answer(state, direct_answer, start_time)
     llm = get_llm_model()
     if llm is None:
         state['final_answer'] = "Failed to generate response due to LLM initialization error"
         logger.error("No LLM available for response generation")
         return state
 
-    response_prompt = ChatPromptTemplate.from_messages([
-        ("system", NL_RESPONSE_PROMPT),
-        ("human", "Question: {question}\nQuery Results:\n{query_result}")
-    ])
+    prompt = _build_response_prompt().format_prompt(
+        question=state['question'],
+        query_result=state['query_result']
+    ).to_string()
+
+    try:
+        final_answer, generation_info = _generate(llm, prompt)
+        _record_generation_stats(state, 'nlp', generation_info)
+        state['final_answer'] = extract_natural_answer(final_answer)
+        _finish_llm_answer(state, start_time, True)
+
+    except Exception as e:
+        logger.error(f"Response generation failed: {str(e)}")
+        traceback.print_exc()
+        state['final_answer'] = "Failed to generate response. Please clarify your query."
+        _finish_llm_answer(state, start_time, False)
+    return state
+
+# Async counterparts of the pipeline nodes: LLM calls go through agenerate/ainvoke and SQL
+# through async_run_query, so one event loop can keep many questions in flight. The other
+# blocking steps (SQL cache sqlite, gazetteer, example and column index loads, validation,
+# the rollup check) run in worker threads, so a cold load does not stall every question.
+async def async_table_routing_node(state: State) -> State:
+    return await asyncio.to_thread(table_routing_node, state)
+
+def _sql_without_llm(state: State) -> bool:
+    return _lookup_cached_sql(state) or _match_template(state)
+
+async def async_sql_gen_node(state: State) -> State:
+    logger.info('Generating SQL query')
+    start_time = time.perf_counter()
+
+    if await asyncio.to_thread(_sql_without_llm, state):
+        state['sql_generation_time'] = time.perf_counter() - start_time
+        return state
+
+    llm = get_llm_model()
 
-    response_model = response_prompt | llm
+    if llm is None:
+        state['query'] = ""
+        logger.error("No LLM available for query generation")
+        return state
 
     try:
-        final_answer = response_model.invoke({
-            "question": state['question'],
-            "query_result": state['query_result']
-        })
-        state['final_answer'] = extract_natural_answer(final_answer) 
+        prompt = await asyncio.to_thread(_sql_gen_prompt, state)
+        with span(state, 'llm_sql_generation') as entry:
+            raw_sql, generation_info = await _agenerate(llm, prompt)
+            _record_generation_stats(state, 'sql', generation_info, entry)
+        state['query'] = _clean_sql_output(raw_sql)
+
+    except Exception as e:
+        logger.error(f"SQL generation failed: {str(e)}")
+        traceback.print_exc()
+        state['query'] = ""
+
+    state['sql_generation_time'] = time.perf_counter() - start_time
+    logger.info(f"Generated SQL Query: {state['query']}")
+    return state
+
+async def async_sql_validation_node(state: State) -> State:
+    if not SQL_VALIDATION_CONFIG['enabled']:
+        return state
+    logger.info('Validating SQL query')
+    start_time = time.perf_counter()
+    state['sql_repair_attempts'] = 0
+    while not _apply_validation(state, await asyncio.to_thread(validate_sql, state['query'], state['table_name'])):
+        llm = get_llm_model()
+        if llm is None:
+            break
+        state['sql_repair_attempts'] += 1
+        logger.info(f"Re-prompting for invalid SQL: {state['sql_validation_errors']}")
+        try:
+            prompt = await asyncio.to_thread(_repair_prompt, state)
+            with span(state, 'llm_sql_repair', attempt=state['sql_repair_attempts']) as entry:
+                raw_sql, generation_info = await _agenerate(llm, prompt)
+                _record_generation_stats(state, 'sql_repair', generation_info, entry)
+            state['query'] = _clean_sql_output(raw_sql)
+        except Exception as e:
+            logger.error(f"SQL repair failed: {str(e)}")
+            break
+    return _finish_validation(state, start_time)
+
+async def async_query_execution_node(state: State) -> State:
+    start_time = time.perf_counter()
+    if state.get('sql_valid') is False:
+        return _finish_execution(state, _invalid_sql_result(state), start_time)
+    logger.info('Executing query')
+    query_id = state.setdefault('query_id', new_query_id())
+    rollup_query = await asyncio.to_thread(_rollup_query, state)
+    timings = {}
+    raw_result = await async_run_query(rollup_query, state['table_name'], query_id, timings=timings) if rollup_query else None
+    if _should_fall_back(raw_result):
+        raw_result = await async_run_query(state['query'], state['table_name'], query_id, timings=timings)
+    add_spans(state, timings)
+    # Stores the SQL in the sqlite cache
+    return await asyncio.to_thread(_finish_execution, state, raw_result, start_time)
+
+async def async_response_generation_node(state: State, on_token=None) -> State:
+    logger.info('Generating natural language response')
+    start_time = time.perf_counter()
+    direct_answer = _direct_answer(state)
+    if direct_answer is not None:
+        _finish_direct_answer(state, direct_answer, start_time)
+        if on_token is not None:
+            on_token(state['final_answer'])
+        return state
+    llm = get_llm_model()
+    if llm is None:
+        state['final_answer'] = "Failed to generate response due to LLM initialization error"
+        logger.error("No LLM available for response generation")
+        return state
+
+    prompt = _build_response_prompt().format_prompt(
+        question=state['question'],
+        query_result=state['query_result']
+    ).to_string()
+
+    try:
+        if on_token is not None:
+            chunks = []
+            async for chunk in llm.astream(prompt):
+                if not chunks:
+                    state['nlp_first_token_time'] = time.perf_counter() - start_time
+                chunk = chunk if isinstance(chunk, str) else str(chunk)
+                chunks.append(chunk)
+                on_token(chunk)
+            state['nlp_completion_tokens'] = sum(1 for chunk in chunks if chunk)
+            final_answer = ''.join(chunks)
+        else:
+            final_answer, generation_info = await _agenerate(llm, prompt)
+            _record_generation_stats(state, 'nlp', generation_info)
+        state['final_answer'] = extract_natural_answer(final_answer)
+        _finish_llm_answer(state, start_time, True)
 
     except Exception as e:
         logger.error(f"Response generation failed: {str(e)}")
         traceback.print_exc()
         state['final_answer'] = "Failed to generate response. Please clarify your query."
-    state['nlp_generation_time'] = time.time()-start_time
+        _finish_llm_answer(state, start_time, False)
     return state
 
+# Pipeline stages in execution order, as consumed by utils.batch_utils.run_batch
+PIPELINE_STAGES = [
+    ('table_routing', table_routing_node),
+    ('sql_gen', sql_gen_node),
+    ('sql_validation', sql_validation_node),
+    ('query_execution', query_execution_node),
+    ('response_generation', response_generation_node)
+]
+
+ASYNC_PIPELINE_STAGES = [
+    ('table_routing', async_table_routing_node),
+    ('sql_gen', async_sql_gen_node),
+    ('sql_validation', async_sql_validation_node),
+    ('query_execution', async_query_execution_node),
+    ('response_generation', async_response_generation_node)
+]
+
+def _loaded_tables() -> list:
+    return [name for name in DATA_FIELDS_MEANING if check_table_exists(None, name)]
+
+# Answer many questions concurrently on the running event loop.
+# Stage limits mirror BATCH_CONFIG so the LLM backend is not flooded; results keep question order.
+# Without a table_name every question is routed to its own table among those that are loaded.
+async def answer_many(questions: list, table_name: str = None, max_in_flight: int = None, stage_limits: dict = None) -> list:
+    limits = dict(BATCH_CONFIG['stage_limits'])
+    limits.update(stage_limits or {})
+    in_flight = asyncio.Semaphore(max_in_flight or BATCH_CONFIG['async_max_in_flight'])
+    semaphores = {
+        stage_name: asyncio.Semaphore(max(1, limits.get(stage_name, 1)))
+        for stage_name, _ in ASYNC_PIPELINE_STAGES
+    }
+    candidate_tables = preferred_table = None
+    if not table_name:
+        candidate_tables = await asyncio.to_thread(_loaded_tables)
+        if ROUTING_CONFIG['enabled'] and candidate_tables:
+            preferred_table = await asyncio.to_thread(stream_table, questions, candidate_tables)
+
+    async def answer(question: str) -> State:
+        state = {
+            'question': question,
+            'table_name': table_name,
+            'candidate_tables': candidate_tables,
+            'preferred_table': preferred_table,
+            'query': '',
+            'query_result': '',
+            'final_answer': ''
+        }
+        async with in_flight:
+            try:
+                for stage_name, node in ASYNC_PIPELINE_STAGES:
+                    async with semaphores[stage_name]:
+                        with span(state, stage_name):
+                            state = await node(state)
+            except Exception as e:
+                logger.error(f"An error occurred: {str(e)}")
+                state['error'] = str(e)
+        return state
+
+    return await asyncio.gather(*(answer(question) for question in questions))
+
 # Create and record the output as a JSON file
 def save_output_as_json(output: dict, question_index: int, output_dir: str = "outputs"):
     os.makedirs(output_dir, exist_ok=True)
@@ -0,0 +1,67 @@
+import sys
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append('.')
+
+from prompt.prompts import BATCH_CONFIG
+from utils.trace_utils import span
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Each stage is recorded as a top-level span once its semaphore is acquired, so waiting
+# for a slot is not counted as stage time
+def _run_stages(state: dict, stages: list, semaphores: dict) -> dict:
+    for stage_name, node in stages:
+        with semaphores[stage_name]:
+            with span(state, stage_name):
+                state = node(state)
+    return state
+
+# Run every state through the pipeline stages with bounded concurrency.
+# Each stage has its own limit, so while one question waits on the LLM another can
+# execute its SQL. on_result(idx, state) is called in question order (1-based idx).
+def run_batch(states: list, stages: list, on_result=None, max_in_flight: int = None, stage_limits: dict = None) -> list:
+    if not states:
+        return []
+
+    max_in_flight = max_in_flight or BATCH_CONFIG['max_in_flight']
+    limits = dict(BATCH_CONFIG['stage_limits'])
+    limits.update(stage_limits or {})
+    semaphores = {
+        stage_name: threading.BoundedSemaphore(max(1, limits.get(stage_name, max_in_flight)))
+        for stage_name, _ in stages
+    }
+
+    results = [None] * len(states)
+    completed = [False] * len(states)
+    next_to_emit = 0
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {
+            executor.submit(_run_stages, state, stages, semaphores): i
+            for i, state in enumerate(states)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                logger.error(f"Error processing question {i + 1}: {str(e)}")
+                results[i] = states[i]
+                results[i]['error'] = str(e)
+            completed[i] = True
+
+            # Emit finished results strictly in question order
+            while next_to_emit < len(states) and completed[next_to_emit]:
+                if on_result is not None:
+                    try:
+                        on_result(next_to_emit + 1, results[next_to_emit])
+                    except Exception as e:
+                        logger.error(f"Failed to handle result of question {next_to_emit + 1}: {str(e)}")
+                next_to_emit += 1
+
+    return results
@@ -0,0 +1,435 @@
+import sys
+import os
+import re
+import hashlib
+import pickle
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+sys.path.append('.')
+
+from prompt.prompts import OLLAMA_CONFIG, SQL_CACHE_CONFIG, RESULT_CACHE_CONFIG
+from utils.sql_utils import canonicalize_sql
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Thread-safe in-memory LRU map with optional TTL and byte budget.
+# on_evict(key, value) is called for entries pushed out by the size limits.
+class LRUCache:
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None, max_bytes: int = None, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.total_bytes = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, stored_at, size = entry
+            if self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.total_bytes -= size
+                self.evictions += 1
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, stored_at: float = None, size: int = 0):
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous[2]
+            self._entries[key] = (value, stored_at if stored_at is not None else time.time(), size)
+            self.total_bytes += size
+            while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+            ):
+                evicted_key, (evicted_value, _, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+                evicted.append((evicted_key, evicted_value))
+        if self.on_evict is not None:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.total_bytes -= entry[2]
+            return entry[0]
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+# === QUESTION -> SQL CACHE ===
+
+def normalize_question(question: str) -> str:
+    question = unicodedata.normalize('NFKC', question).lower()
+    question = re.sub(r'\s+', ' ', question).strip()
+    return question.rstrip('?.! ').strip()
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# Numbers, quoted strings and capitalised words (countries, groups, ...) that must match
+# exactly before two questions are treated as near-duplicates: "GDP of Vietnam in 2019"
+# and "GDP of Japan in 2019" are textually close but need different SQL
+def _entity_signature(question: str) -> frozenset:
+    tokens = set(re.findall(r"\d+(?:\.\d+)?", question))
+    for groups in re.findall(r"'([^']*)'|\"([^\"]*)\"", question):
+        tokens.update(g.lower() for g in groups if g)
+    words = re.findall(r"[A-Za-z][\w&.-]*", question)
+    tokens.update(w.lower() for w in words[1:] if w[0].isupper())
+    return frozenset(tokens)
+
+_sql_cache = LRUCache(SQL_CACHE_CONFIG['max_entries'], SQL_CACHE_CONFIG['ttl_seconds'])
+_near_index = {}
+_sql_cache_db = None
+_sql_cache_lock = threading.Lock()
+_sql_cache_stats = {'exact_hits': 0, 'near_hits': 0, 'misses': 0, 'stores': 0}
+# Memory-tier hits not yet written to the persistent tier's last_used: key -> hit time
+_pending_touches = {}
+
+def _get_cache_db():
+    global _sql_cache_db
+    if _sql_cache_db is not None or not SQL_CACHE_CONFIG.get('path'):
+        return _sql_cache_db
+    try:
+        os.makedirs(os.path.dirname(SQL_CACHE_CONFIG['path']) or '.', exist_ok=True)
+        db = sqlite3.connect(SQL_CACHE_CONFIG['path'], check_same_thread=False)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS sql_cache (
+                model TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                question TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                query TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, table_name, question)
+            )
+        """)
+        db.execute("DELETE FROM sql_cache WHERE created_at < ?", (time.time() - SQL_CACHE_CONFIG['ttl_seconds'],))
+        db.commit()
+        _sql_cache_db = db
+        if SQL_CACHE_CONFIG['near_duplicate']:
+            for model, table_name, question, signature, query in db.execute(
+                "SELECT model, table_name, question, signature, query FROM sql_cache ORDER BY last_used ASC LIMIT ?",
+                (SQL_CACHE_CONFIG['max_entries'],)
+            ):
+                _index_near_duplicate(model, table_name, question, frozenset(signature.split()), query)
+    except Exception as e:
+        logger.error(f"Failed to open SQL cache at {SQL_CACHE_CONFIG['path']}: {str(e)}")
+    return _sql_cache_db
+
+# Written in batches of SQL_CACHE_CONFIG['touch_batch'], before every eviction and at exit,
+# so the persistent tier evicts by real recency, not by when an entry last missed memory.
+# Callers hold _sql_cache_lock.
+def _flush_touches():
+    if not _pending_touches or _sql_cache_db is None:
+        _pending_touches.clear()
+        return
+    try:
+        _sql_cache_db.executemany(
+            "UPDATE sql_cache SET last_used = MAX(last_used, ?) WHERE model = ? AND table_name = ? AND question = ?",
+            [(used_at, *key) for key, used_at in _pending_touches.items()]
+        )
+        _sql_cache_db.commit()
+    except Exception as e:
+        logger.error(f"Failed to update SQL cache recency: {str(e)}")
+    _pending_touches.clear()
+
+def _touch(key):
+    if _get_cache_db() is None:
+        return
+    _pending_touches[key] = time.time()
+    if len(_pending_touches) >= SQL_CACHE_CONFIG['touch_batch']:
+        _flush_touches()
+
+def _flush_touches_at_exit():
+    with _sql_cache_lock:
+        _flush_touches()
+
+atexit.register(_flush_touches_at_exit)
+
+def _index_near_duplicate(model: str, table_name: str, question: str, signature: frozenset, query: str):
+    entries = _near_index.setdefault((model, table_name), {})
+    entries.pop(question, None)
+    entries[question] = (_trigrams(question), signature, query)
+    while len(entries) > SQL_CACHE_CONFIG['max_entries']:
+        entries.pop(next(iter(entries)))
+
+def _lookup_near_duplicate(model: str, table_name: str, question: str, original_question: str):
+    entries = _near_index.get((model, table_name))
+    if not entries:
+        return None
+    grams = _trigrams(question)
+    signature = _entity_signature(original_question)
+    best_score, best_query = 0.0, None
+    for candidate_grams, candidate_signature, query in entries.values():
+        if candidate_signature != signature:
+            continue
+        score = len(grams & candidate_grams) / len(grams | candidate_grams)
+        if score > best_score:
+            best_score, best_query = score, query
+    if best_score >= SQL_CACHE_CONFIG['near_duplicate_threshold']:
+        return best_query
+    return None
+
+def lookup_cached_sql(question: str, table_name: str):
+    if not SQL_CACHE_CONFIG['enabled'] or not question:
+        return None
+    model = OLLAMA_CONFIG['model']
+    normalized = normalize_question(question)
+    key = (model, table_name, normalized)
+
+    query = _sql_cache.get(key)
+    with _sql_cache_lock:
+        if query is not None:
+            _touch(key)
+        else:
+            db = _get_cache_db()
+            if db is not None:
+                row = db.execute(
+                    "SELECT query, created_at FROM sql_cache WHERE model = ? AND table_name = ? AND question = ? AND created_at >= ?",
+                    (model, table_name, normalized, time.time() - SQL_CACHE_CONFIG['ttl_seconds'])
+                ).fetchone()
+                if row is not None:
+                    query = row[0]
+                    _sql_cache.put(key, query, stored_at=row[1])
+                    db.execute(
+                        "UPDATE sql_cache SET last_used = ? WHERE model = ? AND table_name = ? AND question = ?",
+                        (time.time(), model, table_name, normalized)
+                    )
+                    db.commit()
+        if query is not None:
+            _sql_cache_stats['exact_hits'] += 1
+            return query
+
+        if SQL_CACHE_CONFIG['near_duplicate']:
+            query = _lookup_near_duplicate(model, table_name, normalized, question)
+            if query is not None:
+                _sql_cache_stats['near_hits'] += 1
+                return query
+
+        _sql_cache_stats['misses'] += 1
+    return None
+
+def store_cached_sql(question: str, table_name: str, query: str):
+    if not SQL_CACHE_CONFIG['enabled'] or not question or not query:
+        return
+    model = OLLAMA_CONFIG['model']
+    normalized = normalize_question(question)
+    signature = _entity_signature(question)
+    now = time.time()
+    _sql_cache.put((model, table_name, normalized), query, stored_at=now)
+    with _sql_cache_lock:
+        _sql_cache_stats['stores'] += 1
+        if SQL_CACHE_CONFIG['near_duplicate']:
+            _index_near_duplicate(model, table_name, normalized, signature, query)
+        db = _get_cache_db()
+        if db is None:
+            return
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO sql_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (model, table_name, normalized, ' '.join(sorted(signature)), query, now, now)
+            )
+            # Keep the persisted tier bounded by evicting least recently used rows
+            _flush_touches()
+            db.execute("""
+                DELETE FROM sql_cache WHERE rowid IN (
+                    SELECT rowid FROM sql_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (SQL_CACHE_CONFIG['max_entries'],))
+            db.commit()
+        except Exception as e:
+            logger.error(f"Failed to persist cached SQL: {str(e)}")
+
+def get_sql_cache_stats() -> dict:
+    with _sql_cache_lock:
+        stats = dict(_sql_cache_stats)
+    lookups = stats['exact_hits'] + stats['near_hits'] + stats['misses']
+    stats['hit_rate'] = (stats['exact_hits'] + stats['near_hits']) / lookups if lookups else 0.0
+    stats['memory_entries'] = len(_sql_cache)
+    stats['evictions'] = _sql_cache.evictions
+    return stats
+
+def clear_sql_cache():
+    _sql_cache.clear()
+    with _sql_cache_lock:
+        _near_index.clear()
+        _pending_touches.clear()
+        if _get_cache_db() is not None:
+            _sql_cache_db.execute("DELETE FROM sql_cache")
+            _sql_cache_db.commit()
+
+# === EXECUTED SQL -> RESULT CACHE ===
+# Entries remember the versions of the tables they were computed against; a lookup with a
+# different version is a miss. Results evicted from memory are spilled to disk.
+
+_result_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stale': 0, 'stores': 0, 'spills': 0}
+_result_lock = threading.Lock()
+
+def _spill_path(key) -> str:
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(RESULT_CACHE_CONFIG['spill_dir'], f"{digest}.pkl")
+
+def _prune_spill_dir():
+    spill_dir = RESULT_CACHE_CONFIG['spill_dir']
+    try:
+        files = [os.path.join(spill_dir, name) for name in os.listdir(spill_dir)]
+        files = sorted(((os.path.getmtime(f), os.path.getsize(f), f) for f in files))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= RESULT_CACHE_CONFIG['disk_max_bytes']:
+                break
+            os.remove(path)
+            total -= size
+    except OSError as e:
+        logger.warning(f"Failed to prune result spill directory: {str(e)}")
+
+def _spill_result(key, value):
+    if not RESULT_CACHE_CONFIG.get('spill_dir'):
+        return
+    try:
+        os.makedirs(RESULT_CACHE_CONFIG['spill_dir'], exist_ok=True)
+        with open(_spill_path(key), 'wb') as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        with _result_lock:
+            _result_stats['spills'] += 1
+            prune = _result_stats['spills'] % 100 == 0
+        if prune:
+            _prune_spill_dir()
+    except Exception as e:
+        logger.warning(f"Failed to spill cached result to disk: {str(e)}")
+
+def _remove_spilled_result(key):
+    if not RESULT_CACHE_CONFIG.get('spill_dir'):
+        return
+    try:
+        os.remove(_spill_path(key))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove stale spilled result: {str(e)}")
+
+def _load_spilled_result(key):
+    if not RESULT_CACHE_CONFIG.get('spill_dir'):
+        return None
+    path = _spill_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            stored_key, value = pickle.load(f)
+        return value if stored_key == key else None
+    except Exception as e:
+        logger.warning(f"Failed to read spilled result {path}: {str(e)}")
+        return None
+
+_result_cache = LRUCache(max_bytes=RESULT_CACHE_CONFIG['max_bytes'], on_evict=_spill_result)
+
+def lookup_cached_result(query: str, table_name: str, table_version):
+    if not RESULT_CACHE_CONFIG['enabled'] or not query:
+        return None
+    key = (canonicalize_sql(query), table_name)
+    entry = _result_cache.get(key)
+    from_disk = False
+    if entry is None:
+        entry = _load_spilled_result(key)
+        from_disk = entry is not None
+
+    with _result_lock:
+        if entry is None:
+            _result_stats['misses'] += 1
+            return None
+        version, result = entry
+        stale = version != table_version
+        if stale:
+            _result_stats['stale'] += 1
+            _result_stats['misses'] += 1
+        else:
+            _result_stats['disk_hits' if from_disk else 'hits'] += 1
+
+    if stale:
+        # A spilled copy of the entry would be just as stale
+        _result_cache.pop(key)
+        _remove_spilled_result(key)
+        return None
+
+    if from_disk:
+        _result_cache.put(key, entry, size=len(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)))
+    return result
+
+def store_cached_result(query: str, table_name: str, table_version, result: dict):
+    if not RESULT_CACHE_CONFIG['enabled'] or not query or result.get('error'):
+        return
+    key = (canonicalize_sql(query), table_name)
+    entry = (table_version, result)
+    try:
+        size = len(pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception as e:
+        logger.warning(f"Result is not cacheable: {str(e)}")
+        return
+    if size > RESULT_CACHE_CONFIG['max_bytes']:
+        _spill_result(key, entry)
+        return
+    _result_cache.put(key, entry, size=size)
+    with _result_lock:
+        _result_stats['stores'] += 1
+
+# Drop every cached result of a table, in memory and on disk
+def invalidate_cached_results(table_name: str):
+    for key in _result_cache.keys():
+        if key[1] == table_name:
+            _result_cache.pop(key)
+    spill_dir = RESULT_CACHE_CONFIG.get('spill_dir')
+    if not spill_dir or not os.path.isdir(spill_dir):
+        return
+    for name in os.listdir(spill_dir):
+        path = os.path.join(spill_dir, name)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, _ = pickle.load(f)
+            if stored_key[1] == table_name:
+                os.remove(path)
+        except Exception:
+            continue
+
+def get_result_cache_stats() -> dict:
+    with _result_lock:
+        stats = dict(_result_stats)
+    lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+    stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+    stats['memory_entries'] = len(_result_cache)
+    stats['memory_bytes'] = _result_cache.total_bytes
+    stats['evictions'] = _result_cache.evictions
+    return stats
@@ -0,0 +1,179 @@
+import sys
+import os
+import re
+import csv
+import difflib
+import logging
+from functools import lru_cache
+
+sys.path.append('.')
+
+from prompt.prompts import DATA_FIELDS_MEANING, DATASET_CONFIG
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def get_csv_path(table_name: str):
+    path = os.path.join(ROOT_DIR, DATASET_CONFIG['dir'], f"{table_name}.csv")
+    return path if os.path.exists(path) else None
+
+# "GDP Growth (%)" -> "gdp_growth", "Forex USD/EUR" -> "forex_usd_eur"
+def normalize_header(header: str) -> str:
+    header = re.sub(r'\([^)]*\)', ' ', header).lower()
+    header = re.sub(r'[^a-z0-9]+', '_', header)
+    return header.strip('_')
+
+# Map CSV headers onto the (lower-cased) field names declared in DATA_FIELDS_MEANING,
+# falling back to a close match for spelling drift such as log_gdp_per_capita vs log_GDP_per_capital
+@lru_cache(maxsize=None)
+def map_csv_columns(table_name: str, headers: tuple) -> tuple:
+    fields = [field.lower() for field in DATA_FIELDS_MEANING.get(table_name, {}).get('fields', {})]
+    columns = []
+    for header in headers:
+        normalized = normalize_header(header)
+        if normalized in fields:
+            columns.append(normalized)
+            continue
+        match = difflib.get_close_matches(normalized, fields, n=1, cutoff=0.8)
+        columns.append(match[0] if match else normalized)
+    return tuple(columns)
+
+def read_csv_header(path: str) -> list:
+    with open(path, newline='', encoding='utf-8') as f:
+        return next(csv.reader(f))
+
+# Stream a CSV file as lists of rows, never holding more than chunk_rows in memory
+def iter_csv_chunks(path: str, chunk_rows: int = 50000, skip_rows: int = 0):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for _ in range(skip_rows):
+            if next(reader, None) is None:
+                return
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+# int() first: int(float(x)) rounds integers above 2**53; float() only for forms like 2000.0
+def _parse_int(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+_INT_RE = re.compile(r'^[+-]?\d+(\.0*)?$')
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# Narrowest type that holds every non-empty value seen so far: INTEGER < FLOAT < TEXT, DATE < TEXT
+def _widen_type(current: str, value: str) -> str:
+    if current == 'TEXT':
+        return current
+    if current in (None, 'INTEGER') and _INT_RE.match(value):
+        return 'INTEGER'
+    if current in (None, 'INTEGER', 'FLOAT') and _is_number(value):
+        return 'FLOAT'
+    if current in (None, 'DATE') and _DATE_RE.match(value):
+        return 'DATE'
+    return 'TEXT'
+
+# Per-column statistics of a table's CSV: null ratio, inferred type, largest integer
+# magnitude, and the distinct values of low-cardinality text columns
+@lru_cache(maxsize=None)
+def get_column_stats(table_name: str) -> dict:
+    path = get_csv_path(table_name)
+    if path is None:
+        return {}
+    columns = map_csv_columns(table_name, tuple(read_csv_header(path)))
+    limit = DATASET_CONFIG['max_categorical_values']
+    nulls = [0] * len(columns)
+    types = [None] * len(columns)
+    max_int = [0] * len(columns)
+    values = [set() for _ in columns]
+    total = 0
+    for chunk in iter_csv_chunks(path):
+        for row in chunk:
+            total += 1
+            for i, value in enumerate(row[:len(columns)]):
+                if value == '':
+                    nulls[i] += 1
+                    continue
+                types[i] = _widen_type(types[i], value)
+                if types[i] == 'INTEGER':
+                    max_int[i] = max(max_int[i], abs(_parse_int(value)))
+                if values[i] is not None:
+                    values[i].add(value)
+                    if len(values[i]) > limit:
+                        values[i] = None
+    stats = {}
+    for i, column in enumerate(columns):
+        inferred = types[i] or 'TEXT'
+        categorical = inferred in ('TEXT', 'DATE') and values[i] is not None
+        stats[column] = {
+            'null_ratio': nulls[i] / total if total else 1.0,
+            'numeric': inferred in ('INTEGER', 'FLOAT'),
+            'inferred_type': inferred,
+            'max_int': max_int[i],
+            'distinct_values': sorted(values[i]) if categorical else None
+        }
+    return stats
+
+def get_declared_type(table_name: str, column: str):
+    for field, description in DATA_FIELDS_MEANING.get(table_name, {}).get('fields', {}).items():
+        if field.lower() == column:
+            match = re.search(r'\((INTEGER|FLOAT|VARCHAR|TEXT|DATE)\b', description)
+            return match.group(1) if match else None
+    return None
+
+# Column types for loading a CSV: the type declared in DATA_FIELDS_MEANING when the data
+# fits it, otherwise the type inferred from the data (several declarations are inaccurate)
+@lru_cache(maxsize=None)
+def get_column_types(table_name: str) -> tuple:
+    types = []
+    for column, stats in get_column_stats(table_name).items():
+        declared = get_declared_type(table_name, column)
+        inferred = stats['inferred_type']
+        if declared in ('VARCHAR', 'TEXT'):
+            column_type = 'TEXT'
+        elif declared == 'FLOAT' and inferred in ('INTEGER', 'FLOAT'):
+            column_type = 'FLOAT'
+        elif declared == 'DATE' and inferred == 'DATE':
+            column_type = 'DATE'
+        elif declared == 'INTEGER' and inferred == 'INTEGER':
+            column_type = 'INTEGER'
+        else:
+            column_type = inferred
+        if column_type == 'INTEGER' and stats['max_int'] > 2 ** 31 - 1:
+            column_type = 'BIGINT'
+        types.append((column, column_type))
+    return tuple(types)
+
+# Convert a raw CSV value to the Python value for a column type; '' becomes NULL
+def convert_value(value: str, column_type: str):
+    if value == '':
+        return None
+    if column_type in ('INTEGER', 'BIGINT'):
+        return _parse_int(value)
+    if column_type == 'FLOAT':
+        return float(value)
+    return value
+
+# The CSV-derived caches above; call after a CSV changes within the process
+def clear_dataset_caches():
+    map_csv_columns.cache_clear()
+    get_column_stats.cache_clear()
+    get_column_types.cache_clear()
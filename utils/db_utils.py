@@ -1,9 +1,26 @@
 import sys
 sys.path.append('.')
 
+import asyncio
+import json
+import os
 import psycopg2
+import psycopg2.extensions
 import logging
-from prompt.prompts import POSTGRES_CONFIG
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from prompt.prompts import POSTGRES_CONFIG, POOL_CONFIG, RESULT_CACHE_CONFIG, DB_CONFIG, INDEX_ADVISOR_CONFIG, EXECUTION_CONFIG, DATA_FIELDS_MEANING
+from utils.cache_utils import lookup_cached_result, store_cached_result, invalidate_cached_results
+from utils.format_utils import format_result
+from utils.sql_utils import tokenize_sql
+from utils.trace_utils import timed
+from utils.embedded_db import run_embedded_query, embedded_table_exists, get_embedded_version
+from utils.execution_utils import (
+    new_query_id, register_query, unregister_query, was_cancelled, fetch_capped,
+    timeout_result, cancelled_result
+)
 
 # Logging Configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,67 +41,436 @@ def get_db_connection():
         logger.error(f"Failed to connect to PostgreSQL: {str(e)}")
         return None
 
+# Shared connection pool, created lazily on first checkout
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_known_tables = set()
+_pool_stats = {
+    'checkouts': 0,
+    'timeouts': 0,
+    'recycled': 0,
+    'in_use': 0,
+    'wait_time_total': 0.0,
+    'wait_time_max': 0.0,
+    'checkout_time_total': 0.0,
+    'checkout_time_max': 0.0
+}
+
+# Pool bookkeeping lives on the connection itself, so it goes away when the connection does
+class _PooledConnection(psycopg2.extensions.connection):
+    created_at = 0.0
+    last_used = 0.0
+
+def _open_pooled_connection():
+    conn = psycopg2.connect(
+        host=POSTGRES_CONFIG['host'],
+        port=POSTGRES_CONFIG['port'],
+        dbname=POSTGRES_CONFIG['dbname'],
+        user=POSTGRES_CONFIG['user'],
+        password=POSTGRES_CONFIG['password'],
+        connection_factory=_PooledConnection
+    )
+    conn.created_at = conn.last_used = time.monotonic()
+    return conn
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Failed to close pooled connection: {str(e)}")
+
+# Up to max_size idle connections are kept for reuse (psycopg2's ThreadedConnectionPool
+# closes every connection returned beyond minconn). The number of connections checked
+# out is bounded by _pool_slots, so at most max_size are ever open.
+class _ConnectionPool:
+    def __init__(self):
+        self.idle = []
+        self.lock = threading.Lock()
+        for _ in range(POOL_CONFIG['min_size']):
+            self.idle.append(_open_pooled_connection())
+
+    def getconn(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return _open_pooled_connection()
+
+    def putconn(self, conn, close: bool = False):
+        if not close and not conn.closed:
+            with self.lock:
+                if len(self.idle) < POOL_CONFIG['max_size']:
+                    self.idle.append(conn)
+                    return
+        _close_quietly(conn)
+
+    def closeall(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            _close_quietly(conn)
+
+def get_connection_pool():
+    global _pool, _pool_slots
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            try:
+                _pool = _ConnectionPool()
+                # Callers queue on this semaphore while every connection is checked out
+                _pool_slots = threading.BoundedSemaphore(POOL_CONFIG['max_size'])
+                logger.info(f"Connection pool created (min={POOL_CONFIG['min_size']}, max={POOL_CONFIG['max_size']})")
+            except Exception as e:
+                logger.error(f"Failed to create PostgreSQL connection pool: {str(e)}")
+                _pool = None
+    return _pool
+
+def _is_connection_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    now = time.monotonic()
+    if now - conn.created_at > POOL_CONFIG['max_lifetime']:
+        return False
+    if now - conn.last_used > POOL_CONFIG['health_check_interval']:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+        except Exception:
+            return False
+    return True
+
+def _discard_connection(pool, conn):
+    pool.putconn(conn, close=True)
+    with _pool_lock:
+        _pool_stats['recycled'] += 1
+
+def _acquire_connection(pool):
+    # Retry a bounded number of times so a batch of dead sockets cannot loop forever
+    for _ in range(POOL_CONFIG['max_size'] + 1):
+        conn = pool.getconn()
+        if _is_connection_healthy(conn):
+            return conn
+        logger.info("Recycling stale or broken pooled connection")
+        _discard_connection(pool, conn)
+    raise psycopg2.OperationalError("Could not obtain a healthy connection from the pool")
+
+def _release_connection(pool, conn):
+    status = conn.get_transaction_status() if not conn.closed else psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+    if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        _discard_connection(pool, conn)
+        return
+    try:
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except Exception:
+        _discard_connection(pool, conn)
+        return
+    conn.last_used = time.monotonic()
+    pool.putconn(conn)
+
+# Borrow a pooled connection; yields None when no connection could be obtained
+@contextmanager
+def borrow_connection():
+    pool = get_connection_pool()
+    if pool is None:
+        yield None
+        return
+
+    wait_start = time.perf_counter()
+    if not _pool_slots.acquire(timeout=POOL_CONFIG['checkout_timeout']):
+        with _pool_lock:
+            _pool_stats['timeouts'] += 1
+        logger.error(f"Timed out after {POOL_CONFIG['checkout_timeout']}s waiting for a pooled connection")
+        yield None
+        return
+
+    conn = None
+    try:
+        try:
+            conn = _acquire_connection(pool)
+        except Exception as e:
+            logger.error(f"Failed to check out pooled connection: {str(e)}")
+            yield None
+            return
+
+        checkout_start = time.perf_counter()
+        wait_time = checkout_start - wait_start
+        with _pool_lock:
+            _pool_stats['checkouts'] += 1
+            _pool_stats['in_use'] += 1
+            _pool_stats['wait_time_total'] += wait_time
+            _pool_stats['wait_time_max'] = max(_pool_stats['wait_time_max'], wait_time)
+        try:
+            yield conn
+        finally:
+            checkout_time = time.perf_counter() - checkout_start
+            with _pool_lock:
+                _pool_stats['in_use'] -= 1
+                _pool_stats['checkout_time_total'] += checkout_time
+                _pool_stats['checkout_time_max'] = max(_pool_stats['checkout_time_max'], checkout_time)
+            _release_connection(pool, conn)
+    finally:
+        _pool_slots.release()
+
+def get_pool_stats() -> dict:
+    with _pool_lock:
+        stats = dict(_pool_stats)
+    checkouts = stats['checkouts'] or 1
+    stats['wait_time_avg'] = stats['wait_time_total'] / checkouts
+    stats['checkout_time_avg'] = stats['checkout_time_total'] / checkouts
+    stats['min_size'] = POOL_CONFIG['min_size']
+    stats['max_size'] = POOL_CONFIG['max_size']
+    return stats
+
+def close_connection_pool():
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            logger.info("Connection pool closed")
+        _pool = None
+        _pool_slots = None
+
 def check_table_exists(conn, table_name):
+    if table_name in _known_tables:
+        return True
+    if DB_CONFIG['backend'] == 'embedded':
+        exists = embedded_table_exists(table_name)
+        if exists:
+            _known_tables.add(table_name)
+        return exists
+    if conn is None:
+        with borrow_connection() as pooled_conn:
+            if pooled_conn is None:
+                return False
+            return check_table_exists(pooled_conn, table_name)
     try:
         with conn.cursor() as cur:
-            cur.execute(f"""
+            cur.execute("""
                 SELECT EXISTS (
                     SELECT FROM information_schema.tables 
                     WHERE table_schema = 'public' 
-                    AND table_name = '{table_name}'
+                    AND table_name = %s
                 );
-            """)
+            """, (table_name,))
             exists = cur.fetchone()[0]
+            if exists:
+                _known_tables.add(table_name)
             return exists
     except Exception as e:
         logger.error(f"Failed to check table existence: {str(e)}")
         return False
 
-def run_query(query: str, table_name: str = 'world_happiness_report') -> dict:
-    conn = None
+# Table versions combine a local counter (bumped by invalidate_table) with the
+# pg_stat_user_tables modification counters and the relfilenode, which changes on TRUNCATE
+_table_versions = {}
+_local_table_versions = {}
+_table_version_lock = threading.Lock()
+
+def _read_table_version(conn, table_name):
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT s.n_tup_ins, s.n_tup_upd, s.n_tup_del, c.relfilenode
+                FROM pg_stat_user_tables s
+                JOIN pg_class c ON c.oid = s.relid
+                WHERE s.schemaname = 'public' AND s.relname = %s
+            """, (table_name,))
+            row = cur.fetchone()
+    except Exception as e:
+        logger.warning(f"Failed to read modification counters of '{table_name}': {str(e)}")
+        return None
+    with _table_version_lock:
+        return (_local_table_versions.get(table_name, 0),) + tuple(row or ())
+
+def get_table_version(table_name: str, conn=None):
+    with _table_version_lock:
+        cached = _table_versions.get(table_name)
+    if cached is not None and time.monotonic() - cached[1] < RESULT_CACHE_CONFIG['version_check_interval']:
+        return cached[0]
+    if conn is None:
+        return None
+    version = _read_table_version(conn, table_name)
+    if version is not None:
+        with _table_version_lock:
+            _table_versions[table_name] = (version, time.monotonic())
+    return version
+
+# Every known table a statement reads besides table_name (joins, subqueries), so its
+# cached result goes stale when any of them changes
+def _referenced_tables(query: str, table_name: str) -> tuple:
+    words = {text.lower().strip('"') for kind, text in tokenize_sql(query) if kind in ('word', 'quoted')}
+    return tuple(sorted({table_name} | (words & set(DATA_FIELDS_MEANING))))
+
+# ((table, version), ...) for the tables of a statement, or None while any version is unknown
+def _query_version(tables: tuple, conn=None):
+    versions = []
+    for table in tables:
+        version = get_table_version(table, conn)
+        if version is None:
+            return None
+        versions.append((table, version))
+    return tuple(versions)
+
+# Call after changing a table's data so cached results are never served stale
+def invalidate_table(table_name: str):
+    with _table_version_lock:
+        _local_table_versions[table_name] = _local_table_versions.get(table_name, 0) + 1
+        _table_versions.pop(table_name, None)
+    invalidate_cached_results(table_name)
+
+# Workload log read by utils/index_advisor.py
+_query_log_lock = threading.Lock()
+
+def _log_query(query: str, table_name: str, execution_time: float):
+    if not INDEX_ADVISOR_CONFIG['log_queries']:
+        return
+    path = INDEX_ADVISOR_CONFIG['query_log']
+    entry = json.dumps({'table_name': table_name, 'query': query, 'execution_time': execution_time, 'logged_at': time.time()})
     try:
-        if not query:
-            return {'data': None, 'columns': [], 'error': "No query provided"}
-        
-        conn = get_db_connection()
+        with _query_log_lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(entry + '\n')
+    except OSError as e:
+        logger.warning(f"Failed to append to query log: {str(e)}")
+
+# Embedded backend: the database file is rebuilt when a CSV changes, so its build
+# time stands in for the modification counters used on PostgreSQL
+def _run_embedded_query(query: str, table_name: str, query_id: str, timeout_ms: int, max_rows: int, timings: dict) -> dict:
+    table_version = None
+    if RESULT_CACHE_CONFIG['enabled']:
+        with timed(timings, 'result_cache'):
+            try:
+                tables = _referenced_tables(query, table_name)
+                # May build the database from the CSVs, so it runs before the lock is taken
+                embedded_version = get_embedded_version()
+                with _table_version_lock:
+                    table_version = tuple((table, _local_table_versions.get(table, 0)) for table in tables) + embedded_version
+            except Exception as e:
+                logger.warning(f"Failed to read embedded database version: {str(e)}")
+            cached = lookup_cached_result(query, table_name, table_version) if table_version is not None else None
+        if cached is not None:
+            return cached
+
+    result = run_embedded_query(query, table_name, query_id=query_id, timeout_ms=timeout_ms, max_rows=max_rows, timings=timings)
+    if result['error']:
+        if result.get('timed_out') or result.get('cancelled'):
+            logger.warning(f"Query stopped: {result['error']}")
+        elif result['error'] != "No data returned":
+            logger.error(f"Query execution failed: {result['error']}")
+    elif table_version is not None and not result.get('truncated'):
+        store_cached_result(query, table_name, table_version, result)
+    return result
+
+# Closing a server-side cursor in an aborted transaction raises; the transaction is rolled
+# back on release anyway, so that error would only mask the real one
+def _close_cursor(cur):
+    try:
+        cur.close()
+    except Exception:
+        pass
+
+# Generated SQL runs guarded: in a READ ONLY transaction with statement_timeout, through a
+# server-side cursor that stops fetching at max_rows/EXECUTION_CONFIG['max_bytes'], and
+# cancellable from another thread with cancel_query(query_id). Results carry truncated,
+# timed_out and cancelled flags; a timeout after some rows arrived returns those rows.
+# timings, when given, is filled with the (start, end) perf_counter intervals of the
+# result_cache, db_connect, db_execute and db_fetch steps.
+def run_query(query: str, table_name: str = 'world_happiness_report', query_id: str = None,
+              timeout_ms: int = None, max_rows: int = None, timings: dict = None) -> dict:
+    if not query:
+        return {'data': None, 'columns': [], 'error': "No query provided"}
+
+    if DB_CONFIG['backend'] == 'embedded':
+        return _run_embedded_query(query, table_name, query_id, timeout_ms, max_rows, timings)
+
+    # Served straight from memory while the versions of every table it reads are still fresh
+    tables = _referenced_tables(query, table_name)
+    with timed(timings, 'result_cache'):
+        table_version = _query_version(tables)
+        cached = lookup_cached_result(query, table_name, table_version) if table_version is not None else None
+    if cached is not None:
+        return cached
+
+    connect_start = time.perf_counter()
+    with borrow_connection() as conn:
         if conn is None:
             return {'data': None, 'columns': [], 'error': "Database connection failed"}
-        
+
         if not check_table_exists(conn, table_name):
             return {'data': None, 'columns': [], 'error': f"Table '{table_name}' does not exist. Please create the table and load the data."}
 
-        with conn.cursor() as cur:
-            cur.execute(query)
-            if cur.description:
-                columns = [desc[0] for desc in cur.description]
-                data = cur.fetchall()
-                return {
-                    'data': [dict(zip(columns, row)) for row in data],
-                    'columns': columns,
-                    'error': None
-                }
-            return {'data': None, 'columns': [], 'error': "No data returned"}
-    except Exception as e:
-        logger.error(f"Query execution failed: {str(e)}")
-        return {'data': None, 'columns': [], 'error': str(e)}
-    finally:
-        if conn:
-            conn.close()
-            logger.info("Database connection closed")
+        if table_version is None and RESULT_CACHE_CONFIG['enabled']:
+            table_version = _query_version(tables, conn)
+            if table_version is not None:
+                cached = lookup_cached_result(query, table_name, table_version)
+                if cached is not None:
+                    return cached
 
-def convert_to_markdown_table(result: dict) -> str:
-    if result.get('error'):
-        return f"Error: {result['error']}"
-    if not result.get('data'):
-        return "Query ran successfully, no record found"
+        query_id = query_id or new_query_id()
+        timeout_ms = timeout_ms or EXECUTION_CONFIG['statement_timeout_ms']
+        register_query(query_id, conn.cancel)
+        try:
+            # End the transaction opened by the lookups above so the guards apply from the start
+            conn.rollback()
+            with conn.cursor() as cur:
+                if EXECUTION_CONFIG['read_only']:
+                    cur.execute("SET TRANSACTION READ ONLY")
+                cur.execute("SET LOCAL statement_timeout = %s", (int(timeout_ms),))
+            start_time = time.perf_counter()
+            if timings is not None:
+                timings['db_connect'] = (connect_start, start_time)
+            cur = conn.cursor(name=f"run_query_{query_id}")
+            try:
+                with timed(timings, 'db_execute'):
+                    cur.execute(query)
+                with timed(timings, 'db_fetch'):
+                    rows, truncated, timed_out = fetch_capped(cur, max_rows, deadline=time.monotonic() + timeout_ms / 1000)
+                columns = [desc[0] for desc in cur.description] if cur.description else []
+            finally:
+                _close_cursor(cur)
+            _log_query(query, table_name, time.perf_counter() - start_time)
+            if not columns:
+                return {'data': None, 'columns': [], 'error': "No data returned"}
+            if timed_out:
+                logger.warning(f"Query {query_id} hit the {timeout_ms} ms deadline after {len(rows)} rows")
+                return timeout_result(timeout_ms, columns, rows)
+            if truncated:
+                logger.warning(f"Query {query_id} result truncated at {len(rows)} rows")
+            result = {'data': rows, 'columns': columns, 'error': None, 'truncated': truncated, 'timed_out': False, 'cancelled': False}
+            if table_version is not None and not truncated:
+                store_cached_result(query, table_name, table_version, result)
+            return result
+        except psycopg2.extensions.QueryCanceledError:
+            if was_cancelled(query_id):
+                return cancelled_result()
+            logger.warning(f"Query {query_id} exceeded statement_timeout ({timeout_ms} ms)")
+            return timeout_result(timeout_ms)
+        except Exception as e:
+            logger.error(f"Query execution failed: {str(e)}")
+            return {'data': None, 'columns': [], 'error': str(e)}
+        finally:
+            unregister_query(query_id)
+
+# psycopg2 is blocking, so async callers are bridged onto a small executor sized to the
+# pool: extra coroutines wait for a worker instead of each getting a thread of its own
+_query_executor = None
+_query_executor_lock = threading.Lock()
 
-    data = result['data']
-    columns = result['columns']
-    if not columns:
-        return "No columns returned"
+def _get_query_executor() -> ThreadPoolExecutor:
+    global _query_executor
+    with _query_executor_lock:
+        if _query_executor is None:
+            _query_executor = ThreadPoolExecutor(max_workers=POOL_CONFIG['max_size'], thread_name_prefix='run_query')
+    return _query_executor
 
-    header = "| " + " | ".join(columns) + " |"
-    separator = "| " + " | ".join(["---"] * len(columns)) + " |"
-    rows = ["| " + " | ".join(str(row.get(col, '')) for col in columns) + " |" for row in data]
+async def async_run_query(query: str, table_name: str = 'world_happiness_report', query_id: str = None,
+                          timeout_ms: int = None, max_rows: int = None, timings: dict = None) -> dict:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_query_executor(), run_query, query, table_name, query_id, timeout_ms, max_rows, timings)
 
-    return "\n".join([header, separator] + rows)
\ No newline at end of file
+def convert_to_markdown_table(result: dict) -> str:
+    return format_result(result, 'markdown')
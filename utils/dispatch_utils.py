@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, wait
+
+sys.path.append('.')
+
+from prompt.prompts import DISPATCH_CONFIG, BATCH_CONFIG
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# One dispatcher per LLM client sits between the pipeline and the backend. Identical
+# prompts already in flight share one completion (single-flight), so a burst of users
+# asking the same question costs one generation. New prompts queue; a collector thread
+# takes up to DISPATCH_CONFIG['max_batch_size'] of them per batch, waiting at most
+# 'batch_window_ms' for a batch to fill, and runs it on 'parallel_slots' backend slots,
+# either as one agenerate() call ('native_batch') or one call per prompt. The slots are
+# coroutines on the dispatcher's own event loop, so a generation in progress does not hold
+# a thread. release_llm_model() closes the dispatcher of the model it drops.
+#
+# Callers get (text, generation_info) like llm.generate; generation_info is a copy with
+# 'dispatch_coalesced', 'dispatch_queue_time' and 'dispatch_batch_size' added.
+
+# Keyed by id(llm); the dispatcher holds the llm, so the id stays unique until close_dispatcher()
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_dispatch_stats = {
+    'requests': 0,
+    'coalesced': 0,
+    'batches': 0,
+    'batched_prompts': 0,
+    'batch_size_max': 0,
+    'sent': 0,                      # prompts handed to the backend
+    'queue_depth': 0,               # prompts accepted but not yet sent to the backend
+    'queue_depth_max': 0,
+    'queue_wait_total': 0.0,
+    'queue_wait_max': 0.0,
+    'errors': 0
+}
+
+def _count(key: str, amount=1):
+    with _stats_lock:
+        _dispatch_stats[key] += amount
+
+# Backend slots: DISPATCH_CONFIG['parallel_slots'], else the server's OLLAMA_NUM_PARALLEL,
+# else as many as the pipeline's LLM stages may call at once
+def _parallel_slots() -> int:
+    if DISPATCH_CONFIG['parallel_slots']:
+        return DISPATCH_CONFIG['parallel_slots']
+    try:
+        if int(os.environ.get('OLLAMA_NUM_PARALLEL', 0)) > 0:
+            return int(os.environ['OLLAMA_NUM_PARALLEL'])
+    except ValueError:
+        logger.warning(f"Ignoring OLLAMA_NUM_PARALLEL={os.environ['OLLAMA_NUM_PARALLEL']!r}")
+    limits = BATCH_CONFIG['stage_limits']
+    return max(1, limits['sql_gen'] + limits['response_generation'])
+
+class _Dispatcher:
+    def __init__(self, llm):
+        self.llm = llm
+        self.in_flight = {}         # prompt -> Future shared by every caller of that prompt
+        self.pending = []           # [(prompt, future, enqueued_at)]
+        self.running = set()        # batches handed to the event loop and not finished yet
+        self.closed = False
+        self.condition = threading.Condition()
+        self.loop = asyncio.new_event_loop()
+        self.slots = asyncio.Semaphore(_parallel_slots())
+        threading.Thread(target=self._serve, name='llm-slots', daemon=True).start()
+        threading.Thread(target=self._collect, name='llm-dispatch', daemon=True).start()
+
+    # The prompt's shared future and whether it was already in flight; None once closed
+    def submit(self, prompt: str):
+        with self.condition:
+            if self.closed:
+                return None
+            future = self.in_flight.get(prompt) if DISPATCH_CONFIG['coalesce'] else None
+            if future is not None:
+                _count('requests')
+                _count('coalesced')
+                return future, True
+            future = Future()
+            self.in_flight[prompt] = future
+            self.pending.append((prompt, future, time.perf_counter()))
+            self.condition.notify()
+        with _stats_lock:
+            _dispatch_stats['requests'] += 1
+            _dispatch_stats['queue_depth'] += 1
+            _dispatch_stats['queue_depth_max'] = max(_dispatch_stats['queue_depth_max'], _dispatch_stats['queue_depth'])
+        return future, False
+
+    # Stop taking prompts; the queued ones are still sent, then the threads exit
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def _serve(self):
+        self.loop.run_forever()
+        # Clients without a native async path run in the loop's default executor
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+
+    def _collect(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    break
+                deadline = time.perf_counter() + DISPATCH_CONFIG['batch_window_ms'] / 1000
+                while len(self.pending) < DISPATCH_CONFIG['max_batch_size'] and not self.closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.pending[:DISPATCH_CONFIG['max_batch_size']]
+                del self.pending[:len(batch)]
+            with _stats_lock:
+                _dispatch_stats['batches'] += 1
+                _dispatch_stats['batched_prompts'] += len(batch)
+                _dispatch_stats['batch_size_max'] = max(_dispatch_stats['batch_size_max'], len(batch))
+            for part in ([batch] if DISPATCH_CONFIG['native_batch'] else [[item] for item in batch]):
+                running = asyncio.run_coroutine_threadsafe(self._run(part, len(batch)), self.loop)
+                self.running.add(running)
+                running.add_done_callback(self.running.discard)
+        wait(list(self.running))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def _run(self, batch: list, batch_size: int):
+        async with self.slots:
+            start_time = time.perf_counter()
+            waits = [start_time - enqueued_at for _, _, enqueued_at in batch]
+            with _stats_lock:
+                _dispatch_stats['queue_depth'] -= len(batch)
+                _dispatch_stats['sent'] += len(batch)
+                _dispatch_stats['queue_wait_total'] += sum(waits)
+                _dispatch_stats['queue_wait_max'] = max(_dispatch_stats['queue_wait_max'], *waits)
+            try:
+                result = await self.llm.agenerate([prompt for prompt, _, _ in batch])
+                outcomes = [
+                    (generations[0].text, {**(generations[0].generation_info or {}), 'dispatch_queue_time': wait_time, 'dispatch_batch_size': batch_size})
+                    for generations, wait_time in zip(result.generations, waits)
+                ]
+                error = None
+            except Exception as e:
+                outcomes, error = [], e
+                _count('errors')
+        # Leave in_flight before the result is set, so a later identical prompt starts a new generation
+        with self.condition:
+            for prompt, _, _ in batch:
+                self.in_flight.pop(prompt, None)
+        for index, (_, future, _) in enumerate(batch):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(outcomes[index])
+
+def _submit(llm, prompt: str) -> tuple:
+    while True:
+        with _dispatchers_lock:
+            dispatcher = _dispatchers.get(id(llm))
+            if dispatcher is None:
+                dispatcher = _Dispatcher(llm)
+                _dispatchers[id(llm)] = dispatcher
+        submitted = dispatcher.submit(prompt)
+        if submitted is not None:
+            return submitted
+
+# Drop the llm's dispatcher, e.g. when the model registry releases the llm. Prompts
+# already queued are still answered; later calls start a new dispatcher.
+def close_dispatcher(llm):
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.pop(id(llm), None)
+    if dispatcher is not None:
+        dispatcher.close()
+
+def _result(outcome: tuple, coalesced: bool) -> tuple:
+    text, generation_info = outcome
+    return text, {**generation_info, 'dispatch_coalesced': coalesced}
+
+# Completion of one prompt as (text, generation_info); blocks until its batch has run
+def generate(llm, prompt: str) -> tuple:
+    if not DISPATCH_CONFIG['enabled']:
+        generation = llm.generate([prompt]).generations[0][0]
+        return generation.text, generation.generation_info
+    future, coalesced = _submit(llm, prompt)
+    return _result(future.result(), coalesced)
+
+# Same as generate() without blocking the event loop. The shared future is shielded, so a
+# cancelled caller does not cancel the completion other callers are waiting for.
+async def agenerate(llm, prompt: str) -> tuple:
+    if not DISPATCH_CONFIG['enabled']:
+        result = await llm.agenerate([prompt])
+        generation = result.generations[0][0]
+        return generation.text, generation.generation_info
+    future, coalesced = _submit(llm, prompt)
+    return _result(await asyncio.shield(asyncio.wrap_future(future)), coalesced)
+
+def get_dispatch_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_dispatch_stats)
+    stats['coalesce_rate'] = stats['coalesced'] / stats['requests'] if stats['requests'] else 0.0
+    stats['batch_size_avg'] = stats['batched_prompts'] / stats['batches'] if stats['batches'] else 0.0
+    stats['queue_wait_avg'] = stats['queue_wait_total'] / stats['sent'] if stats['sent'] else 0.0
+    return stats
@@ -0,0 +1,355 @@
+import sys
+import os
+import math
+import sqlite3
+import logging
+import threading
+from functools import lru_cache
+
+sys.path.append('.')
+
+from prompt.prompts import DATA_FIELDS_MEANING, DB_CONFIG, EXECUTION_CONFIG
+from utils.dataset_utils import ROOT_DIR, get_csv_path, get_column_types, iter_csv_chunks, convert_value, clear_dataset_caches
+from utils.sql_utils import translate_postgres_to_sqlite
+from utils.trace_utils import timed
+from utils.execution_utils import (
+    new_query_id, register_query, unregister_query, was_cancelled, fetch_capped, start_watchdog,
+    timeout_result, cancelled_result
+)
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_SQLITE_TYPES = {'INTEGER': 'INTEGER', 'BIGINT': 'INTEGER', 'FLOAT': 'REAL', 'DATE': 'TEXT', 'TEXT': 'TEXT'}
+_DUCKDB_TYPES = {'INTEGER': 'INTEGER', 'BIGINT': 'BIGINT', 'FLOAT': 'DOUBLE', 'DATE': 'DATE', 'TEXT': 'VARCHAR'}
+
+# === SQLITE STAND-IN LOADED FROM dataset/*.csv ===
+
+def _csv_tables() -> list:
+    return [table_name for table_name in DATA_FIELDS_MEANING if get_csv_path(table_name)]
+
+# Changes when a CSV is replaced, edited, added or removed
+def _csv_signature(tables: list) -> tuple:
+    signature = []
+    for table_name in tables:
+        stat = os.stat(get_csv_path(table_name))
+        signature.append((table_name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def _is_stale(db_path: str, tables: list) -> bool:
+    if not os.path.exists(db_path):
+        return True
+    built_at = os.path.getmtime(db_path)
+    return any(os.path.getmtime(get_csv_path(table_name)) > built_at for table_name in tables)
+
+def _load_sqlite_table(conn, table_name: str):
+    column_types = get_column_types(table_name)
+    columns_sql = ', '.join(f'"{column}" {_SQLITE_TYPES[column_type]}' for column, column_type in column_types)
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    conn.execute(f'CREATE TABLE "{table_name}" ({columns_sql})')
+    placeholders = ', '.join('?' for _ in column_types)
+    rows_loaded = 0
+    for chunk in iter_csv_chunks(get_csv_path(table_name)):
+        conn.executemany(
+            f'INSERT INTO "{table_name}" VALUES ({placeholders})',
+            (
+                tuple(convert_value(value, column_type) for value, (_, column_type) in zip(row, column_types))
+                for row in chunk
+            )
+        )
+        rows_loaded += len(chunk)
+    logger.info(f"Loaded {rows_loaded} rows into embedded table '{table_name}'")
+
+# Build (or rebuild when a CSV changed) the persisted SQLite database file
+def build_sqlite_database(db_path: str, force: bool = False) -> str:
+    tables = _csv_tables()
+    if not force and not _is_stale(db_path, tables):
+        return db_path
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        for table_name in tables:
+            _load_sqlite_table(conn, table_name)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    return db_path
+
+# PostgreSQL aggregates the generated SQL relies on that SQLite lacks
+class _StddevSamp:
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(float(value))
+
+    def finalize(self):
+        n = len(self.values)
+        if n < 2:
+            return None
+        mean = sum(self.values) / n
+        return math.sqrt(sum((v - mean) ** 2 for v in self.values) / (n - 1))
+
+class _Corr:
+    def __init__(self):
+        self.pairs = []
+
+    def step(self, y, x):
+        if y is not None and x is not None:
+            self.pairs.append((float(y), float(x)))
+
+    def finalize(self):
+        n = len(self.pairs)
+        if n < 2:
+            return None
+        mean_y = sum(y for y, _ in self.pairs) / n
+        mean_x = sum(x for _, x in self.pairs) / n
+        cov = sum((y - mean_y) * (x - mean_x) for y, x in self.pairs)
+        var_y = sum((y - mean_y) ** 2 for y, _ in self.pairs)
+        var_x = sum((x - mean_x) ** 2 for _, x in self.pairs)
+        if var_y == 0 or var_x == 0:
+            return None
+        return cov / math.sqrt(var_y * var_x)
+
+_thread_local = threading.local()
+
+# Bumped by every (re)build; a connection opened before it still reads the replaced file
+_generation = 0
+
+# One read-only connection per thread (sqlite3 connections are not shared across threads)
+def get_sqlite_connection(db_path: str):
+    connections = getattr(_thread_local, 'connections', None)
+    if connections is None:
+        connections = _thread_local.connections = {}
+    conn, generation = connections.get(db_path, (None, None))
+    if conn is not None and generation != _generation:
+        conn.close()
+        conn = None
+    if conn is None:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        conn.create_aggregate('stddev', 1, _StddevSamp)
+        conn.create_aggregate('stddev_samp', 1, _StddevSamp)
+        conn.create_aggregate('corr', 2, _Corr)
+        connections[db_path] = (conn, _generation)
+    return conn
+
+def sqlite_table_exists(db_path: str, table_name: str) -> bool:
+    row = get_sqlite_connection(db_path).execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone()
+    return row is not None
+
+# Execute with the same guards as db_utils.run_query: a watchdog interrupts the statement
+# after timeout_ms, cancel_query(query_id) interrupts it from any thread, and at most
+# max_rows/max_bytes of the result are kept. Same result shape as db_utils.run_query.
+def _run_guarded(execute, interrupt, query_id: str = None, timeout_ms: int = None, max_rows: int = None, max_bytes: int = None,
+                 timings: dict = None) -> dict:
+    query_id = query_id or new_query_id()
+    timeout_ms = timeout_ms or EXECUTION_CONFIG['statement_timeout_ms']
+    expired = []
+
+    def on_timeout():
+        expired.append(True)
+        interrupt()
+
+    register_query(query_id, interrupt)
+    watchdog = start_watchdog(on_timeout, timeout_ms)
+    try:
+        with timed(timings, 'db_execute'):
+            cur = execute()
+        if not cur.description:
+            return {'data': None, 'columns': [], 'error': "No data returned"}
+        columns = [desc[0] for desc in cur.description]
+        with timed(timings, 'db_fetch'):
+            rows, truncated, timed_out = fetch_capped(cur, max_rows, max_bytes)
+        if timed_out or expired:
+            return timeout_result(timeout_ms, columns, rows)
+        return {'data': rows, 'columns': columns, 'error': None, 'truncated': truncated, 'timed_out': False, 'cancelled': False}
+    except Exception as e:
+        if was_cancelled(query_id):
+            return cancelled_result()
+        if expired:
+            return timeout_result(timeout_ms)
+        return {'data': None, 'columns': [], 'error': str(e)}
+    finally:
+        watchdog.cancel()
+        unregister_query(query_id)
+
+def run_sqlite_query(db_path: str, query: str, table_name: str = None, query_id: str = None,
+                     timeout_ms: int = None, max_rows: int = None, max_bytes: int = None, timings: dict = None) -> dict:
+    if not query:
+        return {'data': None, 'columns': [], 'error': "No query provided"}
+    with timed(timings, 'db_connect'):
+        if table_name and not sqlite_table_exists(db_path, table_name):
+            return {'data': None, 'columns': [], 'error': f"Table '{table_name}' does not exist. Please create the table and load the data."}
+        conn = get_sqlite_connection(db_path)
+    return _run_guarded(lambda: conn.execute(translate_postgres_to_sqlite(query)), conn.interrupt, query_id, timeout_ms, max_rows, max_bytes, timings)
+
+# === DUCKDB (COLUMNAR) ENGINE ===
+# DuckDB understands the PostgreSQL dialect the prompts ask for, so queries run unchanged
+
+def _load_duckdb_table(conn, table_name: str):
+    column_types = get_column_types(table_name)
+    path = get_csv_path(table_name)
+    names = [column for column, _ in column_types]
+    casts = []
+    for column, column_type in column_types:
+        value = f"NULLIF(\"{column}\", '')"
+        if column_type in ('INTEGER', 'BIGINT'):
+            # Integral values may be written as 2000.0 in the CSVs; the direct cast comes first
+            # so integers above 2**53 are not rounded through DOUBLE
+            target = _DUCKDB_TYPES[column_type]
+            casts.append(f'COALESCE(TRY_CAST({value} AS {target}), CAST(CAST({value} AS DOUBLE) AS {target})) AS "{column}"')
+        else:
+            casts.append(f'CAST({value} AS {_DUCKDB_TYPES[column_type]}) AS "{column}"')
+    columns_sql = ', '.join(f'"{column}" {_DUCKDB_TYPES[column_type]}' for column, column_type in column_types)
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    conn.execute(f'CREATE TABLE "{table_name}" ({columns_sql})')
+    conn.execute(
+        f'INSERT INTO "{table_name}" SELECT {", ".join(casts)} '
+        f'FROM read_csv(?, header = true, all_varchar = true, names = ?)',
+        [path, names]
+    )
+    rows_loaded = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+    logger.info(f"Loaded {rows_loaded} rows into embedded table '{table_name}'")
+
+def build_duckdb_database(db_path: str, force: bool = False) -> str:
+    import duckdb
+
+    tables = _csv_tables()
+    if not force and not _is_stale(db_path, tables):
+        return db_path
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = duckdb.connect(tmp_path)
+    try:
+        for table_name in tables:
+            _load_duckdb_table(conn, table_name)
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    return db_path
+
+_duckdb_connections = {}
+_duckdb_lock = threading.Lock()
+
+# DuckDB connections are shared per file; each thread works on its own cursor
+def get_duckdb_cursor(db_path: str):
+    import duckdb
+
+    cursors = getattr(_thread_local, 'duckdb_cursors', None)
+    if cursors is None:
+        cursors = _thread_local.duckdb_cursors = {}
+    cursor, generation = cursors.get(db_path, (None, None))
+    if cursor is None or generation != _generation:
+        with _duckdb_lock:
+            conn, generation = _duckdb_connections.get(db_path, (None, None))
+            if conn is None or generation != _generation:
+                if conn is not None:
+                    # DuckDB reuses the open database instance of a path, which would keep
+                    # serving the replaced file; a query still running on it fails once
+                    conn.close()
+                conn = duckdb.connect(db_path, read_only=True)
+                _duckdb_connections[db_path] = (conn, _generation)
+        cursor = conn.cursor()
+        cursors[db_path] = (cursor, _generation)
+    return cursor
+
+def run_duckdb_query(db_path: str, query: str, table_name: str = None, query_id: str = None,
+                     timeout_ms: int = None, max_rows: int = None, max_bytes: int = None, timings: dict = None) -> dict:
+    if not query:
+        return {'data': None, 'columns': [], 'error': "No query provided"}
+    try:
+        with timed(timings, 'db_connect'):
+            cursor = get_duckdb_cursor(db_path)
+            if table_name and not duckdb_table_exists(db_path, table_name):
+                return {'data': None, 'columns': [], 'error': f"Table '{table_name}' does not exist. Please create the table and load the data."}
+    except Exception as e:
+        return {'data': None, 'columns': [], 'error': str(e)}
+    return _run_guarded(lambda: cursor.execute(query), cursor.interrupt, query_id, timeout_ms, max_rows, max_bytes, timings)
+
+def duckdb_table_exists(db_path: str, table_name: str) -> bool:
+    row = get_duckdb_cursor(db_path).execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_name = ?", [table_name]
+    ).fetchone()
+    return row is not None
+
+# === BACKEND SELECTION ===
+
+@lru_cache(maxsize=None)
+def _resolve_engine(engine: str) -> str:
+    if engine == 'duckdb':
+        try:
+            import duckdb  # noqa: F401
+        except ImportError:
+            logger.warning("duckdb is not installed; falling back to the SQLite embedded engine")
+            return 'sqlite'
+    return engine
+
+def resolve_engine(engine: str = None) -> str:
+    return _resolve_engine(engine or DB_CONFIG['embedded_engine'])
+
+def get_embedded_path(engine: str) -> str:
+    path = DB_CONFIG[f'{engine}_path']
+    return path if os.path.isabs(path) else os.path.join(ROOT_DIR, path)
+
+_built_databases = {}   # engine -> (db_path, CSV signature it was built from)
+_build_lock = threading.Lock()
+
+# Build the engine's database file on first use and rebuild it when a CSV changes, also
+# within the same process
+def get_embedded_database(engine: str = None):
+    global _generation
+    engine = resolve_engine(engine)
+    signature = _csv_signature(_csv_tables())
+    with _build_lock:
+        built = _built_databases.get(engine)
+        if built is None or built[1] != signature:
+            db_path = get_embedded_path(engine)
+            if built is not None:
+                logger.info(f"Dataset CSVs changed; rebuilding the embedded {engine} database")
+                clear_dataset_caches()
+            if engine == 'duckdb':
+                build_duckdb_database(db_path, force=built is not None)
+            else:
+                build_sqlite_database(db_path, force=built is not None)
+            _generation += 1
+            built = _built_databases[engine] = (db_path, signature)
+    return engine, built[0]
+
+# timings, when given, is filled with the (start, end) perf_counter intervals of the
+# db_connect, db_execute and db_fetch steps
+def run_embedded_query(query: str, table_name: str = None, engine: str = None, query_id: str = None,
+                       timeout_ms: int = None, max_rows: int = None, max_bytes: int = None, timings: dict = None) -> dict:
+    try:
+        with timed(timings, 'db_connect'):
+            engine, db_path = get_embedded_database(engine)
+    except Exception as e:
+        logger.error(f"Failed to prepare embedded database: {str(e)}")
+        return {'data': None, 'columns': [], 'error': "Database connection failed"}
+    if engine == 'duckdb':
+        return run_duckdb_query(db_path, query, table_name, query_id, timeout_ms, max_rows, max_bytes, timings)
+    return run_sqlite_query(db_path, query, table_name, query_id, timeout_ms, max_rows, max_bytes, timings)
+
+def embedded_table_exists(table_name: str, engine: str = None) -> bool:
+    try:
+        engine, db_path = get_embedded_database(engine)
+        if engine == 'duckdb':
+            return duckdb_table_exists(db_path, table_name)
+        return sqlite_table_exists(db_path, table_name)
+    except Exception as e:
+        logger.error(f"Failed to check table existence: {str(e)}")
+        return False
+
+# Changes whenever the database file is rebuilt, for result-cache invalidation
+def get_embedded_version(engine: str = None):
+    engine, db_path = get_embedded_database(engine)
+    return (engine, os.path.getmtime(db_path))
@@ -0,0 +1,189 @@
+import sys
+import os
+import glob
+import json
+import math
+import hashlib
+import logging
+import threading
+
+sys.path.append('.')
+
+from prompt.prompts import DATASET_CONFIG, FEWSHOT_CONFIG
+from utils.schema_utils import tokenize_text, STOPWORDS
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Few-shot examples for the SQL prompt, retrieved from the gold question/SQL pairs in
+# query/output/*/<dataset>/gold_sql (the same pairs are stored once per model folder).
+# Questions are TF-IDF vectors over words and word pairs, with numbers reduced to their
+# shape, so "net income of d10 category of US in 2015" finds "net income of d1 category
+# of Thailand in 2009". The index is persisted to FEWSHOT_CONFIG['index_path'] and loaded
+# on first use; it is rebuilt when the gold files change.
+#
+# {'signature': str, 'tables': {table_name: {'examples': [{'question', 'query'}],
+#  'idf': {term: idf}, 'vectors': [{term: weight}]}}}
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+_index = None
+_index_lock = threading.Lock()
+
+# Rough token estimate (about 4 characters per token for English and SQL)
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def _normalize_question(question: str) -> str:
+    return ' '.join(question.lower().split()).rstrip('?.! ')
+
+def _terms(question: str) -> list:
+    words = []
+    for token in tokenize_text(question):
+        if token in STOPWORDS:
+            continue
+        if token.isdigit():
+            token = '<year>' if len(token) == 4 else '<number>'
+        words.append(token)
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+def _tf(question: str) -> dict:
+    counts = {}
+    for term in _terms(question):
+        counts[term] = counts.get(term, 0) + 1
+    return {term: 1 + math.log(count) for term, count in counts.items()}
+
+def _unit(vector: dict) -> dict:
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+# === CORPUS ===
+
+def _corpus_files() -> dict:
+    files = {}
+    for dataset, table_name in DATASET_CONFIG['tables'].items():
+        pattern = os.path.join(ROOT_DIR, FEWSHOT_CONFIG['corpus'].format(dataset=dataset))
+        files[table_name] = sorted(glob.glob(pattern))
+    return files
+
+def _signature(files: dict) -> str:
+    digest = hashlib.sha1()
+    for table_name, paths in sorted(files.items()):
+        for path in paths:
+            stat = os.stat(path)
+            digest.update(f"{table_name}\0{os.path.relpath(path, ROOT_DIR)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+# Gold pairs per table, one per distinct question
+def load_gold_examples(files: dict = None) -> dict:
+    examples = {}
+    for table_name, paths in (files or _corpus_files()).items():
+        seen = set()
+        for path in paths:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    pair = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping gold example {path}: {str(e)}")
+                continue
+            question, query = pair.get('question'), pair.get('query')
+            if not question or not query or _normalize_question(question) in seen:
+                continue
+            seen.add(_normalize_question(question))
+            examples.setdefault(table_name, []).append({'question': question, 'query': ' '.join(query.split())})
+    return examples
+
+# === INDEX ===
+
+def _build_table(examples: list) -> dict:
+    frequencies = [_tf(example['question']) for example in examples]
+    document_frequency = {}
+    for frequency in frequencies:
+        for term in frequency:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    idf = {term: math.log((1 + len(examples)) / (1 + df)) + 1 for term, df in document_frequency.items()}
+    vectors = [_unit({term: weight * idf[term] for term, weight in frequency.items()}) for frequency in frequencies]
+    return {'examples': examples, 'idf': idf, 'vectors': vectors}
+
+def build_example_index(files: dict = None) -> dict:
+    files = files or _corpus_files()
+    tables = {table_name: _build_table(examples) for table_name, examples in load_gold_examples(files).items()}
+    return {'signature': _signature(files), 'tables': tables}
+
+def _load_index() -> dict:
+    files = _corpus_files()
+    signature = _signature(files)
+    path = os.path.join(ROOT_DIR, FEWSHOT_CONFIG['index_path'])
+    try:
+        with open(path, encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('signature') == signature:
+            return index
+    except (OSError, ValueError):
+        pass
+    index = build_example_index(files)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.warning(f"Could not persist the few-shot index: {str(e)}")
+    logger.info(f"Built few-shot index: {sum(len(table['examples']) for table in index['tables'].values())} examples")
+    return index
+
+def get_example_index() -> dict:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _load_index()
+    return _index
+
+# Drop the loaded index, e.g. after new gold SQL was saved; the next lookup reloads it
+def reset_example_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+# === RETRIEVAL ===
+
+# Up to k gold pairs for the question's table, most similar first, whose questions and
+# SQL fit in max_tokens together. exclude drops pairs by question (leave-one-out evaluation).
+def select_examples(question: str, table_name: str, k: int = None, max_tokens: int = None, exclude: tuple = ()) -> list:
+    k = FEWSHOT_CONFIG['k'] if k is None else k
+    max_tokens = FEWSHOT_CONFIG['max_tokens'] if max_tokens is None else max_tokens
+    table = get_example_index()['tables'].get(table_name)
+    if not table or k <= 0:
+        return []
+    idf = table['idf']
+    default_idf = math.log(1 + len(table['examples'])) + 1
+    query = _unit({term: weight * idf.get(term, default_idf) for term, weight in _tf(question).items()})
+    excluded = {_normalize_question(text) for text in exclude}
+    scored = []
+    for example, vector in zip(table['examples'], table['vectors']):
+        similarity = sum(weight * vector[term] for term, weight in query.items() if term in vector)
+        if similarity >= FEWSHOT_CONFIG['min_similarity'] and _normalize_question(example['question']) not in excluded:
+            scored.append((similarity, example))
+    scored.sort(key=lambda item: item[0], reverse=True)
+
+    selected = []
+    budget = max_tokens
+    for similarity, example in scored:
+        cost = estimate_tokens(example['question']) + estimate_tokens(example['query'])
+        if cost > budget:
+            continue
+        budget -= cost
+        selected.append({**example, 'similarity': round(similarity, 4)})
+        if len(selected) == k:
+            break
+    return selected
+
+# Chat messages for the examples: each question as a human turn answered by its SQL
+def example_messages(examples: list) -> list:
+    messages = []
+    for example in examples:
+        messages.append(('human', example['question']))
+        messages.append(('ai', example['query']))
+    return messages
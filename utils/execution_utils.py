@@ -0,0 +1,113 @@
+import sys
+import time
+import uuid
+import logging
+import threading
+
+sys.path.append('.')
+
+from prompt.prompts import EXECUTION_CONFIG
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# === RUNNING QUERY REGISTRY ===
+# Each running statement registers a cancel callback (connection.cancel() for PostgreSQL,
+# interrupt() for the embedded engines), so any thread can stop it by query_id
+
+_running_queries = {}
+_running_lock = threading.Lock()
+
+def new_query_id() -> str:
+    return uuid.uuid4().hex
+
+def register_query(query_id: str, cancel):
+    with _running_lock:
+        _running_queries[query_id] = {'cancel': cancel, 'cancelled': False, 'started_at': time.monotonic()}
+
+def unregister_query(query_id: str) -> bool:
+    with _running_lock:
+        entry = _running_queries.pop(query_id, None)
+    return bool(entry and entry['cancelled'])
+
+def was_cancelled(query_id: str) -> bool:
+    with _running_lock:
+        entry = _running_queries.get(query_id)
+    return bool(entry and entry['cancelled'])
+
+def cancel_query(query_id: str) -> bool:
+    with _running_lock:
+        entry = _running_queries.get(query_id)
+        if entry is None:
+            return False
+        entry['cancelled'] = True
+    try:
+        entry['cancel']()
+        logger.info(f"Cancelled query {query_id}")
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to cancel query {query_id}: {str(e)}")
+        return False
+
+def cancel_all_queries() -> int:
+    with _running_lock:
+        query_ids = list(_running_queries)
+    return sum(cancel_query(query_id) for query_id in query_ids)
+
+def running_queries() -> dict:
+    now = time.monotonic()
+    with _running_lock:
+        return {query_id: now - entry['started_at'] for query_id, entry in _running_queries.items()}
+
+# === CAPPED FETCHING ===
+
+def _row_bytes(row) -> int:
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+# Fetch at most max_rows rows / about max_bytes bytes in fetchmany batches, stopping early
+# once deadline (a time.monotonic() value) has passed. Returns (rows, truncated, timed_out).
+def fetch_capped(cursor, max_rows: int = None, max_bytes: int = None, fetch_size: int = None, deadline: float = None):
+    max_rows = max_rows or EXECUTION_CONFIG['max_rows']
+    max_bytes = max_bytes or EXECUTION_CONFIG['max_bytes']
+    fetch_size = fetch_size or EXECUTION_CONFIG['fetch_size']
+    rows = []
+    total_bytes = 0
+    while True:
+        if deadline is not None and time.monotonic() > deadline:
+            return rows, True, True
+        batch = cursor.fetchmany(min(fetch_size, max_rows - len(rows) + 1))
+        if not batch:
+            return rows, False, False
+        for row in batch:
+            if len(rows) >= max_rows:
+                return rows, True, False
+            total_bytes += _row_bytes(row)
+            if total_bytes > max_bytes:
+                return rows, True, False
+            rows.append(row)
+
+# Interrupt a statement from a timer thread once timeout_ms has passed (for engines without
+# a server-side statement_timeout). Call cancel() on the returned timer when done.
+def start_watchdog(interrupt, timeout_ms: int) -> threading.Timer:
+    timer = threading.Timer(timeout_ms / 1000, interrupt)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+# === STRUCTURED RESULTS ===
+
+def timeout_result(timeout_ms: int, columns: list = None, data: list = None) -> dict:
+    return {
+        'data': data, 'columns': columns or [], 'error': None if data else f"Query timed out after {timeout_ms / 1000:g}s",
+        'truncated': bool(data), 'timed_out': True, 'cancelled': False
+    }
+
+def cancelled_result() -> dict:
+    return {'data': None, 'columns': [], 'error': "Query was cancelled", 'truncated': False, 'timed_out': False, 'cancelled': True}
@@ -0,0 +1,169 @@
+import sys
+import io
+import csv
+import json
+import math
+import decimal
+import logging
+from itertools import chain
+
+sys.path.append('.')
+
+from prompt.prompts import RESULT_FORMAT_CONFIG
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Query results are compact: {'columns': [...], 'data': [row tuples straight from the cursor]}.
+# The formatters below walk the rows once and yield text piece by piece, so nothing besides
+# the rows themselves is held in memory and output can go straight to a file or socket.
+
+def _status_message(result: dict):
+    if result.get('error'):
+        return f"Error: {result['error']}"
+    if not result.get('data'):
+        return "Query ran successfully, no record found"
+    if not result.get('columns'):
+        return "No columns returned"
+    return None
+
+def _truncation_note(result: dict) -> str:
+    reason = "the query timed out" if result.get('timed_out') else "the result was too large"
+    return f"(Only the first {len(result['data'])} rows are shown because {reason}.)"
+
+def iter_markdown(result: dict):
+    message = _status_message(result)
+    if message is not None:
+        yield message
+        return
+    columns = result['columns']
+    yield "| " + " | ".join(columns) + " |"
+    yield "\n| " + " | ".join(["---"] * len(columns)) + " |"
+    for row in result['data']:
+        yield "\n| " + " | ".join(str(value) for value in row) + " |"
+    if result.get('truncated'):
+        yield "\n\n" + _truncation_note(result)
+
+def iter_csv(result: dict):
+    if result.get('error'):
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chain([result.get('columns') or []], result.get('data') or []):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def iter_json(result: dict):
+    yield '{"columns": ' + json.dumps(result.get('columns') or [], ensure_ascii=False) + ', "rows": ['
+    for i, row in enumerate(result.get('data') or []):
+        yield (', ' if i else '') + json.dumps(list(row), ensure_ascii=False, default=str)
+    yield '], "error": ' + json.dumps(result.get('error'))
+    yield ', "truncated": ' + json.dumps(bool(result.get('truncated'))) + '}'
+
+_FORMATTERS = {'markdown': iter_markdown, 'csv': iter_csv, 'json': iter_json}
+
+def format_result(result: dict, fmt: str = 'markdown') -> str:
+    return ''.join(_FORMATTERS[fmt](result))
+
+def write_result(result: dict, f, fmt: str = 'markdown') -> int:
+    written = 0
+    for piece in _FORMATTERS[fmt](result):
+        written += f.write(piece)
+    return written
+
+# === SUMMARIZATION FOR THE LLM ===
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool)
+
+def _format_number(value) -> str:
+    value = float(value)
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return f"{value:.4g}" if abs(value) >= 1e6 or abs(value) < 1e-3 else f"{value:.4f}".rstrip('0').rstrip('.')
+
+# A single value as it should read in an answer sentence
+def format_value(value) -> str:
+    if value is None:
+        return "no value"
+    if _is_number(value):
+        if math.isnan(float(value)):
+            return "no value"
+        return _format_number(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+# Per-column statistics, walking the result column by column
+def column_stats(result: dict) -> dict:
+    top_values = RESULT_FORMAT_CONFIG['top_values']
+    rows = result.get('data') or []
+    stats = {}
+    for column, values in zip(result.get('columns') or [], zip(*rows)):
+        present = [value for value in values if value is not None]
+        numeric = [float(value) for value in present if _is_number(value) and not math.isnan(float(value))]
+        column_stat = {'nulls': len(values) - len(present)}
+        if present and len(numeric) == len(present):
+            column_stat.update({
+                'min': min(numeric), 'max': max(numeric), 'mean': sum(numeric) / len(numeric)
+            })
+        else:
+            counts = {}
+            for value in present:
+                key = str(value)
+                counts[key] = counts.get(key, 0) + 1
+            column_stat['distinct'] = len(counts)
+            column_stat['top'] = sorted(counts, key=counts.get, reverse=True)[:top_values]
+        stats[column] = column_stat
+    return stats
+
+def _describe_column(column: str, stat: dict) -> str:
+    nulls = f", {stat['nulls']} empty" if stat['nulls'] else ""
+    if 'mean' in stat:
+        return (f"- {column}: min {_format_number(stat['min'])}, max {_format_number(stat['max'])}, "
+                f"mean {_format_number(stat['mean'])}{nulls}")
+    return f"- {column}: {stat['distinct']} distinct values (e.g. {', '.join(stat['top'])}){nulls}"
+
+# Text handed to the response LLM: the whole table when it fits the token budget, otherwise
+# per-column statistics plus as many leading rows as still fit (SQL output is usually
+# ordered, so the first rows matter most)
+def summarize_result(result: dict, token_budget: int = None) -> str:
+    # Same rule of thumb as the prompt benchmarks: about 4 characters per token
+    budget = (token_budget or RESULT_FORMAT_CONFIG['token_budget']) * 4
+    message = _status_message(result)
+    if message is not None:
+        return message
+
+    pieces = []
+    used = 0
+    for piece in iter_markdown(result):
+        used += len(piece)
+        if used > budget:
+            break
+        pieces.append(piece)
+    else:
+        return ''.join(pieces)
+
+    rows = result['data']
+    columns = result['columns']
+    lines = [f"The query returned {len(rows)} rows{' (truncated)' if result.get('truncated') else ''}; too many to list in full.",
+             "Column summary:"]
+    lines.extend(_describe_column(column, stat) for column, stat in column_stats(result).items())
+    lines.append("First rows:")
+    lines.append("| " + " | ".join(columns) + " |")
+    lines.append("| " + " | ".join(["---"] * len(columns)) + " |")
+    used = sum(len(line) + 1 for line in lines)
+    shown = 0
+    for row in rows:
+        line = "| " + " | ".join(str(value) for value in row) + " |"
+        if used + len(line) + 1 > budget and shown:
+            break
+        lines.append(line)
+        used += len(line) + 1
+        shown += 1
+    if shown < len(rows):
+        lines.append(f"... {len(rows) - shown} more rows not shown")
+    return "\n".join(lines)
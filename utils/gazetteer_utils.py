@@ -0,0 +1,190 @@
+import sys
+import re
+import difflib
+import logging
+import threading
+
+sys.path.append('.')
+
+from prompt.prompts import DATA_FIELDS_MEANING, GAZETTEER_CONFIG
+from utils.dataset_utils import get_csv_path, get_column_stats
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Per-table index of the entity values questions refer to (countries, codes, regions,
+# income groups, deciles, stock indices), so "US", "Europe region" or "OECD group" can be
+# grounded to the literal value in the data. Built from the CSV on first use, from the
+# database for tables without a CSV, and rebuilt after ingestion (refresh_gazetteer).
+#
+# {'keys': {key: ((column, value), ...)}, 'trie': {token: {...}}, 'buckets': {first char: [key, ...]}}
+# keys are normalized values, their unparenthesized forms and acronyms, and the aliases in
+# GAZETTEER_CONFIG; the token trie over the keys finds mentions in a question by longest match.
+
+_TERMINAL = ''
+_GENERIC_WORDS = {'group', 'groups', 'region', 'regions', 'countries', 'country', 'category', 'categories', 'economies'}
+_PARENTHESIS_RE = re.compile(r'\(([^)]*)\)')
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+|&")
+
+_gazetteers = {}
+_lock = threading.Lock()
+
+def normalize_entity(text: str) -> str:
+    return ' '.join(_normalize_token(token) for token in _TOKEN_RE.findall(text))
+
+def _normalize_token(token: str) -> str:
+    return 'and' if token == '&' else token.lower()
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def _strip_generic(key: str) -> str:
+    words = key.split()
+    if words and words[0] == 'the':
+        words = words[1:]
+    while len(words) > 1 and words[-1] in _GENERIC_WORDS:
+        words = words[:-1]
+    return ' '.join(words)
+
+# Short keys ("us", "and" from the ISO code AND) are ordinary words as often as not; in
+# free text they only count when written in capitals ("US") or containing a digit ("d10")
+def _accept_mention(key: str, words: list) -> bool:
+    return len(key) > 3 or any(char.isdigit() for char in key) or all(word.isupper() for word in words)
+
+# === SOURCES ===
+
+def _csv_values(table_name: str) -> dict:
+    columns = set(GAZETTEER_CONFIG['columns'])
+    return {
+        column: stats['distinct_values']
+        for column, stats in get_column_stats(table_name).items()
+        if column in columns and stats['inferred_type'] == 'TEXT' and stats['distinct_values']
+    }
+
+def _database_values(table_name: str) -> dict:
+    from utils.db_utils import run_query
+    fields = {field.lower() for field in DATA_FIELDS_MEANING.get(table_name, {}).get('fields', {})}
+    values = {}
+    for column in GAZETTEER_CONFIG['columns']:
+        if column not in fields:
+            continue
+        result = run_query(
+            f"SELECT DISTINCT {column} FROM {table_name} WHERE {column} IS NOT NULL LIMIT {GAZETTEER_CONFIG['max_values']}",
+            table_name
+        )
+        if result.get('error'):
+            logger.warning(f"Gazetteer could not read {table_name}.{column}: {result['error']}")
+            continue
+        values[column] = sorted(str(row[0]) for row in result.get('data') or [])
+    return values
+
+# === INDEX ===
+
+def _build(values: dict) -> dict:
+    keys = {}
+
+    def add(key, column, value):
+        if key:
+            keys.setdefault(key, set()).add((column, value))
+
+    for column, column_values in values.items():
+        for value in column_values:
+            add(normalize_entity(value), column, value)
+    exact = set(keys)
+    # Unparenthesized forms and acronyms, unless they are some other value's exact name
+    # ("South Asia (IDA & IBRD)" must not answer for "South Asia")
+    for column, column_values in values.items():
+        for value in column_values:
+            for variant in (normalize_entity(_PARENTHESIS_RE.sub(' ', value)), *map(normalize_entity, _PARENTHESIS_RE.findall(value))):
+                if variant not in exact:
+                    add(variant, column, value)
+    for alias, target in GAZETTEER_CONFIG['aliases'].items():
+        matches = keys.get(normalize_entity(target))
+        for column, value in sorted(matches or ()):
+            if value == target:
+                add(normalize_entity(alias), column, value)
+
+    trie = {}
+    for key in keys:
+        node = trie
+        for token in key.split():
+            node = node.setdefault(token, {})
+        node[_TERMINAL] = key
+    buckets = {}
+    for key in keys:
+        buckets.setdefault(key[0], []).append(key)
+    return {'keys': {key: tuple(sorted(matches)) for key, matches in keys.items()}, 'trie': trie, 'buckets': buckets}
+
+def get_gazetteer(table_name: str) -> dict:
+    gazetteer = _gazetteers.get(table_name)
+    if gazetteer is None:
+        values = _csv_values(table_name) if get_csv_path(table_name) else {}
+        if not values and GAZETTEER_CONFIG['query_database']:
+            values = _database_values(table_name)
+        gazetteer = _build(values)
+        with _lock:
+            _gazetteers[table_name] = gazetteer
+    return gazetteer
+
+# Rebuild a table's gazetteer from the database, e.g. after ingestion changed its values
+def refresh_gazetteer(table_name: str):
+    values = _database_values(table_name) if table_name in DATA_FIELDS_MEANING else {}
+    if not values:
+        with _lock:
+            _gazetteers.pop(table_name, None)
+        return
+    gazetteer = _build(values)
+    with _lock:
+        _gazetteers[table_name] = gazetteer
+
+# === LOOKUPS ===
+
+# (column, value) candidates for a mention such as "US", "indebt countries group" or "Vietnan"
+def lookup_entity(phrase: str, table_name: str) -> tuple:
+    gazetteer = get_gazetteer(table_name)
+    key = normalize_entity(phrase)
+    for candidate in (key, _strip_generic(key)):
+        if candidate in gazetteer['keys']:
+            return gazetteer['keys'][candidate]
+    key = _strip_generic(key)
+    if len(key) < 4:
+        return ()
+    close = difflib.get_close_matches(key, gazetteer['buckets'].get(key[0], []), n=1, cutoff=GAZETTEER_CONFIG['fuzzy_cutoff'])
+    return gazetteer['keys'][close[0]] if close else ()
+
+# Mentions of known values in a question, longest match first:
+# [{'text', 'matches': ((column, value), ...)}]
+def find_entities(question: str, table_name: str) -> list:
+    gazetteer = get_gazetteer(table_name)
+    words = _TOKEN_RE.findall(question)
+    tokens = [_normalize_token(word) for word in words]
+    mentions = []
+    i = 0
+    while i < len(tokens):
+        node = gazetteer['trie']
+        end, key = None, None
+        for j in range(i, len(tokens)):
+            node = node.get(tokens[j])
+            if node is None:
+                break
+            if _TERMINAL in node and _accept_mention(node[_TERMINAL], words[i:j + 1]):
+                end, key = j + 1, node[_TERMINAL]
+        if key is None:
+            i += 1
+            continue
+        mentions.append({'text': ' '.join(tokens[i:end]), 'matches': gazetteer['keys'][key]})
+        i = end
+    return mentions
+
+# "column = 'value'" hints for the SQL prompt, at most GAZETTEER_CONFIG['max_hints'] per mention
+def entity_hints(question: str, table_name: str) -> list:
+    if not GAZETTEER_CONFIG['enabled']:
+        return []
+    hints = []
+    for mention in find_entities(question, table_name):
+        for column, value in mention['matches'][:GAZETTEER_CONFIG['max_hints']]:
+            hint = f"{column} = {_literal(value)}"
+            if hint not in hints:
+                hints.append(hint)
+    return hints
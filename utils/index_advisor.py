@@ -0,0 +1,331 @@
+import argparse
+import sys
+import os
+import json
+import glob
+import time
+import logging
+from collections import Counter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from prompt.prompts import DATA_FIELDS_MEANING, DATASET_CONFIG, INDEX_ADVISOR_CONFIG
+from utils.sql_utils import tokenize_sql, canonicalize_sql, extract_sql_statement
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+OUTPUT_ROOT = os.path.join(ROOT_DIR, 'query', 'output')
+REPORT_PATH = os.path.join(ROOT_DIR, 'query', 'benchmark', 'index_advisor.json')
+
+# === WORKLOAD ===
+
+# Distinct (table, SQL) pairs from the stored pred_sql/gold_sql outputs and the live query log,
+# with how often each was seen
+def load_workload(output_root: str = OUTPUT_ROOT, log_path: str = None) -> list:
+    counts = Counter()
+    statements = {}
+
+    def add(table_name, raw_sql):
+        statement = extract_sql_statement(raw_sql)
+        if not statement or table_name not in DATA_FIELDS_MEANING:
+            return
+        key = (table_name, canonicalize_sql(statement))
+        counts[key] += 1
+        statements.setdefault(key, statement)
+
+    for path in sorted(glob.glob(os.path.join(output_root, '*', '*', '*_sql', 'question_*.json'))):
+        dataset = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        with open(path, encoding='utf-8') as f:
+            add(DATASET_CONFIG['tables'].get(dataset, dataset), json.load(f).get('query', ''))
+
+    log_path = log_path or INDEX_ADVISOR_CONFIG['query_log']
+    if log_path and os.path.exists(log_path):
+        with open(log_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                add(entry.get('table_name'), entry.get('query', ''))
+
+    return [
+        {'table_name': table_name, 'query': statements[(table_name, canonical)], 'frequency': count}
+        for (table_name, canonical), count in counts.items()
+    ]
+
+# === PREDICATE EXTRACTION ===
+
+_COMPARISONS = {'=': 'eq', '<': 'range', '>': 'range', '<=': 'range', '>=': 'range'}
+_FILTER_CLAUSES = {'where', 'on', 'having'}
+
+# Filter, sort and grouping columns of a query, restricted to the table's real columns.
+# Equality predicates keep their constant so recurring ones can become partial indexes.
+def extract_access_pattern(sql: str, table_name: str) -> dict:
+    fields = {field.lower() for field in DATA_FIELDS_MEANING[table_name]['fields']}
+    tokens = tokenize_sql(sql)
+    pattern = {'eq': [], 'range': [], 'order': [], 'group': [], 'constants': {}}
+    clause = None
+    clause_stack = []
+    for i, (kind, text) in enumerate(tokens):
+        lowered = text.lower()
+        if text == '(':
+            clause_stack.append(clause)
+            continue
+        if text == ')':
+            clause = clause_stack.pop() if clause_stack else None
+            continue
+        if kind == 'word' and lowered in _FILTER_CLAUSES | {'select', 'from', 'limit'}:
+            clause = 'filter' if lowered in _FILTER_CLAUSES else lowered
+            continue
+        if kind == 'word' and lowered in ('order', 'group') and i + 1 < len(tokens) and tokens[i + 1][1].lower() == 'by':
+            clause = lowered
+            continue
+        if kind not in ('word', 'quoted'):
+            continue
+        column = lowered.strip('"')
+        if column not in fields:
+            continue
+
+        if clause in ('order', 'group'):
+            if column not in pattern[clause]:
+                pattern[clause].append(column)
+        elif clause == 'filter' and i + 1 < len(tokens):
+            next_kind, next_text = tokens[i + 1]
+            operator = next_text.lower()
+            if operator in _COMPARISONS:
+                access = _COMPARISONS[operator]
+            elif operator == 'in':
+                access = 'eq'
+            elif operator == 'between':
+                access = 'range'
+            else:
+                continue
+            if column not in pattern[access]:
+                pattern[access].append(column)
+            if operator == '=' and i + 2 < len(tokens) and tokens[i + 2][0] in ('string', 'number'):
+                pattern['constants'].setdefault(column, tokens[i + 2][1])
+    pattern['range'] = [c for c in pattern['range'] if c not in pattern['eq']]
+    return pattern
+
+# === CANDIDATES ===
+
+def _index_key(pattern: dict, column_rank: dict, max_columns: int) -> tuple:
+    # Equality columns first (shared ones leading, so one index serves many queries),
+    # then a single range or sort column
+    key = sorted(pattern['eq'], key=lambda c: (-column_rank[c], c))
+    tail = pattern['range'][:1] or [c for c in pattern['order'] if c not in key][:1]
+    return tuple((key + tail)[:max_columns])
+
+# Candidate indexes for a workload: one per recurring access pattern, dropping keys that
+# are a prefix of another candidate, plus a partial variant when most of a candidate's
+# queries pin its leading column to the same constant
+def propose_indexes(workload: list, min_frequency: int = None, max_columns: int = None) -> list:
+    min_frequency = min_frequency or INDEX_ADVISOR_CONFIG['min_frequency']
+    max_columns = max_columns or INDEX_ADVISOR_CONFIG['max_index_columns']
+    candidates = []
+    for table_name in sorted({item['table_name'] for item in workload}):
+        items = [dict(item, pattern=extract_access_pattern(item['query'], table_name))
+                 for item in workload if item['table_name'] == table_name]
+        column_rank = Counter()
+        for item in items:
+            for column in item['pattern']['eq']:
+                column_rank[column] += item['frequency']
+
+        by_key = {}
+        for item in items:
+            key = _index_key(item['pattern'], column_rank, max_columns)
+            if key:
+                by_key.setdefault(key, []).append(item)
+        # Shortest first, so a chain of prefixes folds into its longest key
+        for key in sorted(by_key, key=len):
+            longer = next((other for other in by_key if len(other) > len(key) and other[:len(key)] == key), None)
+            if longer is not None:
+                by_key[longer].extend(by_key.pop(key))
+
+        for key, key_items in by_key.items():
+            frequency = sum(item['frequency'] for item in key_items)
+            if frequency < min_frequency:
+                continue
+            candidate = {'table_name': table_name, 'columns': list(key), 'where': None,
+                         'frequency': frequency, 'queries': [item['query'] for item in key_items]}
+            candidates.append(candidate)
+
+            constants = Counter(item['pattern']['constants'].get(key[0]) for item in key_items for _ in range(item['frequency']))
+            constant, count = constants.most_common(1)[0]
+            if len(key) > 1 and constant is not None and count / frequency >= INDEX_ADVISOR_CONFIG['partial_min_share']:
+                candidates.append({
+                    'table_name': table_name,
+                    'columns': list(key[1:]),
+                    'where': f'"{key[0]}" = {constant}',
+                    'frequency': count,
+                    'queries': [item['query'] for item in key_items
+                                if item['pattern']['constants'].get(key[0]) == constant]
+                })
+    return candidates
+
+def index_name(candidate: dict) -> str:
+    suffix = '_partial' if candidate['where'] else ''
+    return f"{candidate['table_name']}_{'_'.join(candidate['columns'])}{suffix}_idx"[:63]
+
+def index_ddl(candidate: dict, concurrently: bool = False) -> str:
+    columns = ', '.join(f'"{column}"' for column in candidate['columns'])
+    ddl = (f'CREATE INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS "{index_name(candidate)}" '
+           f'ON "{candidate["table_name"]}" ({columns})')
+    if candidate['where']:
+        ddl += f" WHERE {candidate['where']}"
+    return ddl
+
+# === EVALUATION (POSTGRESQL) ===
+
+def _existing_indexes(conn, table_name: str) -> list:
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT array_agg(a.attname ORDER BY k.ord), i.indpred IS NOT NULL
+            FROM pg_index i
+            JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord) ON true
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+            WHERE i.indrelid = to_regclass(%s)
+            GROUP BY i.indexrelid, i.indpred
+        """, (f'public.{table_name}',))
+        return [(list(columns), partial) for columns, partial in cur.fetchall()]
+
+def _is_covered(candidate: dict, existing: list) -> bool:
+    columns = candidate['columns']
+    return any(not partial and index_columns[:len(columns)] == columns for index_columns, partial in existing)
+
+def _plan_cost(cur, query: str):
+    try:
+        cur.execute("SAVEPOINT advisor_explain")
+        cur.execute(f"EXPLAIN (FORMAT JSON) {query}")
+        plan = cur.fetchone()[0]
+        cur.execute("RELEASE SAVEPOINT advisor_explain")
+        return plan[0]['Plan']['Total Cost']
+    except Exception:
+        cur.execute("ROLLBACK TO SAVEPOINT advisor_explain")
+        return None
+
+def _measure(cur, query: str, trials: int):
+    timings = []
+    for _ in range(trials):
+        cur.execute("SAVEPOINT advisor_run")
+        try:
+            start_time = time.perf_counter()
+            cur.execute(query)
+            cur.fetchall()
+            timings.append(time.perf_counter() - start_time)
+            cur.execute("RELEASE SAVEPOINT advisor_run")
+        except Exception:
+            cur.execute("ROLLBACK TO SAVEPOINT advisor_run")
+            return None
+    return sorted(timings)[len(timings) // 2]
+
+def _workload_cost(cur, queries: list, trials: int) -> dict:
+    costs = [_plan_cost(cur, query) for query in queries]
+    latencies = [_measure(cur, query, trials) for query, cost in zip(queries, costs) if cost is not None]
+    costs = [cost for cost in costs if cost is not None]
+    latencies = [latency for latency in latencies if latency is not None]
+    return {
+        'plan_cost': sum(costs) if costs else None,
+        'latency': sum(latencies) if latencies else None,
+        'plans': len(costs)
+    }
+
+# Planner cost and median latency of a candidate's queries without and with the index.
+# The index is built inside a transaction that is rolled back, so nothing is left behind.
+def evaluate_candidate(conn, candidate: dict, trials: int) -> dict:
+    try:
+        with conn.cursor() as cur:
+            before = _workload_cost(cur, candidate['queries'], trials)
+            cur.execute(index_ddl(candidate))
+            cur.execute(f'ANALYZE "{candidate["table_name"]}"')
+            after = _workload_cost(cur, candidate['queries'], trials)
+    finally:
+        conn.rollback()
+    improvement = None
+    if before['plan_cost'] and after['plan_cost'] is not None:
+        improvement = 1 - after['plan_cost'] / before['plan_cost']
+    return {'before': before, 'after': after, 'cost_improvement': improvement}
+
+def advise(workload: list, apply: bool = False, trials: int = None, min_improvement: float = None) -> dict:
+    from utils.db_utils import get_db_connection, invalidate_table
+
+    trials = trials or INDEX_ADVISOR_CONFIG['trials']
+    min_improvement = INDEX_ADVISOR_CONFIG['min_improvement'] if min_improvement is None else min_improvement
+    candidates = propose_indexes(workload)
+    conn = get_db_connection()
+    if conn is None:
+        raise ConnectionError("Database connection failed")
+    report = []
+    try:
+        existing = {}
+        for candidate in candidates:
+            table_name = candidate['table_name']
+            if table_name not in existing:
+                existing[table_name] = _existing_indexes(conn, table_name)
+                conn.rollback()
+            record = {key: candidate[key] for key in ('table_name', 'columns', 'where', 'frequency')}
+            record['ddl'] = index_ddl(candidate)
+            if _is_covered(candidate, existing[table_name]):
+                record['status'] = 'covered'
+                report.append(record)
+                continue
+            record.update(evaluate_candidate(conn, candidate, trials))
+            improvement = record['cost_improvement']
+            record['status'] = 'recommended' if improvement is not None and improvement >= min_improvement else 'rejected'
+            if apply and record['status'] == 'recommended':
+                conn.autocommit = True
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(index_ddl(candidate, concurrently=True))
+                        cur.execute(f'ANALYZE "{table_name}"')
+                finally:
+                    conn.autocommit = False
+                existing[table_name].append((candidate['columns'], bool(candidate['where'])))
+                invalidate_table(table_name)
+                record['status'] = 'created'
+            report.append(record)
+    finally:
+        conn.close()
+    return {'candidates': report}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Propose (and optionally create) indexes for the generated SQL workload")
+    parser.add_argument('--output-root', default=OUTPUT_ROOT)
+    parser.add_argument('--query-log', default=INDEX_ADVISOR_CONFIG['query_log'])
+    parser.add_argument('--dry-run', action='store_true', help="only list candidates; no database connection")
+    parser.add_argument('--apply', action='store_true', help="create recommended indexes (CREATE INDEX CONCURRENTLY)")
+    parser.add_argument('--trials', type=int, default=INDEX_ADVISOR_CONFIG['trials'])
+    parser.add_argument('--min-improvement', type=float, default=INDEX_ADVISOR_CONFIG['min_improvement'])
+    parser.add_argument('--output', default=REPORT_PATH)
+    args = parser.parse_args()
+
+    workload = load_workload(args.output_root, args.query_log)
+    logger.info(f"Workload: {len(workload)} distinct queries")
+    if args.dry_run:
+        report = {'candidates': [
+            {**{key: candidate[key] for key in ('table_name', 'columns', 'where', 'frequency')}, 'ddl': index_ddl(candidate)}
+            for candidate in propose_indexes(workload)
+        ]}
+    else:
+        try:
+            report = advise(workload, args.apply, args.trials, args.min_improvement)
+        except ConnectionError:
+            logger.error("Please check your PostgreSQL configuration, or use --dry-run. Exiting...")
+            sys.exit(1)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    for record in report['candidates']:
+        status = record.get('status', 'candidate')
+        line = f"{status:11s} x{record['frequency']:<4d} {record['ddl']}"
+        if record.get('cost_improvement') is not None:
+            before, after = record['before'], record['after']
+            line += f"\n            cost {before['plan_cost']:.1f} -> {after['plan_cost']:.1f} ({record['cost_improvement']:.0%})"
+            if before['latency'] is not None and after['latency'] is not None:
+                line += f", latency {before['latency'] * 1000:.2f} ms -> {after['latency'] * 1000:.2f} ms"
+        print(line)
+    logger.info(f"Saved: {args.output}")
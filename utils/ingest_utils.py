@@ -0,0 +1,257 @@
+import argparse
+import sys
+import os
+import io
+import csv
+import time
+import hashlib
+import logging
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from psycopg2 import sql
+from prompt.prompts import DATA_FIELDS_MEANING, INGEST_CONFIG, ROLLUP_CONFIG
+from utils.dataset_utils import get_csv_path, read_csv_header, get_column_types, iter_csv_chunks, convert_value, clear_dataset_caches
+from utils.db_utils import get_db_connection, invalidate_table
+from utils.rollup_utils import refresh_rollups, get_rollup_measures
+from utils.gazetteer_utils import refresh_gazetteer
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_POSTGRES_TYPES = {'INTEGER': 'INTEGER', 'BIGINT': 'BIGINT', 'FLOAT': 'DOUBLE PRECISION', 'DATE': 'DATE', 'TEXT': 'TEXT'}
+
+# === INGEST STATE ===
+# One row per table: how many CSV rows were loaded and a hash of the bytes they came
+# from, so an append-only CSV is reloaded by copying just the new rows
+
+def _ensure_state_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {} (
+                table_name TEXT PRIMARY KEY,
+                csv_size BIGINT NOT NULL,
+                csv_hash TEXT NOT NULL,
+                header_hash TEXT NOT NULL,
+                rows_loaded BIGINT NOT NULL,
+                loaded_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """).format(sql.Identifier(INGEST_CONFIG['state_table'])))
+
+def _read_state(conn, table_name: str):
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("SELECT csv_size, csv_hash, header_hash, rows_loaded FROM {} WHERE table_name = %s")
+            .format(sql.Identifier(INGEST_CONFIG['state_table'])),
+            (table_name,)
+        )
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return {'csv_size': row[0], 'csv_hash': row[1], 'header_hash': row[2], 'rows_loaded': row[3]}
+
+def _write_state(conn, table_name: str, state: dict):
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("""
+                INSERT INTO {} (table_name, csv_size, csv_hash, header_hash, rows_loaded, loaded_at)
+                VALUES (%s, %s, %s, %s, %s, now())
+                ON CONFLICT (table_name) DO UPDATE SET
+                    csv_size = EXCLUDED.csv_size, csv_hash = EXCLUDED.csv_hash,
+                    header_hash = EXCLUDED.header_hash, rows_loaded = EXCLUDED.rows_loaded,
+                    loaded_at = EXCLUDED.loaded_at
+            """).format(sql.Identifier(INGEST_CONFIG['state_table'])),
+            (table_name, state['csv_size'], state['csv_hash'], state['header_hash'], state['rows_loaded'])
+        )
+
+def _hash_file_prefix(path: str, size: int) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        remaining = size
+        while remaining > 0:
+            block = f.read(min(1 << 20, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+def _table_exists(conn, table_name: str) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f'public.{table_name}',))
+        return cur.fetchone()[0]
+
+# === COPY LOADING ===
+
+# years, when given, collects the distinct year values loaded (for incremental rollup refresh)
+def _copy_chunks(conn, target: str, column_types: tuple, path: str, chunk_rows: int, skip_rows: int = 0, years: set = None) -> int:
+    copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '')").format(
+        sql.Identifier(target),
+        sql.SQL(', ').join(sql.Identifier(column) for column, _ in column_types)
+    ).as_string(conn)
+    width = len(column_types)
+    year_index = next((i for i, (column, _) in enumerate(column_types) if column == 'year'), None)
+    rows_loaded = 0
+    with conn.cursor() as cur:
+        for chunk in iter_csv_chunks(path, chunk_rows, skip_rows):
+            # Re-encode through convert_value so values like 2000.0 land in INTEGER columns
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in chunk:
+                values = [
+                    convert_value(value, column_type)
+                    for value, (_, column_type) in zip(row[:width], column_types)
+                ]
+                if years is not None and year_index is not None and values[year_index] is not None:
+                    years.add(values[year_index])
+                writer.writerow(values)
+            buffer.seek(0)
+            cur.copy_expert(copy_sql, buffer)
+            rows_loaded += len(chunk)
+    return rows_loaded
+
+def _create_indexes(conn, target: str, table_name: str, column_types: tuple):
+    columns = {column for column, _ in column_types}
+    with conn.cursor() as cur:
+        for column in INGEST_CONFIG['index_columns']:
+            if column in columns:
+                cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} ({})").format(
+                    sql.Identifier(f"{table_name}_{column}_idx"), sql.Identifier(target), sql.Identifier(column)
+                ))
+
+# Definitions of every index on the live table, including ones added by the index advisor
+def _index_definitions(conn, table_name: str) -> list:
+    with conn.cursor() as cur:
+        cur.execute("SELECT indexdef FROM pg_indexes WHERE schemaname = 'public' AND tablename = %s", (table_name,))
+        return [
+            definition.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1)
+                      .replace('CREATE UNIQUE INDEX ', 'CREATE UNIQUE INDEX IF NOT EXISTS ', 1)
+            for definition, in cur.fetchall()
+        ]
+
+# Full reload into a staging table that replaces the live one in a single transaction,
+# so readers see either the old data or the new data, never a half-loaded table
+def _full_load(conn, table_name: str, column_types: tuple, path: str, chunk_rows: int) -> int:
+    staging = f"{table_name}__ingest"
+    indexes = _index_definitions(conn, table_name)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(staging)))
+        cur.execute(sql.SQL("CREATE TABLE {} ({})").format(
+            sql.Identifier(staging),
+            sql.SQL(', ').join(
+                sql.SQL("{} {}").format(sql.Identifier(column), sql.SQL(_POSTGRES_TYPES[column_type]))
+                for column, column_type in column_types
+            )
+        ))
+    rows_loaded = _copy_chunks(conn, staging, column_types, path, chunk_rows)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(table_name)))
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(staging), sql.Identifier(table_name)))
+    # Built after the bulk load: one sort per index instead of per-row index maintenance.
+    # Indexes the dropped table had beyond the configured ones are recreated as they were.
+    _create_indexes(conn, table_name, table_name, column_types)
+    with conn.cursor() as cur:
+        for definition in indexes:
+            cur.execute(definition)
+    return rows_loaded
+
+# === INGESTION ===
+
+# Load one CSV into PostgreSQL. mode is 'auto' (skip if unchanged, append if the CSV only
+# grew, otherwise reload) or 'full'.
+def ingest_table(table_name: str, mode: str = 'auto', chunk_rows: int = None) -> dict:
+    path = get_csv_path(table_name)
+    if path is None:
+        raise FileNotFoundError(f"No CSV found for table '{table_name}'")
+    chunk_rows = chunk_rows or INGEST_CONFIG['chunk_rows']
+    csv_size = os.path.getsize(path)
+    header_hash = hashlib.sha1(','.join(read_csv_header(path)).encode('utf-8')).hexdigest()
+
+    conn = get_db_connection()
+    if conn is None:
+        raise ConnectionError("Database connection failed")
+    start_time = time.perf_counter()
+    try:
+        _ensure_state_table(conn)
+        conn.commit()
+        state = _read_state(conn, table_name) if mode == 'auto' and _table_exists(conn, table_name) else None
+
+        load_mode, rows_loaded, total_rows = 'full', 0, 0
+        if state is not None and state['header_hash'] == header_hash and csv_size >= state['csv_size']:
+            if _hash_file_prefix(path, state['csv_size']) == state['csv_hash']:
+                load_mode = 'unchanged' if csv_size == state['csv_size'] else 'append'
+
+        if load_mode != 'unchanged':
+            # Types and stats inferred from the previous version of the CSV
+            clear_dataset_caches()
+            get_rollup_measures.cache_clear()
+        column_types = get_column_types(table_name)
+        years = set()
+        if load_mode == 'unchanged':
+            total_rows = state['rows_loaded']
+        elif load_mode == 'append':
+            try:
+                rows_loaded = _copy_chunks(conn, table_name, column_types, path, chunk_rows, skip_rows=state['rows_loaded'], years=years)
+                total_rows = state['rows_loaded'] + rows_loaded
+            except Exception as e:
+                # New rows that no longer fit the existing column types
+                logger.warning(f"Incremental load of '{table_name}' failed ({str(e).strip()}); reloading in full")
+                conn.rollback()
+                load_mode = 'full'
+        if load_mode == 'full':
+            rows_loaded = total_rows = _full_load(conn, table_name, column_types, path, chunk_rows)
+
+        if load_mode != 'unchanged':
+            _write_state(conn, table_name, {
+                'csv_size': csv_size,
+                'csv_hash': _hash_file_prefix(path, csv_size),
+                'header_hash': header_hash,
+                'rows_loaded': total_rows
+            })
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table_name)))
+            if table_name in ROLLUP_CONFIG['rollups']:
+                # Same transaction as the load, so rollups never disagree with the base table
+                refresh_rollups(table_name, sorted(years) if load_mode == 'append' else None, conn=conn)
+            conn.commit()
+            invalidate_table(table_name)
+            refresh_gazetteer(table_name)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start_time
+    return {
+        'table_name': table_name,
+        'mode': load_mode,
+        'rows_loaded': rows_loaded,
+        'total_rows': total_rows,
+        'elapsed': elapsed,
+        'rows_per_sec': rows_loaded / elapsed if rows_loaded and elapsed > 0 else None
+    }
+
+def ingest_all(tables: list = None, mode: str = 'auto', chunk_rows: int = None) -> list:
+    tables = tables or [table_name for table_name in DATA_FIELDS_MEANING if get_csv_path(table_name)]
+    return [ingest_table(table_name, mode, chunk_rows) for table_name in tables]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load dataset/*.csv into PostgreSQL with COPY")
+    parser.add_argument('--tables', nargs='+', default=None, help="tables to load (default: every table with a CSV)")
+    parser.add_argument('--full', action='store_true', help="reload from scratch even if the CSV only grew")
+    parser.add_argument('--chunk-rows', type=int, default=INGEST_CONFIG['chunk_rows'])
+    args = parser.parse_args()
+
+    try:
+        results = ingest_all(args.tables, 'full' if args.full else 'auto', args.chunk_rows)
+    except ConnectionError:
+        logger.error("Please check your PostgreSQL configuration. Exiting...")
+        sys.exit(1)
+    for result in results:
+        rate = f"{result['rows_per_sec']:,.0f} rows/s" if result['rows_per_sec'] else "-"
+        print(
+            f"{result['table_name']:35s} {result['mode']:9s} {result['rows_loaded']:>9,} rows "
+            f"({result['total_rows']:,} total) in {result['elapsed']:.2f}s  {rate}"
+        )
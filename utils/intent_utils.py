@@ -0,0 +1,348 @@
+import argparse
+import sys
+import os
+import re
+import json
+import time
+import difflib
+import logging
+from functools import lru_cache
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from prompt.prompts import DATA_FIELDS_MEANING, DATASET_CONFIG, INTENT_CONFIG
+from utils.dataset_utils import get_csv_path, read_csv_header, map_csv_columns, get_column_stats, get_declared_type
+from utils.gazetteer_utils import lookup_entity
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+INPUT_DIR = os.path.join(ROOT_DIR, 'query', 'input')
+OUTPUT_ROOT = os.path.join(ROOT_DIR, 'query', 'output')
+REPORT_PATH = os.path.join(ROOT_DIR, 'query', 'benchmark', 'intents.json')
+
+# Template SQL for the most common question shapes (value of a metric for an entity and
+# year, top/bottom N countries by a metric, average of a metric over a group). Every slot
+# has to resolve: the metric to one numeric column by name, entities to values in the data
+# through the gazetteer ("US" -> 'United States'), years and dates literally. Otherwise
+# match_question returns None and the question goes to the LLM.
+
+_MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+_LEAD = r"^(?:(?:what|which) (?:is|was|are|were) |what's |give me |show (?:me )?|list )?(?:the )?"
+_YEAR = r"(?: (?:in|for|during) (?:the year )?(?P<year>\d{4}))"
+_EXTREMES = {'highest': 'DESC', 'largest': 'DESC', 'greatest': 'DESC', 'biggest': 'DESC', 'most': 'DESC',
+             'lowest': 'ASC', 'smallest': 'ASC', 'least': 'ASC'}
+_EXTREME = '(?P<extreme>' + '|'.join(_EXTREMES) + ')'
+
+_LOOKUP_RE = re.compile(_LEAD + r"(?P<metrics>.+?) (?:of|for) (?P<entities>.+?)" + _YEAR + "$")
+_DATE_LOOKUP_RE = re.compile(_LEAD + r"(?P<metrics>.+?) (?:of|on|for) (?P<date>[a-z]+\.? \d{1,2},? \d{4}|\d{4}-\d{2}-\d{2})$")
+_TOP_N_RE = re.compile(
+    _LEAD + r"(?P<order>top|bottom) (?P<n>\d+) countr(?:y|ies)(?: that| which)? (?:by|with|having|has|have) (?:the )?"
+    + f"(?:{_EXTREME} )?" + r"(?P<metric>.+?)" + _YEAR + "?$"
+)
+_TOP_ONE_RE = re.compile(
+    r"^(?:(?:which|what) country (?:has|had|have|with)|country with) (?:the )?" + _EXTREME + r" (?P<metric>.+?)" + _YEAR + "?$"
+)
+_AVERAGE_RE = re.compile(
+    _LEAD + r"(?:average|mean|avg)(?: of)? (?P<metric>.+?) (?:of|for|in|among|across) (?P<entities>.+?)" + _YEAR
+    + r"?(?: (?:over|through|across) (?:the )?years)?$"
+)
+_LIST_RE = re.compile(r",\s*(?:and\s+)?|\s+and\s+")
+
+def _squash(text: str) -> str:
+    return re.sub(r'[^a-z0-9]', '', text.lower())
+
+def _normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+def _literal(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+# === SCHEMA LOOKUPS ===
+
+def _fields(table_name: str) -> list:
+    return list(DATA_FIELDS_MEANING.get(table_name, {}).get('fields', {}))
+
+def _field_with_type(table_name: str, column_type: str):
+    return next((field for field in _fields(table_name) if get_declared_type(table_name, field.lower()) == column_type), None)
+
+def _name_column(table_name: str):
+    fields = {field.lower(): field for field in _fields(table_name)}
+    return next((fields[column] for column in INTENT_CONFIG['name_columns'] if column in fields), None)
+
+# Squashed column names and CSV headers -> numeric column
+@lru_cache(maxsize=None)
+def _metric_names(table_name: str) -> dict:
+    stats = get_column_stats(table_name)
+    headers = {}
+    path = get_csv_path(table_name)
+    if path is not None:
+        raw_headers = read_csv_header(path)
+        headers = dict(zip(map_csv_columns(table_name, tuple(raw_headers)), raw_headers))
+    names = {}
+    for field in _fields(table_name):
+        column = field.lower()
+        numeric = stats[column]['numeric'] if column in stats else get_declared_type(table_name, column) in ('INTEGER', 'FLOAT')
+        if not numeric or column == 'year' or column.endswith('_id'):
+            continue
+        names[_squash(field)] = field
+        if column in headers:
+            names.setdefault(_squash(re.sub(r'\([^)]*\)', ' ', headers[column])), field)
+    return names
+
+# The column a metric phrase names, or None when no column is close enough or two are
+@lru_cache(maxsize=4096)
+def resolve_metric(phrase: str, table_name: str):
+    names = _metric_names(table_name)
+    key = _squash(phrase)
+    if not key:
+        return None
+    if key in names:
+        return names[key]
+    cutoff = INTENT_CONFIG['metric_cutoff']
+    best = {}
+    for name, field in names.items():
+        matcher = difflib.SequenceMatcher(None, key, name)
+        if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+            best[field] = max(best.get(field, 0.0), matcher.ratio())
+    ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+    if not ranked or ranked[0][1] < cutoff:
+        return None
+    if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < INTENT_CONFIG['metric_margin']:
+        return None
+    return ranked[0][0]
+
+# (column, value) for an entity phrase; lookups prefer name columns (country_name) and
+# averages prefer group columns (income_group), as "High income" can be either
+def resolve_entity(phrase: str, table_name: str, prefer_names: bool = True):
+    matches = lookup_entity(phrase, table_name)
+    if not matches:
+        return None
+    name_columns = INTENT_CONFIG['name_columns']
+    preferred = [match for match in matches if (match[0] in name_columns) == prefer_names]
+    candidates = preferred or list(matches)
+    # Codes ("USA") only when nothing else matches
+    return sorted(candidates, key=lambda match: match[0] in ('country_code', 'iso'))[0]
+
+# "d10 category of us" -> one (column, value) per part, each on a different column
+def _resolve_entities(phrase: str, table_name: str, prefer_names: bool = True):
+    resolved = []
+    for part in phrase.split(' of '):
+        entity = resolve_entity(part, table_name, prefer_names)
+        if entity is None or any(column == entity[0] for column, _ in resolved):
+            return None
+        resolved.append(entity)
+    return resolved
+
+def _resolve_metrics(phrase: str, table_name: str):
+    metrics = [resolve_metric(part, table_name) for part in _LIST_RE.split(phrase) if part]
+    if not metrics or None in metrics:
+        return None
+    return list(dict.fromkeys(metrics))
+
+def _parse_date(text: str):
+    match = re.match(r'^(\d{4})-(\d{2})-(\d{2})$', text)
+    if match:
+        return text
+    match = re.match(r'^([a-z]+)\.? (\d{1,2}),? (\d{4})$', text)
+    if not match or match.group(1)[:3] not in _MONTHS:
+        return None
+    return f"{match.group(3)}-{_MONTHS.index(match.group(1)[:3]) + 1:02d}-{int(match.group(2)):02d}"
+
+# === TEMPLATES ===
+
+def _where(conditions: list) -> str:
+    return f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+def _lookup(match, table_name: str):
+    year_field = _field_with_type(table_name, 'INTEGER') if 'year' in (field.lower() for field in _fields(table_name)) else None
+    metrics = _resolve_metrics(match.group('metrics'), table_name)
+    entities = _resolve_entities(match.group('entities'), table_name)
+    if year_field is None or metrics is None or entities is None:
+        return None
+    conditions = [f"{column} = {_literal(value)}" for column, value in entities] + [f"year = {int(match.group('year'))}"]
+    return f"SELECT {', '.join(metrics)} FROM {table_name}{_where(conditions)} LIMIT {INTENT_CONFIG['limit']}"
+
+def _date_lookup(match, table_name: str):
+    date_field = _field_with_type(table_name, 'DATE')
+    metrics = _resolve_metrics(match.group('metrics'), table_name)
+    date = _parse_date(match.group('date'))
+    if date_field is None or metrics is None or date is None:
+        return None
+    name_column = _name_column(table_name)
+    columns = ([name_column] if name_column else []) + metrics
+    return f"SELECT {', '.join(columns)} FROM {table_name} WHERE {date_field} = {_literal(date)} LIMIT {INTENT_CONFIG['limit']}"
+
+def _top(match, table_name: str, n: int, direction: str):
+    name_column = _name_column(table_name)
+    metric = resolve_metric(match.group('metric'), table_name)
+    if name_column is None or metric is None or not 0 < n <= INTENT_CONFIG['max_top_n']:
+        return None
+    columns = [name_column, metric]
+    conditions = [f"{metric} IS NOT NULL"]
+    if match.group('year'):
+        conditions.insert(0, f"year = {int(match.group('year'))}")
+    elif 'year' in (field.lower() for field in _fields(table_name)):
+        columns.insert(1, 'year')
+    country_filter = INTENT_CONFIG['country_filters'].get(table_name)
+    if country_filter:
+        conditions.append(country_filter)
+    return f"SELECT {', '.join(columns)} FROM {table_name}{_where(conditions)} ORDER BY {metric} {direction} LIMIT {n}"
+
+def _top_n(match, table_name: str):
+    direction = 'ASC' if match.group('order') == 'bottom' else 'DESC'
+    if match.group('extreme'):
+        direction = _EXTREMES[match.group('extreme')]
+    return _top(match, table_name, int(match.group('n')), direction)
+
+def _top_one(match, table_name: str):
+    return _top(match, table_name, 1, _EXTREMES[match.group('extreme')])
+
+def _average(match, table_name: str):
+    metric = resolve_metric(match.group('metric'), table_name)
+    entities = _resolve_entities(match.group('entities'), table_name, prefer_names=False)
+    if metric is None or entities is None:
+        return None
+    conditions = [f"{column} = {_literal(value)}" for column, value in entities]
+    if match.group('year'):
+        conditions.append(f"year = {int(match.group('year'))}")
+    return f"SELECT AVG({metric}) AS avg_{metric.lower()} FROM {table_name}{_where(conditions)}"
+
+# Tried in order; the first template whose slots all resolve wins
+TEMPLATES = [
+    ('top_n', _TOP_N_RE, _top_n),
+    ('top_one', _TOP_ONE_RE, _top_one),
+    ('average', _AVERAGE_RE, _average),
+    ('date_lookup', _DATE_LOOKUP_RE, _date_lookup),
+    ('lookup', _LOOKUP_RE, _lookup)
+]
+
+def _normalize_question(question: str) -> str:
+    return _normalize(re.sub(r'^\s*\d+\|', '', question)).rstrip('?.! ')
+
+# {'intent', 'sql'} for a question matching one of the templates on table_name, else None
+def match_question(question: str, table_name: str):
+    if table_name not in DATA_FIELDS_MEANING:
+        return None
+    text = _normalize_question(question)
+    for intent, pattern, build in TEMPLATES:
+        match = pattern.match(text)
+        if match is None:
+            continue
+        sql = build(match, table_name)
+        if sql is not None:
+            return {'intent': intent, 'sql': sql}
+    return None
+
+# === COVERAGE REPORT ===
+
+def _stored_output(model: str, dataset: str, kind: str, idx: int):
+    path = os.path.join(OUTPUT_ROOT, model, dataset, kind, f"question_{idx}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round((len(values) - 1) * q / 100)))]
+
+# Coverage, match latency and agreement with the stored gold SQL over query/input. Agreement
+# compares execution results on the embedded engine (metric_utils), so a template that is
+# written differently from the gold query but returns the same rows counts as agreeing; it is
+# None when there is no gold query or the gold query cannot run. The LLM time avoided is read
+# from the model's stored pred_sql generation times, None when none are stored.
+def coverage_report(datasets: list, model: str, execute: bool = False, engine: str = None) -> dict:
+    from utils.metric_utils import execute_sql, execution_match
+
+    run_query = None
+    if execute:
+        from utils.db_utils import run_query
+    report = {'model': model, 'datasets': {}}
+    for dataset in datasets:
+        table_name = DATASET_CONFIG['tables'][dataset]
+        with open(os.path.join(INPUT_DIR, f"{dataset}.json"), encoding='utf-8') as f:
+            questions = json.load(f)['user_queries']
+        match_question(questions[0], table_name)  # build the lookups outside the timings
+        records = []
+        for idx, question in enumerate(questions, 1):
+            start_time = time.perf_counter()
+            match = match_question(question, table_name)
+            elapsed = time.perf_counter() - start_time
+            record = {'idx': idx, 'question': question, 'intent': match and match['intent'], 'sql': match and match['sql'], 'match_time': elapsed}
+            if match:
+                gold = _stored_output(model, dataset, 'gold_sql', idx)
+                pred = _stored_output(model, dataset, 'pred_sql', idx)
+                result = execute_sql(match['sql'], table_name, engine)
+                record['template_error'] = result['error'] if result['error'] != "No data returned" else None
+                record['gold_match'] = None
+                if gold:
+                    gold_result = execute_sql(gold['query'], table_name, engine)
+                    record['gold_error'] = gold_result['error']
+                    record['gold_match'] = execution_match(result, gold_result)
+                record['llm_time_avoided'] = pred.get('generation_time') if pred else None
+                if run_query is not None:
+                    result = run_query(match['sql'], table_name)
+                    record['rows'] = None if result.get('error') else len(result.get('data') or [])
+            records.append(record)
+        matched = [record for record in records if record['intent']]
+        intents = {}
+        for record in matched:
+            intents[record['intent']] = intents.get(record['intent'], 0) + 1
+        times = [record['match_time'] * 1e6 for record in records]
+        compared = [record['gold_match'] for record in matched if record.get('gold_match') is not None]
+        avoided = [record['llm_time_avoided'] for record in matched if record.get('llm_time_avoided') is not None]
+        report['datasets'][dataset] = {
+            'table_name': table_name,
+            'questions': len(records),
+            'matched': len(matched),
+            'coverage': round(len(matched) / len(records), 4) if records else None,
+            'intents': intents,
+            'match_us_p50': round(_percentile(times, 50), 1),
+            'match_us_p95': round(_percentile(times, 95), 1),
+            'template_errors': sum(1 for record in matched if record['template_error']),
+            'gold_compared': len(compared),
+            'gold_agreement': sum(compared) if compared else None,
+            'llm_time_avoided': round(sum(avoided), 2) if avoided else None,
+            'records': records
+        }
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coverage and latency of the template SQL fast path over query/input")
+    parser.add_argument('--datasets', nargs='+', default=list(DATASET_CONFIG['tables']))
+    parser.add_argument('--model', default='gemma3', help="stored outputs under query/output/<model> used for gold SQL and LLM times")
+    parser.add_argument('--execute', action='store_true', help="also run every template query against the database")
+    parser.add_argument('--engine', choices=['duckdb', 'sqlite'], default=None,
+                        help="embedded engine the template and gold results are compared on")
+    parser.add_argument('--output', default=REPORT_PATH)
+    args = parser.parse_args()
+
+    report = coverage_report(args.datasets, args.model, args.execute, args.engine)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    for dataset, stats in report['datasets'].items():
+        agreement = f"{stats['gold_agreement']}/{stats['gold_compared']}" if stats['gold_compared'] else "n/a"
+        avoided = f"{stats['llm_time_avoided']:.1f}s" if stats['llm_time_avoided'] is not None else "n/a"
+        print(
+            f"{dataset:20s} {stats['matched']:>3d}/{stats['questions']:<3d} ({stats['coverage']:.0%}) "
+            f"p50 {stats['match_us_p50']:.0f} us, p95 {stats['match_us_p95']:.0f} us, "
+            f"{stats['template_errors']} failed, gold agreement {agreement}, {args.model} time avoided {avoided}  {stats['intents']}"
+        )
+        for record in stats['records']:
+            if record['intent']:
+                if record['template_error']:
+                    status = 'failed'
+                elif record['gold_match'] is None:
+                    status = 'no gold' if 'gold_error' not in record else 'gold failed'
+                else:
+                    status = 'same rows as gold' if record['gold_match'] else 'differs from gold'
+                print(f"    #{record['idx']:<3d} {record['intent']:12s} [{status}] {record['sql']}")
+                if record['template_error']:
+                    print(f"         {record['template_error'].splitlines()[0]}")
+    logger.info(f"Saved: {args.output}")
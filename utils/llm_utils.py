@@ -2,25 +2,129 @@ import logging
 from langchain_ollama import OllamaLLM
 import sys
 import os
+import re
+import time
+import zlib
+import threading
 from groq import Groq
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import Generation, GenerationChunk, LLMResult
 from prompt.prompts import GROQ_CONFIG
 
 sys.path.append('.')
 
-from prompt.prompts import OLLAMA_CONFIG
+from prompt.prompts import OLLAMA_CONFIG, MOCK_LLM_CONFIG, DATA_FIELDS_MEANING
+from utils.dispatch_utils import close_dispatcher
 
 # Logging Configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def get_llm_model():
-    try:
-        llm = OllamaLLM(model=OLLAMA_CONFIG['model'], base_url=OLLAMA_CONFIG['endpoint'])
-        logger.info("LLM initialized successfully")
-        return llm
-    except Exception as e:
-        logger.error(f"Failed to initialize LLM: {str(e)}")
-        return None
+# Model registry: one long-lived client per (provider, model, endpoint), so every question
+# reuses the same HTTP session instead of building a new client per call
+_llm_registry = {}
+_llm_registry_lock = threading.RLock()
+
+# === MOCK LLM ===
+# Deterministic offline stand-in with Ollama-style generation_info, so the pipeline and the
+# model benchmark run without a model server. SQL prompts get a SELECT of the columns named
+# in the question; answer prompts get the first result line back.
+
+_MOCK_TOKEN_RE = re.compile(r'\s*(?:\w+|[^\w\s])')
+_MOCK_TABLE_RE = re.compile(r"table named '([^']+)'")
+_MOCK_YEAR_RE = re.compile(r'\b(?:19|20)\d{2}\b')
+
+def _mock_response(prompt: str) -> str:
+    if 'Query Results:' in prompt:
+        results = [line for line in prompt.split('Query Results:', 1)[1].splitlines() if line.strip()]
+        return f"Based on the query results: {results[0].strip() if results else 'no data'}"
+    table = _MOCK_TABLE_RE.search(prompt)
+    if table is None or table.group(1) not in DATA_FIELDS_MEANING:
+        return "SELECT 1;"
+    table_name = table.group(1)
+    fields = [field.lower() for field in DATA_FIELDS_MEANING[table_name]['fields']]
+    question = prompt.rsplit('Human:', 1)[-1].lower()
+    words = set(re.findall(r'[a-z0-9]+', question))
+    columns = [field for field in fields if set(field.split('_')) <= words] or fields[:1]
+    conditions = [f"year = {year}" for year in _MOCK_YEAR_RE.findall(question)[:1] if 'year' in fields]
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {', '.join(columns)} FROM {table_name}{where} LIMIT 50;"
+
+class MockLLM(LLM):
+    model: str = 'mock'
+
+    @property
+    def _llm_type(self) -> str:
+        return 'mock'
+
+    # Per-model speed factor, so mock models differ from each other but not between runs
+    def _speed(self) -> float:
+        return 0.5 + (zlib.crc32(self.model.encode('utf-8')) % 100) / 100
+
+    # Yields the response token by token at the simulated speed; returns the generation info
+    def _emit(self, prompt: str):
+        tokens = _MOCK_TOKEN_RE.findall(_mock_response(prompt))
+        prompt_tokens = len(_MOCK_TOKEN_RE.findall(prompt))
+        prompt_eval = prompt_tokens * MOCK_LLM_CONFIG['prompt_seconds_per_token'] * self._speed()
+        token_time = MOCK_LLM_CONFIG['seconds_per_token'] * self._speed()
+        time.sleep(prompt_eval)
+        for token in tokens:
+            time.sleep(token_time)
+            yield token
+        return {
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': int(prompt_eval * 1e9),
+            'eval_count': len(tokens),
+            'eval_duration': int(len(tokens) * token_time * 1e9)
+        }
+
+    def _generate_one(self, prompt: str) -> Generation:
+        emitter = self._emit(prompt)
+        tokens = []
+        while True:
+            try:
+                tokens.append(next(emitter))
+            except StopIteration as stop:
+                return Generation(text=''.join(tokens), generation_info=stop.value)
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs) -> str:
+        return self._generate_one(prompt).text
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs) -> LLMResult:
+        return LLMResult(generations=[[self._generate_one(prompt)] for prompt in prompts])
+
+    # Like Ollama, the statistics arrive on a final empty chunk
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        emitter = self._emit(prompt)
+        while True:
+            try:
+                yield GenerationChunk(text=next(emitter))
+            except StopIteration as stop:
+                yield GenerationChunk(text='', generation_info=stop.value)
+                return
+
+def is_mock_model(model: str) -> bool:
+    return model == 'mock' or model.startswith('mock:')
+
+def get_llm_model(model: str = None, endpoint: str = None):
+    model = model or OLLAMA_CONFIG['model']
+    endpoint = endpoint or OLLAMA_CONFIG['endpoint']
+    key = ('ollama', model, endpoint)
+    with _llm_registry_lock:
+        llm = _llm_registry.get(key)
+        if llm is not None:
+            return llm
+        try:
+            if is_mock_model(model):
+                llm = MockLLM(model=model)
+            else:
+                llm = OllamaLLM(model=model, base_url=endpoint, keep_alive=OLLAMA_CONFIG.get('keep_alive'))
+            _llm_registry[key] = llm
+            logger.info(f"LLM initialized successfully with model: {model}")
+            return llm
+        except Exception as e:
+            logger.error(f"Failed to initialize LLM: {str(e)}")
+            return None
     
 def get_groq_llm_model():
     try:
@@ -28,9 +132,71 @@ def get_groq_llm_model():
         model = GROQ_CONFIG.get("model")
         if not api_key or api_key == "YOUR_API_KEY":
             raise ValueError("GROQ_CONFIG['api_key'] is not set. Please update it in prompts.py.")
-        llm = Groq(api_key=api_key)
-        logger.info(f"Groq LLM initialized successfully with model: {model}")
+        key = ('groq', model, GROQ_CONFIG.get('endpoint'))
+        with _llm_registry_lock:
+            llm = _llm_registry.get(key)
+            if llm is None:
+                llm = Groq(api_key=api_key, base_url=GROQ_CONFIG.get('endpoint'))
+                _llm_registry[key] = llm
+                logger.info(f"Groq LLM initialized successfully with model: {model}")
         return llm
     except Exception as e:
         logger.error(f"Failed to initialize Groq LLM: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+# Ask Ollama to load the model now (an empty prompt only loads it) and keep it resident
+# for OLLAMA_CONFIG['keep_alive'], so the first question does not pay the model load time
+def warm_up_llm(model: str = None, endpoint: str = None, keep_alive=None) -> bool:
+    from ollama import Client
+
+    model = model or OLLAMA_CONFIG['model']
+    endpoint = endpoint or OLLAMA_CONFIG['endpoint']
+    keep_alive = keep_alive if keep_alive is not None else OLLAMA_CONFIG.get('keep_alive')
+    if is_mock_model(model):
+        return True
+    try:
+        Client(host=endpoint).generate(model=model, prompt='', keep_alive=keep_alive)
+        logger.info(f"Model {model} loaded and kept alive for {keep_alive}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to warm up model {model}: {str(e)}")
+        return False
+
+def release_llm_model(model: str, endpoint: str = None, unload: bool = False):
+    endpoint = endpoint or OLLAMA_CONFIG['endpoint']
+    with _llm_registry_lock:
+        llm = _llm_registry.pop(('ollama', model, endpoint), None)
+    if llm is not None:
+        close_dispatcher(llm)
+    if unload:
+        unload_llm(model, endpoint)
+
+# Ask Ollama to free the model's memory now instead of after keep_alive
+def unload_llm(model: str, endpoint: str = None) -> bool:
+    from ollama import Client
+
+    endpoint = endpoint or OLLAMA_CONFIG['endpoint']
+    if is_mock_model(model):
+        return True
+    try:
+        Client(host=endpoint).generate(model=model, prompt='', keep_alive=0)
+        logger.info(f"Model {model} unloaded")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to unload model {model}: {str(e)}")
+        return False
+
+# Switch the model used by the pipeline without restarting the process.
+# Later get_llm_model() calls (and the SQL cache key) pick up the new model.
+def set_active_model(model: str, endpoint: str = None, warm_up: bool = True, unload_previous: bool = False):
+    with _llm_registry_lock:
+        previous_model, previous_endpoint = OLLAMA_CONFIG['model'], OLLAMA_CONFIG['endpoint']
+        OLLAMA_CONFIG['model'] = model
+        if endpoint:
+            OLLAMA_CONFIG['endpoint'] = endpoint
+    logger.info(f"Active model switched from {previous_model} to {model}")
+    if unload_previous and (previous_model, previous_endpoint) != (model, OLLAMA_CONFIG['endpoint']):
+        release_llm_model(previous_model, previous_endpoint, unload=True)
+    if warm_up:
+        warm_up_llm(model)
+    return get_llm_model(model)
@@ -0,0 +1,217 @@
+import argparse
+import sys
+import os
+import json
+import glob
+import math
+import time
+import logging
+import datetime
+import decimal
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append('.')
+
+from prompt.prompts import DATASET_CONFIG
+from utils.sql_utils import canonicalize_sql
+from utils.embedded_db import get_embedded_database, run_embedded_query
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+OUTPUT_ROOT = os.path.join(ROOT_DIR, 'query', 'output')
+REPORT_PATH = os.path.join(ROOT_DIR, 'query', 'evaluation', 'evaluation.json')
+# Results are compared whole, so the execution caps meant for the agent are lifted
+EVAL_MAX_ROWS = 1_000_000
+EVAL_MAX_BYTES = 1 << 30
+
+# === PAIR LOADING ===
+
+def _read_json(path: str) -> dict:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+# Every (model, dataset, question) that has both a predicted and a gold SQL file
+def load_query_pairs(output_root: str = OUTPUT_ROOT) -> list:
+    pairs = []
+    for pred_path in sorted(glob.glob(os.path.join(output_root, '*', '*', 'pred_sql', 'question_*.json'))):
+        pred_dir = os.path.dirname(pred_path)
+        dataset_dir = os.path.dirname(pred_dir)
+        gold_path = os.path.join(dataset_dir, 'gold_sql', os.path.basename(pred_path))
+        if not os.path.exists(gold_path):
+            continue
+        model = os.path.basename(os.path.dirname(dataset_dir))
+        dataset = os.path.basename(dataset_dir)
+        pred, gold = _read_json(pred_path), _read_json(gold_path)
+        pairs.append({
+            'model': model,
+            'dataset': dataset,
+            'table_name': DATASET_CONFIG['tables'].get(dataset, dataset),
+            'idx': int(os.path.splitext(os.path.basename(pred_path))[0].split('_')[-1]),
+            'question': pred.get('question') or gold.get('question'),
+            'pred_sql': pred.get('query', ''),
+            'gold_sql': gold.get('query', ''),
+            'pred_generation_time': pred.get('generation_time'),
+            'gold_generation_time': gold.get('generation_time')
+        })
+    return pairs
+
+# === RESULT COMPARISON ===
+
+def _normalize_value(value):
+    if isinstance(value, decimal.Decimal):
+        value = float(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        return round(value, 6)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+# Order-insensitive multiset of result rows, with floats rounded so that engines that
+# differ in the last digits still compare equal
+def result_multiset(result: dict) -> Counter:
+    rows = result.get('data') or []
+    return Counter(tuple(_normalize_value(value) for value in row) for row in rows)
+
+def exact_match(pred_sql: str, gold_sql: str) -> bool:
+    return canonicalize_sql(pred_sql) == canonicalize_sql(gold_sql)
+
+# None when the gold query itself cannot be executed (nothing to compare against)
+def execution_match(pred_result: dict, gold_result: dict):
+    if gold_result.get('error') and gold_result['error'] != "No data returned":
+        return None
+    if pred_result.get('error') and pred_result['error'] != "No data returned":
+        return False
+    return pred_result['rows'] == gold_result['rows']
+
+def percentile(values: list, pct: float):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = (len(values) - 1) * pct / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+def latency_stats(values: list) -> dict:
+    values = [v for v in values if v is not None]
+    if not values:
+        return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values)
+    }
+
+# === EXECUTION ===
+
+def _execute(engine: str, table_name: str, sql: str) -> dict:
+    start_time = time.perf_counter()
+    result = run_embedded_query(sql, table_name, engine, max_rows=EVAL_MAX_ROWS, max_bytes=EVAL_MAX_BYTES)
+    return {
+        'rows': result_multiset(result) if not result.get('error') else None,
+        'error': result.get('error'),
+        'execution_time': time.perf_counter() - start_time
+    }
+
+# One query on the embedded engine, in the form execution_match compares
+def execute_sql(sql: str, table_name: str = None, engine: str = None) -> dict:
+    engine, _ = get_embedded_database(engine)
+    return _execute(engine, table_name, sql)
+
+# Run each distinct (table, canonical SQL) once, in parallel
+def execute_unique_queries(pairs: list, engine: str = None, max_workers: int = 8) -> dict:
+    jobs = {}
+    for pair in pairs:
+        for sql in (pair['pred_sql'], pair['gold_sql']):
+            key = (pair['table_name'], canonicalize_sql(sql))
+            jobs.setdefault(key, sql)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {key: executor.submit(_execute, engine, key[0], sql) for key, sql in jobs.items()}
+        for key, future in futures.items():
+            results[key] = future.result()
+    return results
+
+# === EVALUATION ===
+
+def evaluate_matrix(output_root: str = OUTPUT_ROOT, engine: str = None, max_workers: int = 8) -> dict:
+    start_time = time.perf_counter()
+    engine, _ = get_embedded_database(engine)
+    pairs = load_query_pairs(output_root)
+    executions = execute_unique_queries(pairs, engine, max_workers)
+
+    records = []
+    for pair in pairs:
+        pred = executions[(pair['table_name'], canonicalize_sql(pair['pred_sql']))]
+        gold = executions[(pair['table_name'], canonicalize_sql(pair['gold_sql']))]
+        records.append({
+            **pair,
+            'exact_match': exact_match(pair['pred_sql'], pair['gold_sql']),
+            'execution_match': execution_match(pred, gold),
+            'pred_error': pred['error'],
+            'gold_error': gold['error'],
+            'pred_execution_time': pred['execution_time'],
+            'gold_execution_time': gold['execution_time']
+        })
+
+    summary = {}
+    for record in records:
+        group = summary.setdefault(f"{record['model']}/{record['dataset']}", [])
+        group.append(record)
+    for key, group in summary.items():
+        executable = [r['execution_match'] for r in group if r['execution_match'] is not None]
+        summary[key] = {
+            'questions': len(group),
+            'exact_match': sum(r['exact_match'] for r in group) / len(group),
+            'executable_pairs': len(executable),
+            'execution_match': sum(executable) / len(executable) if executable else None,
+            'pred_errors': sum(1 for r in group if r['pred_error']),
+            'generation_time': latency_stats([r['pred_generation_time'] for r in group]),
+            'execution_time': latency_stats([r['pred_execution_time'] for r in group])
+        }
+
+    return {
+        'engine': engine,
+        'pairs': len(pairs),
+        'unique_queries': len(executions),
+        'elapsed': time.perf_counter() - start_time,
+        'summary': summary,
+        'records': records
+    }
+
+def write_evaluation_report(report: dict, path: str = REPORT_PATH) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4, default=str)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate pred_sql against gold_sql for every model and dataset")
+    parser.add_argument('--output-root', default=OUTPUT_ROOT)
+    parser.add_argument('--engine', choices=['duckdb', 'sqlite'], default=None,
+                        help="embedded engine to execute on (default: DB_CONFIG['embedded_engine'])")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--report', default=REPORT_PATH)
+    args = parser.parse_args()
+
+    report = evaluate_matrix(args.output_root, args.engine, args.workers)
+    write_evaluation_report(report, args.report)
+    print(f"{report['pairs']} pairs, {report['unique_queries']} unique queries on {report['engine']}, {report['elapsed']:.2f}s")
+    for key, summary in sorted(report['summary'].items()):
+        execution = f"{summary['execution_match']:.2%}" if summary['execution_match'] is not None else "n/a"
+        p50 = summary['generation_time']['p50']
+        print(
+            f"{key:40s} EM {summary['exact_match']:.2%}  EX {execution} "
+            f"({summary['executable_pairs']}/{summary['questions']} executable)  "
+            f"gen p50 {p50 if p50 is None else round(p50, 2)}s"
+        )
+    logger.info(f"Saved: {args.report}")
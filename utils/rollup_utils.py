@@ -0,0 +1,259 @@
+import argparse
+import sys
+import os
+import time
+import logging
+import threading
+from functools import lru_cache
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from psycopg2 import sql
+from prompt.prompts import DATA_FIELDS_MEANING, ROLLUP_CONFIG
+from utils.dataset_utils import get_column_types, get_declared_type
+from utils.sql_utils import tokenize_sql, join_tokens
+from utils.db_utils import get_db_connection, check_table_exists
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Rollups are plain summary tables rather than materialized views: REFRESH MATERIALIZED VIEW
+# always recomputes everything, while these are refreshed one year at a time after ingestion.
+# Each row holds a group's row count and, per measure, SUM/COUNT/MIN/MAX of the non-null
+# values, which is enough to answer AVG, SUM, COUNT, MIN and MAX over any coarser grouping.
+
+def rollup_table_name(table_name: str, group_columns: list) -> str:
+    return f"{table_name}__rollup_{'_'.join(group_columns)}"
+
+# Numeric columns of a table, excluding its grouping columns
+@lru_cache(maxsize=None)
+def get_rollup_measures(table_name: str) -> tuple:
+    dimensions = {column for group in ROLLUP_CONFIG['rollups'].get(table_name, []) for column in group}
+    types = dict(get_column_types(table_name))
+    if not types:
+        # No CSV to infer from (the table is loaded elsewhere): trust the declared types
+        types = {field.lower(): get_declared_type(table_name, field.lower()) for field in DATA_FIELDS_MEANING[table_name]['fields']}
+    return tuple(
+        column for column, column_type in types.items()
+        if column_type in ('INTEGER', 'BIGINT', 'FLOAT') and column not in dimensions
+    )
+
+# === REFRESH ===
+
+def _rollup_select(table_name: str, group_columns: list, measures: tuple):
+    items = [sql.Identifier(column) for column in group_columns]
+    items.append(sql.SQL("COUNT(*) AS row_count"))
+    for measure in measures:
+        for function, suffix in (('SUM', 'sum'), ('COUNT', 'count'), ('MIN', 'min'), ('MAX', 'max')):
+            items.append(sql.SQL("{}({}) AS {}").format(
+                sql.SQL(function), sql.Identifier(measure), sql.Identifier(f"{measure}__{suffix}")
+            ))
+    return sql.SQL("SELECT {} FROM {}").format(sql.SQL(', ').join(items), sql.Identifier(table_name))
+
+def _existing_columns(conn, table_name: str) -> set:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s",
+            (table_name,)
+        )
+        return {row[0] for row in cur.fetchall()}
+
+# Rebuild a table's rollups, or with years only the groups of those years. Runs inside the
+# caller's transaction when conn is given (ingestion refreshes in the same commit as the load).
+def refresh_rollups(table_name: str, years: list = None, conn=None) -> dict:
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        if conn is None:
+            raise ConnectionError("Database connection failed")
+    refreshed = {}
+    if years is not None:
+        years = sorted({int(year) for year in years})
+    try:
+        columns = _existing_columns(conn, table_name)
+        measures = tuple(measure for measure in get_rollup_measures(table_name) if measure in columns)
+        for group_columns in ROLLUP_CONFIG['rollups'].get(table_name, []):
+            if not set(group_columns) <= columns:
+                logger.warning(f"Skipping rollup of '{table_name}' by {group_columns}: missing grouping columns")
+                continue
+            rollup = rollup_table_name(table_name, group_columns)
+            select = _rollup_select(table_name, group_columns, measures)
+            group_by = sql.SQL(', ').join(sql.Identifier(column) for column in group_columns)
+            start_time = time.perf_counter()
+            with conn.cursor() as cur:
+                if years is None or not _table_exists(conn, rollup):
+                    cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(rollup)))
+                    cur.execute(sql.SQL("CREATE TABLE {} AS {} GROUP BY {}").format(sql.Identifier(rollup), select, group_by))
+                else:
+                    cur.execute(sql.SQL("DELETE FROM {} WHERE year = ANY(%s)").format(sql.Identifier(rollup)), (years,))
+                    cur.execute(sql.SQL("INSERT INTO {} {} WHERE year = ANY(%s) GROUP BY {}").format(
+                        sql.Identifier(rollup), select, group_by
+                    ), (years,))
+                cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(rollup)))
+            refreshed[rollup] = time.perf_counter() - start_time
+            _mark_available(rollup)
+        if own_conn:
+            conn.commit()
+    except Exception:
+        if own_conn:
+            conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+    return refreshed
+
+def _table_exists(conn, table_name: str) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f'public.{table_name}',))
+        return cur.fetchone()[0]
+
+# === AVAILABILITY ===
+
+_availability = {}
+_availability_lock = threading.Lock()
+
+def _mark_available(rollup: str):
+    with _availability_lock:
+        _availability[rollup] = (True, time.monotonic())
+
+# Missing rollups are re-checked at most every availability_check_interval seconds
+def _is_available(rollup: str) -> bool:
+    with _availability_lock:
+        cached = _availability.get(rollup)
+    if cached is not None and (cached[0] or time.monotonic() - cached[1] < ROLLUP_CONFIG['availability_check_interval']):
+        return cached[0]
+    available = check_table_exists(None, rollup)
+    with _availability_lock:
+        _availability[rollup] = (available, time.monotonic())
+    return available
+
+# === QUERY REWRITE ===
+
+_AGGREGATES = {'avg', 'sum', 'count', 'min', 'max'}
+_UNSUPPORTED = {'join', 'distinct', 'over', 'union', 'intersect', 'except', 'with', 'filter', 'within', 'into'}
+_TABLE_FOLLOWERS = {'where', 'group', 'order', 'limit', 'having', 'offset'}
+
+def _rewrite_aggregate(function: str, column: str, measures: set, dimensions: set):
+    if column == '*':
+        return ['CAST', '(', 'COALESCE', '(', 'SUM', '(', 'row_count', ')', ',', '0', ')', 'AS', 'BIGINT', ')'] if function == 'count' else None
+    if column in measures:
+        ref = lambda suffix: f'"{column}__{suffix}"'
+        if function == 'avg':
+            return ['(', 'SUM', '(', ref('sum'), ')', '/', 'NULLIF', '(', 'SUM', '(', ref('count'), ')', ',', '0', ')', ')']
+        if function == 'sum':
+            return ['SUM', '(', ref('sum'), ')']
+        if function == 'count':
+            return ['CAST', '(', 'COALESCE', '(', 'SUM', '(', ref('count'), ')', ',', '0', ')', 'AS', 'BIGINT', ')']
+        return [function.upper(), '(', ref(function), ')']
+    if column in dimensions and function in ('min', 'max'):
+        return [function.upper(), '(', f'"{column}"', ')']
+    return None
+
+# Rewrite a single-table aggregate query (AVG/SUM/COUNT/MIN/MAX, optionally grouped and
+# filtered by rollup grouping columns only) to read the smallest rollup that covers it.
+# Returns None whenever the query is not provably answerable from a rollup.
+def rewrite_to_rollup(query: str, table_name: str):
+    groups = ROLLUP_CONFIG['rollups'].get(table_name) if ROLLUP_CONFIG['enabled'] else None
+    if not groups or not query:
+        return None
+    tokens = tokenize_sql(query)
+    while tokens and tokens[-1][1] == ';':
+        tokens.pop()
+    words = [text.lower() for kind, text in tokens if kind == 'word']
+    if words.count('select') != 1 or words.count('from') != 1 or _UNSUPPORTED & set(words):
+        return None
+    if any(text in (';', '.') or kind == 'other' for kind, text in tokens):
+        return None
+
+    fields = {field.lower() for field in DATA_FIELDS_MEANING[table_name]['fields']}
+    measures = set(get_rollup_measures(table_name))
+    all_dimensions = {column for group in groups for column in group}
+    out = []
+    used_dimensions = set()
+    aliases = set()
+    aggregates = 0
+    table_index = None
+    clause = None
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        lowered = text.lower()
+        if kind == 'word' and lowered in ('select', 'from', 'where', 'group', 'having', 'order', 'limit'):
+            clause = lowered
+        if text == '(':
+            depth += 1
+        elif text == ')':
+            depth -= 1
+
+        if (kind == 'word' and lowered in _AGGREGATES and i + 3 < len(tokens)
+                and tokens[i + 1][1] == '(' and tokens[i + 3][1] == ')'):
+            argument_kind, argument = tokens[i + 2]
+            if argument == '*' or (lowered == 'count' and argument == '1'):
+                argument = '*'
+            elif argument_kind in ('word', 'quoted'):
+                argument = argument.lower().strip('"')
+            else:
+                return None
+            replacement = _rewrite_aggregate(lowered, argument, measures, all_dimensions)
+            if replacement is None:
+                return None
+            if argument in all_dimensions:
+                used_dimensions.add(argument)
+            # Keep the column name PostgreSQL gives a bare aggregate in the select list
+            top_level_item = (clause == 'select' and depth == 0 and out and out[-1].lower() in ('select', ',')
+                              and i + 4 < len(tokens) and tokens[i + 4][1].lower() in (',', 'from'))
+            out.extend(replacement + (['AS', lowered] if top_level_item else []))
+            aggregates += 1
+            i += 4
+            continue
+
+        if clause == 'from' and kind in ('word', 'quoted') and lowered != 'from':
+            if lowered.strip('"') != table_name.lower() or table_index is not None:
+                return None
+            if i + 1 < len(tokens) and tokens[i + 1][1].lower() not in _TABLE_FOLLOWERS:
+                return None
+            table_index = len(out)
+            out.append(text)
+            i += 1
+            continue
+
+        if kind in ('word', 'quoted'):
+            column = lowered.strip('"')
+            if out and out[-1].lower() == 'as':
+                aliases.add(column)
+            elif column in fields and column not in aliases:
+                if column not in all_dimensions:
+                    return None
+                used_dimensions.add(column)
+        out.append(text)
+        i += 1
+
+    if not aggregates or table_index is None:
+        return None
+    candidates = [group for group in groups if used_dimensions <= set(group)]
+    if not candidates:
+        return None
+    group_columns = min(candidates, key=len)
+    rollup = rollup_table_name(table_name, group_columns)
+    if not _is_available(rollup):
+        return None
+    out[table_index] = f'"{rollup}"'
+    return join_tokens(out)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the aggregate rollup tables")
+    parser.add_argument('--tables', nargs='+', default=list(ROLLUP_CONFIG['rollups']))
+    parser.add_argument('--years', nargs='+', type=int, default=None, help="refresh only these years")
+    args = parser.parse_args()
+
+    for table_name in args.tables:
+        try:
+            refreshed = refresh_rollups(table_name, args.years)
+        except ConnectionError:
+            logger.error("Please check your PostgreSQL configuration. Exiting...")
+            sys.exit(1)
+        for rollup, elapsed in refreshed.items():
+            print(f"{rollup:60s} {elapsed:.2f}s")
@@ -0,0 +1,201 @@
+import sys
+import re
+import math
+import logging
+from functools import lru_cache
+
+sys.path.append('.')
+
+from prompt.prompts import DATA_FIELDS_MEANING, ROUTING_CONFIG
+from utils.schema_utils import get_column_index, question_terms, tokenize_text, STOPWORDS
+from utils.dataset_utils import get_declared_type
+from utils.validation_utils import typo_match
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Picks the table a question is about without an LLM call. A table scores by its best
+# matching columns (the schema_utils column index: column names, CSV headers and
+# descriptions), by the distinct values of its categorical columns named in the question
+# ("South Asia", "d10", ...) and, for day-level questions, by having a DATE column.
+# Words and values found in every table carry no weight, so country names and "year"
+# decide nothing.
+
+_NUMBER_RE = re.compile(r'^[\d\s.:/-]+$')
+_MONTHS = r'(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*'
+_DAY_RE = re.compile(rf'\b(?:{_MONTHS}\s+\d{{1,2}}\b|\d{{1,2}}\s+{_MONTHS}\b|\d{{4}}-\d{{2}}-\d{{2}}|days?\b|daily\b)', re.IGNORECASE)
+
+def _value_phrase(value: str):
+    # Numbers, and short codes such as ISO "ARE" or "PER" that collide with English words
+    if _NUMBER_RE.match(value) or (value.isupper() and len(value) <= 3):
+        return None
+    tokens = tokenize_text(value)
+    if not tokens or len(tokens) > ROUTING_CONFIG['max_value_words'] or all(token in STOPWORDS for token in tokens):
+        return None
+    return ' '.join(tokens)
+
+# Built once: per-table word weights, categorical value phrases and their IDF across tables
+@lru_cache(maxsize=None)
+def get_routing_index() -> dict:
+    terms = {}
+    columns = {}
+    values = {}
+    dated = set()
+    for table_name in DATA_FIELDS_MEANING:
+        index = get_column_index(table_name)
+        weights = {}
+        for document in index['documents'].values():
+            for term, weight in document.items():
+                weights[term] = max(weights.get(term, 0.0), weight)
+        terms[table_name] = weights
+        columns[table_name] = [
+            (' '.join(tokenize_text(field.replace('_', ' '))), document) for field, document in index['documents'].items()
+        ]
+        if any(get_declared_type(table_name, field.lower()) == 'DATE' for field in index['documents']):
+            dated.add(table_name)
+        for stats in index['stats'].values():
+            for value in stats['distinct_values'] or []:
+                phrase = _value_phrase(value)
+                if phrase is not None:
+                    values.setdefault(phrase, set()).add(table_name)
+
+    tables = len(terms)
+    document_frequency = {}
+    for weights in terms.values():
+        for term in weights:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    term_idf = {term: math.log(tables / df) for term, df in document_frequency.items() if df < tables}
+
+    # Only tables whose CSV is available contribute values, so a value is shared when all of those have it
+    value_tables = len({table_name for owners in values.values() for table_name in owners})
+    value_idf = {phrase: math.log(value_tables / len(owners)) for phrase, owners in values.items() if len(owners) < value_tables}
+    # Single words of those values ("oecd" of "oecd member"), used to order close candidates
+    value_words = {}
+    for phrase, owners in values.items():
+        for word in phrase.split():
+            if word not in STOPWORDS:
+                value_words.setdefault(word, set()).update(owners)
+    return {
+        'columns': columns,
+        'vocabulary': frozenset(document_frequency),
+        'dated': frozenset(dated),
+        'term_idf': term_idf,
+        'values': {phrase: frozenset(values[phrase]) for phrase in value_idf},
+        'value_idf': value_idf,
+        'value_words': {word: frozenset(owners) for word, owners in value_words.items() if len(owners) < value_tables}
+    }
+
+def _value_matches(question: str, index: dict) -> list:
+    tokens = tokenize_text(question)
+    matches = []
+    for size in range(1, ROUTING_CONFIG['max_value_words'] + 1):
+        for i in range(len(tokens) - size + 1):
+            phrase = ' '.join(tokens[i:i + size])
+            if phrase in index['values']:
+                matches.append(phrase)
+    return matches
+
+# Sum of the best ROUTING_CONFIG['top_columns'] column scores; a column whose whole name
+# is spelled out in the question counts double (as in schema_utils.score_columns)
+def _column_score(table_columns: list, terms: set, question_text: str, idf: dict) -> float:
+    scores = []
+    for name, weights in table_columns:
+        score = sum(idf[term] * weights[term] for term in terms if term in weights and term in idf)
+        if score > 0 and name in question_text:
+            score *= 2
+        scores.append(score)
+    return sum(sorted(scores, reverse=True)[:ROUTING_CONFIG['top_columns']])
+
+# Question words no table knows, replaced by the one table word a typo away
+# ("generiosity" -> generosity, "gpd" -> gdp, "long gdp" -> log gdp)
+def _correct_typos(question: str, index: dict) -> str:
+    tokens = []
+    for token in tokenize_text(question):
+        if token not in index['vocabulary'] and token not in STOPWORDS and len(token) >= 3 and not token.isdigit():
+            token = typo_match(token, index['vocabulary']) or token
+        tokens.append(token)
+    return ' '.join(tokens)
+
+# {table_name: score} for every table with a positive score
+def score_tables(question: str, tables: list = None) -> dict:
+    index = get_routing_index()
+    candidates = [table_name for table_name in (tables or index['columns']) if table_name in index['columns']]
+    question_text = _correct_typos(question, index)
+    terms = set(question_terms(question_text))
+    scores = {
+        table_name: _column_score(index['columns'][table_name], terms, question_text, index['term_idf'])
+        for table_name in candidates
+    }
+    if _DAY_RE.search(question):
+        for table_name in index['dated'] & set(scores):
+            scores[table_name] += ROUTING_CONFIG['date_weight']
+    for phrase in _value_matches(question, index):
+        bonus = ROUTING_CONFIG['value_weight'] * len(phrase.split()) * index['value_idf'][phrase]
+        for table_name in index['values'][phrase]:
+            if table_name in scores:
+                scores[table_name] += bonus
+    return {table_name: score for table_name, score in scores.items() if score > 0}
+
+# Tables to answer the question from, best first: the best match plus runner-ups within
+# ROUTING_CONFIG['ambiguity_ratio'] of it. prefer (the table of the question's stream, see
+# stream_table) goes first when it scores within ROUTING_CONFIG['stream_ratio'] of the best,
+# so generic questions ("population of China") stay on the stream's table. Falls back to
+# prefer, the default table or the first of tables when nothing matches.
+def route_question(question: str, tables: list = None, prefer: str = None) -> list:
+    scores = score_tables(question, tables)
+    if not scores:
+        default = prefer or ROUTING_CONFIG['default_table']
+        if tables and default not in tables:
+            default = tables[0]
+        return [default]
+    best = max(scores.values())
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    close = [table_name for table_name in ranked if scores[table_name] >= best * ROUTING_CONFIG['ambiguity_ratio']]
+    tied = [table_name for table_name in close if scores[table_name] >= best * ROUTING_CONFIG['tie_ratio']]
+    if len(tied) > 1:
+        # Near-ties are broken by how many question words appear in each table's categorical
+        # values ("oecd" of "OECD members")
+        index = get_routing_index()
+        words = set(_correct_typos(question, index).split())
+        hits = {table_name: sum(table_name in index['value_words'].get(word, ()) for word in words) for table_name in tied}
+        tied.sort(key=lambda table_name: (hits[table_name], scores[table_name]), reverse=True)
+        close = tied + [table_name for table_name in close if table_name not in tied]
+    if prefer in scores and scores[prefer] >= best * ROUTING_CONFIG['stream_ratio']:
+        close = [prefer] + [table_name for table_name in close if table_name != prefer]
+    return close
+
+# The table a stream of questions is about: the one that at least ROUTING_CONFIG['stream_share']
+# of them route to on their own, without close runner-ups. None for a mixed stream.
+def stream_table(questions: list, tables: list = None):
+    counts = {}
+    for question in questions:
+        routed = route_question(question, tables)
+        if len(routed) == 1 and score_tables(question, tables):
+            counts[routed[0]] = counts.get(routed[0], 0) + 1
+    if not counts:
+        return None
+    best = max(counts, key=counts.get)
+    return best if counts[best] >= len(questions) * ROUTING_CONFIG['stream_share'] else None
+
+if __name__ == "__main__":
+    import os
+    import json
+    from prompt.prompts import DATASET_CONFIG
+
+    # Routing accuracy over query/input: each file's questions should reach its dataset's table
+    input_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'query', 'input')
+    totals = [0, 0, 0]
+    for dataset, table_name in DATASET_CONFIG['tables'].items():
+        with open(os.path.join(input_dir, f"{dataset}.json"), encoding='utf-8') as f:
+            questions = json.load(f)['user_queries']
+        preferred = stream_table(questions)
+        alone = [route_question(question)[0] for question in questions]
+        in_stream = [route_question(question, prefer=preferred)[0] for question in questions]
+        hits = (sum(routed == table_name for routed in alone), sum(routed == table_name for routed in in_stream))
+        totals = [totals[0] + hits[0], totals[1] + hits[1], totals[2] + len(questions)]
+        print(f"{dataset:20s} alone {hits[0]:>3d}/{len(questions)}, in stream {hits[1]:>3d}/{len(questions)} (stream table: {preferred})")
+        for question, routed in zip(questions, in_stream):
+            if routed != table_name:
+                print(f"    -> {routed}: {question}")
+    print(f"{'total':20s} alone {totals[0]:>3d}/{totals[2]}, in stream {totals[1]:>3d}/{totals[2]}")
@@ -0,0 +1,134 @@
+import sys
+import re
+import math
+import logging
+from functools import lru_cache
+
+sys.path.append('.')
+
+from prompt.prompts import DATA_FIELDS_MEANING, SCHEMA_PRUNING_CONFIG
+from utils.dataset_utils import get_csv_path, read_csv_header, map_csv_columns, get_column_stats
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'at', 'to', 'for', 'by', 'and', 'or', 'is', 'are', 'was', 'were',
+    'what', 'which', 'who', 'how', 'many', 'much', 'does', 'do', 'did', 'has', 'have', 'with', 'from',
+    'than', 'that', 'this', 'these', 'those', 'as', 'be', 'it', 'its', 'me', 'for', 'there', 'any',
+    'between', 'over', 'through', 'across', 'year', 'years', 'all', 'each', 'their', 'score', 'rate'
+}
+
+# Question vocabulary that does not appear literally in column names
+_SYNONYMS = {
+    'hdi': ['human', 'development', 'index'],
+    'inequality': ['gini'],
+    'deflation': ['inflation'],
+    'economic': ['econ'],
+    'economy': ['econ', 'gdp'],
+    'grow': ['growth'],
+    'percentage': ['pct'],
+    'percent': ['pct'],
+    'weather': ['climate'],
+    'enrolment': ['enrollment'],
+    'gpd': ['gdp'],
+    'wealth': ['gdp'],
+    'emission': ['co2'],
+    'carbon': ['co2'],
+    'decile': ['category'],
+    'group': ['category'],
+    'net': ['income_net'],
+    'digital': ['digital'],
+    'happiness': ['life', 'ladder'],
+    'corruption': ['corruption'],
+    'fdi': ['fdi']
+}
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+def tokenize_text(text: str) -> list:
+    return [_stem(token) for token in re.findall(r'[a-z0-9]+', text.lower())]
+
+def question_terms(question: str) -> list:
+    terms = []
+    for token in tokenize_text(question):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        for synonym in _SYNONYMS.get(token, []):
+            terms.extend(tokenize_text(synonym) if '_' not in synonym else [synonym])
+    return terms
+
+# Lexical index over a table's columns: column-name tokens weigh most, then the CSV
+# header wording, then the description (several descriptions are placeholders)
+@lru_cache(maxsize=None)
+def get_column_index(table_name: str) -> dict:
+    fields = DATA_FIELDS_MEANING[table_name]['fields']
+    headers = {}
+    path = get_csv_path(table_name)
+    if path is not None:
+        raw_headers = read_csv_header(path)
+        headers = dict(zip(map_csv_columns(table_name, tuple(raw_headers)), raw_headers))
+
+    documents = {}
+    for field, description in fields.items():
+        weights = {}
+        for token in tokenize_text(field.replace('_', ' ')):
+            weights[token] = max(weights.get(token, 0.0), 2.0)
+        weights[field.lower()] = 2.0
+        for token in tokenize_text(headers.get(field.lower(), '')):
+            weights[token] = max(weights.get(token, 0.0), 1.5)
+        if not description.startswith('No description provided'):
+            for token in tokenize_text(re.sub(r'\([^)]*\)', ' ', description)):
+                if token not in STOPWORDS:
+                    weights[token] = max(weights.get(token, 0.0), 0.5)
+        documents[field] = weights
+
+    document_frequency = {}
+    for weights in documents.values():
+        for token in weights:
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    idf = {token: math.log(1 + len(documents) / df) for token, df in document_frequency.items()}
+    return {'documents': documents, 'idf': idf, 'stats': get_column_stats(table_name)}
+
+def score_columns(question: str, table_name: str) -> dict:
+    index = get_column_index(table_name)
+    terms = question_terms(question)
+    question_text = ' '.join(tokenize_text(question))
+    scores = {}
+    for field, weights in index['documents'].items():
+        score = sum(index['idf'].get(term, 0.0) * weights[term] for term in set(terms) if term in weights)
+        if score <= 0:
+            continue
+        # Whole column name spelled out in the question ("gdp per capita")
+        if ' '.join(tokenize_text(field.replace('_', ' '))) in question_text:
+            score *= 2
+        stats = index['stats'].get(field.lower())
+        if stats is not None:
+            score *= 1 - 0.5 * stats['null_ratio']
+        scores[field] = score
+    return scores
+
+# Columns worth sending to the LLM for this question, in the table's declared order.
+# Returns None when the table is narrow enough to send whole or nothing matched.
+def select_relevant_columns(question: str, table_name: str, top_k: int = None, min_fields: int = None):
+    if table_name not in DATA_FIELDS_MEANING:
+        return None
+    fields = list(DATA_FIELDS_MEANING[table_name]['fields'])
+    min_fields = SCHEMA_PRUNING_CONFIG['min_fields'] if min_fields is None else min_fields
+    if len(fields) <= min_fields:
+        return None
+
+    scores = score_columns(question, table_name)
+    if not scores:
+        return None
+    top_k = top_k or SCHEMA_PRUNING_CONFIG['top_k']
+    selected = set(sorted(scores, key=scores.get, reverse=True)[:top_k])
+    selected.update(field for field in fields if field.lower() in SCHEMA_PRUNING_CONFIG['key_columns'])
+    return tuple(field for field in fields if field in selected)
@@ -0,0 +1,109 @@
+import re
+
+_TOKEN_RE = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*")
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op><=|>=|<>|!=|::|\|\||[-+*/%=<>^])
+  | (?P<punct>[(),;.\[\]])
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# Split SQL into (kind, text) tokens; whitespace and comments are dropped
+def tokenize_sql(sql: str) -> list:
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql or ''):
+        kind = match.lastgroup
+        if kind in ('space', 'comment'):
+            continue
+        tokens.append((kind, match.group()))
+    return tokens
+
+# Canonical form used as a cache key: comments and layout removed, unquoted words
+# lower-cased (PostgreSQL folds them anyway), literals and quoted identifiers kept verbatim
+def canonicalize_sql(sql: str) -> str:
+    parts = []
+    for kind, text in tokenize_sql(sql):
+        parts.append(text.lower() if kind == 'word' else text)
+    while parts and parts[-1] == ';':
+        parts.pop()
+    return ' '.join(parts)
+
+# Best-effort rewrite of the PostgreSQL constructs generated for our tables into SQLite:
+# casts (::type) are dropped, ILIKE becomes LIKE (case-insensitive in SQLite) and
+# EXTRACT(<part> FROM x) becomes strftime
+_EXTRACT_FORMATS = {'year': '%Y', 'month': '%m', 'day': '%d'}
+
+def translate_postgres_to_sqlite(sql: str) -> str:
+    tokens = tokenize_sql(sql)
+    out = []
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        lowered = text.lower()
+        if kind == 'op' and text == '::':
+            i += 2
+            # Drop type modifiers such as numeric(10, 2)
+            if i < len(tokens) and tokens[i][1] == '(':
+                depth = 0
+                while i < len(tokens):
+                    depth += tokens[i][1] == '('
+                    depth -= tokens[i][1] == ')'
+                    i += 1
+                    if depth == 0:
+                        break
+            continue
+        if kind == 'word' and lowered == 'ilike':
+            out.append('LIKE')
+        elif (kind == 'word' and lowered == 'extract' and i + 3 < len(tokens)
+              and tokens[i + 1][1] == '(' and tokens[i + 2][1].lower() in _EXTRACT_FORMATS
+              and tokens[i + 3][1].lower() == 'from'):
+            out.extend(['CAST', '(', 'strftime', '(', f"'{_EXTRACT_FORMATS[tokens[i + 2][1].lower()]}'", ','])
+            depth = 1
+            i += 4
+            while i < len(tokens) and depth:
+                depth += tokens[i][1] == '('
+                depth -= tokens[i][1] == ')'
+                if depth:
+                    out.append(tokens[i][1])
+                i += 1
+            out.extend([')', 'AS', 'INTEGER', ')'])
+            continue
+        else:
+            out.append(text)
+        i += 1
+    return join_tokens(out)
+
+_SPACED_BEFORE_PAREN = {'and', 'or', 'not', 'in', 'as', 'from', 'where', 'on', 'select', 'by', 'when', 'then', 'else', 'join', 'exists', 'over', 'with', 'union', 'all', 'any'}
+
+def join_tokens(parts: list) -> str:
+    sql = ''
+    previous = ''
+    for part in parts:
+        function_call = part == '(' and re.match(r'^[A-Za-z_]\w*$', previous) and previous.lower() not in _SPACED_BEFORE_PAREN
+        if sql and not (part in (')', ',', '.', ';') or function_call or sql.endswith(('(', '.'))):
+            sql += ' '
+        sql += part
+        previous = part
+    return sql
+
+_FENCE_RE = re.compile(r'```(?:sql)?\s*(.*?)```', re.IGNORECASE | re.DOTALL)
+_STATEMENT_START_RE = re.compile(r'\b(SELECT|WITH)\b', re.IGNORECASE)
+
+# First SQL statement in raw model output, which may wrap it in a code fence or prose
+def extract_sql_statement(text: str) -> str:
+    text = text or ''
+    fence = _FENCE_RE.search(text)
+    if fence:
+        text = fence.group(1)
+    start = _STATEMENT_START_RE.search(text)
+    if start is None:
+        return ''
+    text = text[start.start():]
+    for match in _TOKEN_RE.finditer(text):
+        if match.group() == ';':
+            return text[:match.start()].strip()
+    return text.strip()
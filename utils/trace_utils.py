@@ -0,0 +1,218 @@
+import sys
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+
+sys.path.append('.')
+
+from prompt.prompts import TRACE_CONFIG
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Spans are timed with time.perf_counter() (monotonic) and kept in the question's state as
+# {'name', 'span_id', 'parent_id', 'start', 'end', 'attributes'}; they are always recorded
+# (the state's *_time fields come from them) and TRACE_CONFIG only controls export.
+# Wall-clock times are derived on export, from one anchor taken at import.
+_ANCHOR_WALL_NS = time.time_ns()
+_ANCHOR_PERF = time.perf_counter()
+
+def _to_unix_ns(perf_time: float) -> int:
+    return _ANCHOR_WALL_NS + int((perf_time - _ANCHOR_PERF) * 1e9)
+
+def _new_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def _ensure_trace(state: dict):
+    if 'trace_id' not in state:
+        state['trace_id'] = uuid.uuid4().hex
+    state.setdefault('spans', [])
+    state.setdefault('_open_spans', [])
+
+# Record a span around a block; spans opened inside it become its children. Yields the
+# span so attributes (token counts, row counts, ...) can be added before it closes.
+@contextmanager
+def span(state: dict, name: str, **attributes):
+    _ensure_trace(state)
+    entry = {
+        'name': name,
+        'span_id': _new_span_id(),
+        'parent_id': state['_open_spans'][-1] if state['_open_spans'] else None,
+        'start': time.perf_counter(),
+        'end': None,
+        'attributes': attributes
+    }
+    state['_open_spans'].append(entry['span_id'])
+    try:
+        yield entry
+    finally:
+        entry['end'] = time.perf_counter()
+        state['_open_spans'].pop()
+        state['spans'].append(entry)
+
+# Record an interval measured elsewhere as a child of the currently open span
+def record_span(state: dict, name: str, start: float, end: float, **attributes) -> dict:
+    _ensure_trace(state)
+    entry = {
+        'name': name,
+        'span_id': _new_span_id(),
+        'parent_id': state['_open_spans'][-1] if state['_open_spans'] else None,
+        'start': start,
+        'end': end,
+        'attributes': attributes
+    }
+    state['spans'].append(entry)
+    return entry
+
+# Record the timings filled in by run_query / timed()
+def add_spans(state: dict, timings: dict):
+    for name, (start, end) in sorted((timings or {}).items(), key=lambda item: item[1][0]):
+        record_span(state, name, start, end)
+
+# Fill timings[name] with the (start, end) perf_counter interval of a block; a name timed
+# twice covers both blocks. Does nothing when timings is None.
+@contextmanager
+def timed(timings: dict, name: str):
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        if name in timings:
+            start = min(start, timings[name][0])
+        timings[name] = (start, end)
+
+def span_seconds(entry: dict) -> float:
+    return entry['end'] - entry['start']
+
+def stage_durations(state: dict) -> dict:
+    durations = {}
+    for entry in state.get('spans', []):
+        durations[entry['name']] = durations.get(entry['name'], 0.0) + entry['end'] - entry['start']
+    return {name: round(duration, 6) for name, duration in durations.items()}
+
+# === EXPORT ===
+
+_export_lock = threading.Lock()
+
+def _span_record(state: dict, entry: dict) -> dict:
+    return {
+        'trace_id': state['trace_id'],
+        'span_id': entry['span_id'],
+        'parent_id': entry['parent_id'],
+        'name': entry['name'],
+        'start_unix_ns': _to_unix_ns(entry['start']),
+        'duration_ms': round((entry['end'] - entry['start']) * 1000, 3),
+        'attributes': entry['attributes']
+    }
+
+# One JSON object per span, appended to path
+def export_jsonl(states: list, path: str = None) -> int:
+    path = path or TRACE_CONFIG['jsonl_path']
+    lines = [json.dumps(_span_record(state, entry), ensure_ascii=False, default=str)
+             for state in states if state.get('spans') for entry in state['spans']]
+    with _export_lock:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line + '\n')
+    return len(lines)
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+# OTLP/JSON (the OpenTelemetry protocol's JSON encoding), accepted by OpenTelemetry
+# collectors and by Jaeger/Tempo importers
+def to_otlp(states: list) -> dict:
+    spans = []
+    for state in states:
+        for entry in state.get('spans', []):
+            attributes = [{'key': key, 'value': _otlp_value(value)} for key, value in entry['attributes'].items() if value is not None]
+            spans.append({
+                'traceId': state['trace_id'],
+                'spanId': entry['span_id'],
+                **({'parentSpanId': entry['parent_id']} if entry['parent_id'] else {}),
+                'name': entry['name'],
+                'kind': 1,
+                'startTimeUnixNano': str(_to_unix_ns(entry['start'])),
+                'endTimeUnixNano': str(_to_unix_ns(entry['end'])),
+                'attributes': attributes
+            })
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': TRACE_CONFIG['service_name']}}]},
+        'scopeSpans': [{'scope': {'name': 'text2sql.agent'}, 'spans': spans}]
+    }]}
+
+def export_otlp(states: list, path: str = None) -> int:
+    path = path or TRACE_CONFIG['otlp_path']
+    payload = to_otlp(states)
+    with _export_lock:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+    return len(payload['resourceSpans'][0]['scopeSpans'][0]['spans'])
+
+def export_traces(states: list, fmt: str = None) -> int:
+    fmt = fmt if fmt is not None else TRACE_CONFIG['export']
+    if fmt == 'jsonl':
+        return export_jsonl(states)
+    if fmt == 'otlp':
+        return export_otlp(states)
+    return 0
+
+# === BATCH PROFILE ===
+
+def _percentile(values: list, q: float) -> float:
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+# Per span name: how often it ran, total/mean/p50/p95/max seconds and its share of the
+# time spent in top-level spans, across every question of a batch
+def profile(states: list) -> dict:
+    durations = {}
+    top_level_total = 0.0
+    for state in states:
+        for entry in state.get('spans', []):
+            duration = entry['end'] - entry['start']
+            durations.setdefault(entry['name'], []).append(duration)
+            if entry['parent_id'] is None:
+                top_level_total += duration
+    report = {}
+    for name, values in durations.items():
+        values.sort()
+        report[name] = {
+            'count': len(values),
+            'total': round(sum(values), 4),
+            'mean': round(sum(values) / len(values), 4),
+            'p50': round(_percentile(values, 50), 4),
+            'p95': round(_percentile(values, 95), 4),
+            'max': round(values[-1], 4),
+            'share': round(sum(values) / top_level_total, 4) if top_level_total else None
+        }
+    return dict(sorted(report.items(), key=lambda item: item[1]['total'], reverse=True))
+
+def format_profile(report: dict) -> str:
+    lines = [f"{'span':22s} {'count':>6s} {'total s':>9s} {'mean s':>8s} {'p50 s':>8s} {'p95 s':>8s} {'max s':>8s} {'share':>6s}"]
+    for name, stats in report.items():
+        share = f"{stats['share']:.0%}" if stats['share'] is not None else '-'
+        lines.append(
+            f"{name:22s} {stats['count']:>6d} {stats['total']:>9.3f} {stats['mean']:>8.4f} {stats['p50']:>8.4f} "
+            f"{stats['p95']:>8.4f} {stats['max']:>8.4f} {share:>6s}"
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,267 @@
+import sys
+import re
+import difflib
+import logging
+from functools import lru_cache
+
+sys.path.append('.')
+
+from prompt.prompts import DATA_FIELDS_MEANING, SQL_VALIDATION_CONFIG
+from utils.sql_utils import tokenize_sql, canonicalize_sql, join_tokens, extract_sql_statement
+
+# Logging Configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Local checks run on generated SQL before it reaches the database: a single read-only
+# SELECT, balanced parentheses, and table/column names known from DATA_FIELDS_MEANING.
+# A name one typo away from exactly one known name, and common non-PostgreSQL syntax, are
+# fixed in place; anything else is reported as an error the LLM can be re-prompted with.
+
+# Rejected where a statement starts
+_STATEMENT_KEYWORDS = {
+    'insert', 'update', 'delete', 'merge', 'drop', 'create', 'alter', 'truncate', 'grant', 'revoke', 'copy',
+    'call', 'do', 'execute', 'vacuum', 'analyze', 'reindex', 'cluster', 'lock', 'comment', 'set', 'reset',
+    'begin', 'commit', 'rollback', 'savepoint', 'prepare', 'listen', 'notify'
+}
+# Rejected anywhere inside the SELECT (data-modifying CTEs, SELECT INTO)
+_WRITE_KEYWORDS = {'insert', 'update', 'delete', 'merge', 'drop', 'create', 'alter', 'truncate', 'grant', 'revoke', 'copy', 'into'}
+
+_KEYWORDS = {
+    'select', 'from', 'where', 'group', 'by', 'order', 'having', 'limit', 'offset', 'fetch', 'next', 'first',
+    'last', 'only', 'rows', 'row', 'ties', 'as', 'and', 'or', 'not', 'in', 'is', 'null', 'nulls', 'true', 'false',
+    'unknown', 'like', 'ilike', 'similar', 'to', 'escape', 'between', 'symmetric', 'case', 'when', 'then', 'else',
+    'end', 'asc', 'desc', 'distinct', 'all', 'any', 'some', 'on', 'using', 'join', 'inner', 'left', 'right',
+    'full', 'outer', 'cross', 'natural', 'lateral', 'with', 'recursive', 'materialized', 'union', 'intersect',
+    'except', 'exists', 'over', 'partition', 'range', 'groups', 'preceding', 'following', 'unbounded',
+    'current', 'window', 'filter', 'within', 'isnull', 'notnull', 'collate', 'at', 'time', 'zone', 'interval',
+    'date', 'timestamp', 'year', 'month', 'day', 'hour', 'minute', 'second', 'week', 'quarter', 'dow', 'doy',
+    'epoch', 'decade', 'century', 'integer', 'int', 'bigint', 'smallint', 'numeric', 'decimal', 'real', 'float',
+    'double', 'precision', 'text', 'varchar', 'char', 'character', 'varying', 'boolean', 'current_date',
+    'current_timestamp', 'current_time', 'localtime', 'localtimestamp', 'default', 'values', 'array', 'percent',
+    'cube', 'rollup', 'sets', 'grouping', 'ordinality', 'without', 'no', 'others', 'exclude', 'tablesample'
+}
+
+_CLAUSE_KEYWORDS = {'select', 'from', 'where', 'group', 'having', 'order', 'limit', 'on', 'using', 'join'}
+_COMPARISON_OPS = {'=', '<>', '!=', 'like', 'ilike'}
+_BACKTICK_RE = re.compile(r'`([^`]+)`')
+
+@lru_cache(maxsize=None)
+def _table_columns(table_name: str) -> frozenset:
+    return frozenset(field.lower() for field in DATA_FIELDS_MEANING.get(table_name, {}).get('fields', {}))
+
+# Closest candidates, ignoring underscores (LLMs often write lifeladder for life_ladder)
+def _closest(name: str, candidates, n: int = 1, cutoff: float = 0.5) -> list:
+    squashed = {candidate.replace('_', ''): candidate for candidate in sorted(candidates)}
+    matches = difflib.get_close_matches(name.replace('_', ''), list(squashed), n=n, cutoff=cutoff)
+    return [squashed[match] for match in matches]
+
+# One inserted, deleted, replaced or swapped character
+def one_typo(a: str, b: str) -> bool:
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) > 1:
+        return False
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    return a[i + 1:] == b[i + 1:] or (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+
+# The only candidate one typo away from name, or None. Anything looser (e.g.
+# income_net_d10 -> income_net) would silently change what the query means.
+def typo_match(name: str, candidates):
+    matches = [candidate for candidate in candidates if one_typo(name, candidate)]
+    return matches[0] if len(matches) == 1 else None
+
+def _name(token: tuple) -> str:
+    kind, text = token
+    return _unquote(text).lower() if kind == 'quoted' else text.lower()
+
+def _unquote(text: str) -> str:
+    return text[1:-1].replace('""', '"')
+
+def _is_name(token: tuple) -> bool:
+    return token[0] == 'quoted' or (token[0] == 'word' and token[1].lower() not in _KEYWORDS)
+
+def _result(sql: str, errors: list, repairs: list) -> dict:
+    return {'valid': not errors, 'sql': sql, 'errors': errors, 'repairs': repairs}
+
+# The single SELECT to validate and its tokens, or an error message
+def _extract_select(sql: str, repairs: list):
+    text = sql or ''
+    # A write statement wherever a statement can start is rejected outright, even when a
+    # SELECT follows (extraction would otherwise pick up its subquery)
+    statement_start = True
+    for kind, token in tokenize_sql(text):
+        if statement_start and kind == 'word' and token.lower() in _STATEMENT_KEYWORDS:
+            return None, None, f"Only SELECT statements are allowed, found {token.upper()}"
+        statement_start = token == ';' or (statement_start and kind != 'word')
+
+    statement = extract_sql_statement(text)
+    if not statement:
+        return None, None, "No SELECT statement found in the generated text"
+    if canonicalize_sql(statement) != canonicalize_sql(text):
+        repairs.append("kept only the SQL statement")
+    if '`' in statement:
+        statement = _BACKTICK_RE.sub(lambda match: f'"{match.group(1)}"', statement)
+        repairs.append("backtick quoting -> double quotes")
+    return statement, tokenize_sql(statement), None
+
+# T-SQL "SELECT TOP n ..." -> "SELECT ... LIMIT n"
+def _repair_top(tokens: list, repairs: list) -> list:
+    if len(tokens) > 2 and tokens[0][1].lower() == 'select' and tokens[1][1].lower() == 'top' and tokens[2][0] == 'number':
+        limit = tokens[2]
+        tokens = tokens[:1] + tokens[3:]
+        if not any(kind == 'word' and text.lower() == 'limit' for kind, text in tokens):
+            tokens += [('word', 'LIMIT'), limit]
+        repairs.append("TOP -> LIMIT")
+    return tokens
+
+def _check_structure(tokens: list) -> list:
+    words = {text.lower() for kind, text in tokens if kind == 'word'}
+    forbidden = sorted(words & _WRITE_KEYWORDS)
+    if forbidden:
+        return [f"Only reading queries are allowed, found {forbidden[0].upper()}"]
+    errors = [f"Unexpected character {text!r}" for kind, text in tokens if kind == 'other']
+    depth = 0
+    for _, text in tokens:
+        depth += text == '('
+        depth -= text == ')'
+        if depth < 0:
+            break
+    if depth:
+        errors.append("Unbalanced parentheses")
+    return errors
+
+# Positions of table references and the names the statement defines itself (CTEs, aliases)
+def _scan_names(tokens: list):
+    tables = set()
+    defined = set()
+    clauses = [None]
+    for i, token in enumerate(tokens):
+        text = token[1].lower()
+        previous = tokens[i - 1] if i else ('', '')
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else ''
+        if text == '(':
+            clauses.append(None)
+        elif text == ')':
+            if len(clauses) > 1:
+                clauses.pop()
+        elif token[0] == 'word' and text in _CLAUSE_KEYWORDS:
+            clauses[-1] = text
+        if not _is_name(token) or following == '(':
+            continue
+
+        table_slot = (previous[1].lower() in ('from', 'join') or (previous[1] == ',' and clauses[-1] == 'from')
+                      or (previous[1] == '.' and i - 2 in tables))
+        if table_slot:
+            if following == '.':
+                # schema.table: the table name comes next
+                tables.add(i)
+                continue
+            tables.discard(i - 2)
+            tables.add(i)
+        elif previous[1].lower() == 'as':
+            defined.add(_name(token))
+        elif following.lower() == 'as' and i + 2 < len(tokens) and tokens[i + 2][1] == '(':
+            defined.add(_name(token))
+        elif following != '.' and (previous[1] == ')' or i - 1 in tables or previous[0] in ('number', 'string')
+                                   or (_is_name(previous) and (i < 2 or tokens[i - 2][1] != '::'))):
+            # An alias without AS, e.g. "AVG(x) avg_x" or "FROM t w"
+            defined.add(_name(token))
+    return tables, defined
+
+# Validate, and where possible repair, generated SQL for table_name.
+# Returns {'valid', 'sql', 'errors', 'repairs'}, where 'sql' is the repaired statement.
+def validate_sql(sql: str, table_name: str) -> dict:
+    repairs = []
+    statement, tokens, error = _extract_select(sql, repairs)
+    if error is not None:
+        return _result(sql, [error], repairs)
+    tokens = _repair_top(tokens, repairs)
+    errors = _check_structure(tokens)
+    if errors:
+        return _result(sql, errors, repairs)
+
+    texts = [text for _, text in tokens]
+    tables, defined = _scan_names(tokens)
+    known_tables = set(DATA_FIELDS_MEANING)
+    referenced = set()
+    for i in sorted(tables):
+        if i + 1 < len(tokens) and texts[i + 1] == '.':
+            continue
+        name = _name(tokens[i])
+        if name in known_tables:
+            referenced.add(name)
+        elif name not in defined:
+            match = typo_match(name, known_tables)
+            if match:
+                repairs.append(f"table {texts[i]} -> {match}")
+                texts[i] = match
+                referenced.add(match)
+            else:
+                errors.append(f"Unknown table {texts[i]}; only query the table {table_name}")
+    if errors:
+        return _result(sql, errors, repairs)
+
+    columns = set()
+    for name in referenced or {table_name}:
+        columns |= _table_columns(name)
+
+    for i, token in enumerate(tokens):
+        if i in tables or not _is_name(token):
+            continue
+        following = texts[i + 1] if i + 1 < len(tokens) else ''
+        previous = texts[i - 1].lower() if i else ''
+        if following in ('(', '.') or previous == '::':
+            continue
+        name = _name(token)
+        if name in columns or name in defined or name in known_tables:
+            continue
+        if previous == '.' and _name(tokens[i - 2]) in defined - referenced:
+            # Output column of a CTE or subquery; those are not tracked
+            continue
+        if token[0] == 'quoted' and previous in _COMPARISON_OPS:
+            # "Vietnam" as a value (MySQL style) would be a column reference in PostgreSQL
+            texts[i] = "'" + _unquote(token[1]).replace("'", "''") + "'"
+            repairs.append(f"{token[1]} -> {texts[i]}")
+            continue
+        match = typo_match(name, columns)
+        if match:
+            repairs.append(f"column {token[1]} -> {match}")
+            texts[i] = match
+            continue
+        suggestions = _closest(name, columns, SQL_VALIDATION_CONFIG['max_suggestions'])
+        hint = f" (did you mean {', '.join(suggestions)}?)" if suggestions else ""
+        errors.append(f"Unknown column {token[1]}{hint}")
+
+    return _result(join_tokens(texts) if repairs else statement, errors, repairs)
+
+# Regression check over the stored gold SQL: apart from dropping prose around the statement,
+# a gold query may only be changed by a one-typo name fix. Gold queries referencing columns
+# the table does not have are listed as rejected; the LLM repair loop handles those.
+if __name__ == "__main__":
+    from utils.example_utils import load_gold_examples
+
+    counts = {'unchanged': 0, 'typo fixed': 0, 'rejected': 0, 'rewritten': 0}
+    for table_name, examples in load_gold_examples().items():
+        for example in examples:
+            result = validate_sql(example['query'], table_name)
+            before = tokenize_sql(extract_sql_statement(example['query']) or '')
+            after = tokenize_sql(result['sql'] or '')
+            changed = [(old, new) for old, new in zip(before, after) if old != new]
+            if not result['valid']:
+                status = 'rejected'
+            elif len(before) == len(after) and not changed:
+                status = 'unchanged'
+            elif len(before) == len(after) and all(typo_match(_name(old), {_name(new)}) for old, new in changed):
+                status = 'typo fixed'
+            else:
+                status = 'rewritten'
+            counts[status] += 1
+            if status != 'unchanged':
+                print(f"{status}: {table_name}: {example['question']}\n    {example['query']}\n    -> {result['sql']} {result['errors']}")
+    print(', '.join(f"{count} {status}" for status, count in counts.items()))
+    sys.exit(1 if counts['rewritten'] else 0)